@@ -0,0 +1,6 @@
+'''
+Herramientas de apoyo para el análisis del departamento analítico de Y.Afisha.
+
+El análisis narrativo vive en `proyecto_7_depto_analitico.py`; este paquete reúne
+las funciones que lo hacen escalar a registros del servidor de varios GB.
+'''
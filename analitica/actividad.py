@@ -0,0 +1,280 @@
+'''
+Usuarios activos por día, semana ISO y mes (con su año) y en ventanas móviles, a partir de
+un solo ordenamiento de las visitas.
+
+El informe del producto agrupaba por `session_week` (sólo el número de semana ISO) y por
+`session_month` (sólo el número de mes), así que la semana 22 de 2017 y la de 2018 caían
+en el mismo grupo, y cada métrica era un `groupby().nunique()` distinto sobre todo el
+registro. Aquí las visitas se ordenan una vez por (usuario/a, día) y se descartan los pares
+repetidos; dentro de cada usuario/a los días quedan en orden, así que la semana y el mes
+tampoco bajan y un par cuenta para su periodo si su usuario/a o su periodo cambian respecto
+al par anterior. Los conteos por periodo y los usuarios activos en los últimos 7 y 30 días
+de cada día salen de recorrer esos pares una vez con `np.bincount`.
+
+Las semanas se identifican por su lunes y los meses por su primer día, de modo que las
+claves ya incluyen el año.
+'''
+import numpy as np
+import pandas as pd
+
+from analitica.calendario import MONTH_DTYPE, month_start
+from analitica.sesiones import NS_PER_DAY, civil_from_days
+from analitica.usuarios import CODE_DTYPE
+
+
+# ventanas móviles por defecto, en días
+WINDOWS = (7, 30)
+
+
+def visit_days(start_ts):
+    '''
+    Función que devuelve el día (días desde 1970-01-01) de cada hora de inicio.
+    '''
+    return np.asarray(start_ts, dtype='datetime64[ns]').view(np.int64) // NS_PER_DAY
+
+
+def week_starts(days):
+    '''
+    Función que devuelve el lunes (días desde 1970-01-01) de la semana ISO de cada día.
+    '''
+    # el 1970-01-01 fue jueves; weekday 0 es lunes
+    return days - (days + 3) % 7
+
+
+def day_months(days):
+    '''
+    Función que devuelve el código de mes (`analitica.calendario`) de cada día.
+    '''
+    year, month, _ = civil_from_days(days)
+    return (year * 12 + month - 1).astype(MONTH_DTYPE)
+
+
+def activity_pairs(days, users):
+    '''
+    Función que devuelve los pares (usuario/a, día) distintos, ordenados por usuario/a y día.
+    Si los códigos de usuario/a caben junto con el día en un int64 (los códigos int32 de
+    `analitica.usuarios`) se ordena una sola llave; si no (los `uid`), se usa `np.lexsort`.
+    '''
+    days = np.asarray(days, dtype=np.int64)
+    users = np.asarray(users)
+    if not len(days):
+        return users[:0], days
+    first = days.min()
+    span = days.max() - first + 1
+    if np.issubdtype(users.dtype, np.signedinteger) and users.max() < np.iinfo(np.int64).max // span:
+        keys = np.sort(users.astype(np.int64) * span + (days - first))
+        keep = np.ones(len(keys), dtype=bool)
+        keep[1:] = keys[1:] != keys[:-1]
+        user, day = np.divmod(keys[keep], span)
+        return user, day + first
+    order = np.lexsort((days, users))
+    user, day = users[order], days[order]
+    keep = np.ones(len(order), dtype=bool)
+    keep[1:] = (user[1:] != user[:-1]) | (day[1:] != day[:-1])
+    return user[keep], day[keep]
+
+
+def _dates(days):
+    return (np.asarray(days, dtype=np.int64) * NS_PER_DAY).view('datetime64[ns]')
+
+
+def _changes(user, period):
+    # primer par de cada (usuario/a, periodo) en los pares ordenados por usuario/a y día
+    new = np.ones(len(user), dtype=bool)
+    new[1:] = (user[1:] != user[:-1]) | (period[1:] != period[:-1])
+    return new
+
+
+def _period_counts(periods):
+    # número de pares por periodo, sólo de los periodos con pares, en orden
+    first = periods.min()
+    counts = np.bincount(periods - first)
+    present = np.flatnonzero(counts)
+    return present + first, counts[present]
+
+
+def rolling_active(user, day, window, first, n_days):
+    '''
+    Función que cuenta, para cada uno de los `n_days` días desde `first`, los usuarios/as con
+    alguna visita en los `window` días que terminan en ese día. Cada par (usuario/a, día)
+    cubre los días [día, día + window); sólo se suma la parte que no cubría ya el par
+    anterior del mismo usuario/a, así que cada usuario/a cuenta una vez por día.
+    '''
+    start = day.copy()
+    same = user[1:] == user[:-1]
+    start[1:][same] = np.maximum(day[1:][same], day[:-1][same] + window)
+    size = n_days + window
+    delta = np.bincount(start - first, minlength=size) - np.bincount(day + window - first, minlength=size)
+    return np.cumsum(delta)[:n_days]
+
+
+def active_users(start_ts, users, windows=WINDOWS):
+    '''
+    Función que calcula, a partir de la hora de inicio y del usuario/a (código o `uid`) de
+    cada visita, los usuarios únicos por día, por semana ISO y por mes, y los usuarios
+    activos en las ventanas móviles de `windows` días que terminan en cada día. Devuelve
+    un diccionario con:
+
+        daily    Series por `session_date`, sólo los días con visitas
+        weekly   Series por `session_week` (el lunes de la semana)
+        monthly  Series por `session_month` (el primer día del mes)
+        rolling  DataFrame con una columna `active_{n}d` por ventana, para todos los días
+                 entre la primera y la última visita
+    '''
+    user, day = activity_pairs(visit_days(start_ts), users)
+    tables = {}
+    for name, index_name, periods, to_dates in (('daily', 'session_date', day, _dates),
+                                                 ('weekly', 'session_week', week_starts(day), _dates),
+                                                 ('monthly', 'session_month', day_months(day), month_start)):
+        keys, counts = _period_counts(periods[_changes(user, periods)])
+        tables[name] = pd.Series(counts, index=pd.DatetimeIndex(to_dates(keys), name=index_name), name='uid')
+
+    first = day.min()
+    n_days = int(day.max() - first + 1)
+    dates = pd.DatetimeIndex(_dates(first + np.arange(n_days)), name='session_date')
+    tables['rolling'] = pd.DataFrame({f'active_{window}d': rolling_active(user, day, window, first, n_days)
+                                      for window in windows}, index=dates)
+    return tables
+
+
+# ventanas de los usuarios activos de los últimos días (R7 y R28)
+TRAILING_WINDOWS = (7, 28)
+
+# último día de los/las usuarios/as sin visitas todavía
+_NEVER = np.iinfo(np.int64).min // 2
+
+
+def trailing_table(dau, active):
+    '''
+    Función que une los usuarios únicos de cada día (`dau`, sólo los días con visitas) y
+    los activos en cada ventana (`active`, con las columnas `active_{n}d`) en una tabla por
+    día con el factor de adherencia `sticky_{n}d` = DAU / activos en los últimos n días.
+    '''
+    table = pd.DataFrame({'dau': dau.reindex(active.index, fill_value=0).to_numpy(dtype=np.int64)},
+                         index=active.index)
+    for column in active.columns:
+        table[column] = active[column].to_numpy(dtype=np.int64)
+    for column in active.columns:
+        table['sticky_' + column.split('_')[1]] = table['dau'] / table[column]
+    return table
+
+
+def _check_codes(users):
+    # códigos densos de usuario/a: enteros con signo entre 0 y el máximo de CODE_DTYPE
+    users = np.asarray(users)
+    if not np.issubdtype(users.dtype, np.signedinteger):
+        raise ValueError(f'se esperaban códigos enteros de usuario/a y se recibió {users.dtype}; '
+                        'los uid se codifican con analitica.usuarios.UidDictionary.build()')
+    if len(users) and (users.min() < 0 or users.max() > np.iinfo(CODE_DTYPE).max):
+        raise ValueError(f'los códigos de usuario/a tienen que estar entre 0 y {np.iinfo(CODE_DTYPE).max} '
+                         f'(se recibieron de {users.min()} a {users.max()}); '
+                         'los uid se codifican con analitica.usuarios.UidDictionary.build()')
+    return users
+
+
+class TrailingActiveUsers:
+    '''
+    Usuarios activos en los últimos días (R7, R28, ...) actualizados día a día.
+
+    Se guarda el último día con visitas de cada usuario/a (`last_seen`, por código int32
+    de `analitica.usuarios`) y cuántos/as usuarios/as tienen cada día como último
+    (`last_counts`). Al pasar al día siguiente, de cada ventana salen los/las que tenían
+    como último el día que la deja; al procesar las visitas del día, cada usuario/a deja
+    su día anterior y entra en el nuevo. Cada visita se toca una vez, así que la serie
+    completa cuesta O(filas) y no O(días × filas).
+
+    Los bloques tienen que llegar en orden de fecha (por ejemplo, las particiones diarias
+    de `analitica.particiones` o el almacén de `analitica.almacen`, ordenado por inicio);
+    un bloque puede empezar en el último día del anterior.
+    '''
+
+    def __init__(self, windows=TRAILING_WINDOWS):
+        self.windows = tuple(windows)
+        self.last_seen = np.empty(0, dtype=np.int64)
+        self.last_counts = np.empty(0, dtype=np.int64)
+        self.first = None
+        self.day = None
+        self.active = dict.fromkeys(self.windows, 0)
+        self._today = np.empty(0, dtype=np.int64)
+        self._rows = []
+
+    def _grow(self, n_users, day):
+        if n_users > len(self.last_seen):
+            extra = np.full(n_users - len(self.last_seen), _NEVER, dtype=np.int64)
+            self.last_seen = np.concatenate([self.last_seen, extra])
+        if day - self.first >= len(self.last_counts):
+            size = max(day - self.first + 1, 2 * len(self.last_counts))
+            self.last_counts = np.concatenate([self.last_counts,
+                                               np.zeros(size - len(self.last_counts), dtype=np.int64)])
+
+    def _close(self):
+        # guarda la fila del día actual
+        self._rows.append((self.day, len(self._today), *(self.active[window] for window in self.windows)))
+
+    def _advance(self, day):
+        # pasa del día actual a `day`, cerrando los días intermedios sin visitas
+        while self.day < day:
+            self._close()
+            self.day += 1
+            self._today = np.empty(0, dtype=np.int64)
+            for window in self.windows:
+                leaving = self.day - window - self.first
+                if leaving >= 0:
+                    self.active[window] -= self.last_counts[leaving]
+
+    def _enter(self, users):
+        # los/las usuarios/as (distintos/as, sin contar los/las ya vistos/as hoy) del día actual
+        users = np.setdiff1d(users, self._today, assume_unique=True)
+        previous = self.last_seen[users]
+        for window in self.windows:
+            self.active[window] += len(users) - int((previous > self.day - window).sum())
+        np.subtract.at(self.last_counts, previous[previous != _NEVER] - self.first, 1)
+        self.last_counts[self.day - self.first] += len(users)
+        self.last_seen[users] = self.day
+        self._today = np.union1d(self._today, users)
+
+    def update(self, days, users):
+        '''
+        Procesa un bloque de visitas a partir de su día (días desde 1970-01-01, ver
+        `visit_days()`) y del código de su usuario/a. Los códigos tienen que ser enteros
+        densos (los de `analitica.usuarios.UidDictionary`): `last_seen` tiene una posición
+        por código, así que con los `uid` pediría un arreglo de 2**64 posiciones.
+        '''
+        users = _check_codes(users)
+        user, day = activity_pairs(days, users)
+        if not len(day):
+            return self
+        order = np.argsort(day, kind='stable')
+        user, day = user[order], day[order]
+        if self.first is None:
+            self.first = self.day = int(day[0])
+        if day[0] < self.day:
+            raise ValueError(f'el bloque empieza en el día {day[0]}, anterior al día actual {self.day}')
+        self._grow(int(user.max()) + 1, int(day[-1]))
+        bounds = np.flatnonzero(np.diff(day)) + 1
+        for block in np.split(np.arange(len(day)), bounds):
+            self._advance(int(day[block[0]]))
+            self._enter(user[block])
+        return self
+
+    def frame(self):
+        '''
+        Devuelve la serie por día (desde el primero hasta el actual, incluidos los días sin
+        visitas) del DAU, los activos en cada ventana y el factor de adherencia.
+        '''
+        rows = self._rows + ([(self.day, len(self._today), *(self.active[w] for w in self.windows))]
+                             if self.day is not None else [])
+        columns = ['day', 'dau'] + [f'active_{window}d' for window in self.windows]
+        data = pd.DataFrame(rows, columns=columns, dtype=np.int64)
+        index = pd.DatetimeIndex(_dates(data.pop('day')), name='session_date')
+        data.index = index
+        return trailing_table(data.pop('dau'), data)
+
+
+def trailing_active_users(start_ts, users, windows=TRAILING_WINDOWS):
+    '''
+    Función que calcula, con `TrailingActiveUsers`, el DAU, los activos en los últimos días
+    de cada ventana y el factor de adherencia diario de todas las visitas; `users` son los
+    códigos de usuario/a de `analitica.usuarios`.
+    '''
+    return TrailingActiveUsers(windows).update(visit_days(start_ts), users).frame()
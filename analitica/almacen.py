@@ -0,0 +1,168 @@
+'''
+Almacén binario de las sesiones, de ancho fijo y por columnas, que se abre con `mmap`.
+
+Cada vez que se vuelve a ejecutar el informe del producto se lee y se interpreta de nuevo
+`visits_log_us` (o su caché Parquet, que también hay que descomprimir). `build_store()`
+escribe una sola vez las visitas, ordenadas por la hora de inicio, como un archivo `.npy`
+por columna:
+
+    user.npy       código int32 de cada usuario/a (`analitica.usuarios`)
+    uids.npy       diccionario de `uid` (uint64, ordenados) de esos códigos
+    start.npy      inicio de la sesión en nanosegundos desde 1970 (int64)
+    end.npy        fin de la sesión en nanosegundos desde 1970 (int64)
+    device.npy     código int16 del dispositivo
+    source_id.npy  código int16 de la fuente de anuncios
+
+y `meta.json` con las categorías de los códigos, la versión del formato (`STORE_FORMAT`) y
+el tamaño, la fecha y el hash del CSV de origen (el almacén se reconstruye cuando cambia el
+CSV o el formato, como la caché de `analitica.carga`).
+
+`SessionStore.open()` abre los archivos con `np.load(mmap_mode='r')`: no se copia ni se
+interpreta nada, las columnas son vistas de sólo lectura de las páginas del archivo y
+varios procesos que abren el mismo almacén comparten esas páginas en la caché del sistema.
+El orden por hora de inicio es estable, así que entre sesiones a la misma hora se conserva
+el orden del CSV.
+
+Uso:
+    python -m analitica.almacen --visits /datasets/visits_log_us.csv --store files/cache/sesiones
+'''
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from analitica.carga import CACHE_DIR, _cache_is_valid, _source_stat, file_hash, read_csv_typed
+from analitica.usuarios import UidDictionary
+
+
+# directorio por defecto del almacén de sesiones
+STORE_DIR = os.path.join(CACHE_DIR, 'sesiones')
+
+# columnas del almacén y su tipo de datos
+COLUMNS = {'user': np.int32, 'start': np.int64, 'end': np.int64, 'device': np.int16, 'source_id': np.int16}
+
+# versión del formato del almacén; cambia cada vez que cambian sus columnas
+STORE_FORMAT = 2
+
+_META = 'meta.json'
+
+
+def _codes(values):
+    # códigos int16 y categorías ordenadas con su tipo (textos o, las fuentes, enteros)
+    values = pd.Series(values).astype('category')
+    limit = np.iinfo(np.int16).max + 1
+    if len(values.cat.categories) > limit:
+        raise ValueError(f'la columna {values.name} tiene {len(values.cat.categories)} valores distintos; '
+                         f'el almacén guarda códigos int16 (hasta {limit})')
+    return values.cat.codes.to_numpy(dtype=np.int16), values.cat.categories.tolist()
+
+
+def build_store(path, store_dir=STORE_DIR):
+    '''
+    Función que escribe el almacén de sesiones del CSV de visitas `path` en `store_dir`.
+    Se escribe primero en un directorio temporal para no dejar un almacén a medias.
+    '''
+    visits = read_csv_typed(path, table='visits_log_us')
+    start = visits['Start Ts'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    order = np.argsort(start, kind='stable')
+    dictionary, (users,) = UidDictionary.build(visits['Uid'].to_numpy()[order])
+    devices, device_names = _codes(visits['Device'])
+    sources, source_names = _codes(visits['Source Id'])
+    columns = {'user': users, 'start': start[order],
+               'end': visits['End Ts'].to_numpy(dtype='datetime64[ns]').view(np.int64)[order],
+               'device': devices[order], 'source_id': sources[order]}
+
+    tmp_dir = store_dir.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, dtype in COLUMNS.items():
+        np.save(os.path.join(tmp_dir, name + '.npy'), np.ascontiguousarray(columns[name], dtype=dtype))
+    np.save(os.path.join(tmp_dir, 'uids.npy'), dictionary.uids)
+    meta = _source_stat(path)
+    meta.update(format=STORE_FORMAT, sha256=file_hash(path), rows=len(visits),
+                devices=device_names, sources=source_names)
+    with open(os.path.join(tmp_dir, _META), 'w') as f:
+        json.dump(meta, f)
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(tmp_dir, store_dir)
+    return store_dir
+
+
+class SessionStore:
+    '''
+    Columnas de las visitas abiertas con `mmap`, ordenadas por hora de inicio. `user`,
+    `start`, `end`, `device` y `source_id` son arreglos de NumPy de sólo lectura.
+    '''
+
+    def __init__(self, columns, dictionary, devices, sources):
+        for name, values in columns.items():
+            setattr(self, name, values)
+        self.dictionary = dictionary
+        self.devices = devices
+        self.sources = sources
+
+    def __len__(self):
+        return len(self.start)
+
+    @classmethod
+    def open(cls, store_dir=STORE_DIR):
+        '''
+        Abre un almacén escrito con `build_store()` sin leer su contenido.
+        '''
+        with open(os.path.join(store_dir, _META)) as f:
+            meta = json.load(f)
+        columns = {name: np.load(os.path.join(store_dir, name + '.npy'), mmap_mode='r') for name in COLUMNS}
+        dictionary = UidDictionary(np.load(os.path.join(store_dir, 'uids.npy'), mmap_mode='r'))
+        return cls(columns, dictionary, meta['devices'], meta['sources'])
+
+    def frame(self, columns=('device', 'end_ts', 'source_id', 'start_ts', 'uid')):
+        '''
+        Devuelve las visitas como un DataFrame con los nombres de columna de
+        `analitica.pipeline`. Las fechas son vistas datetime64 de las columnas del archivo y
+        el dispositivo es category sobre sus códigos; la fuente y `uid` se decodifican (la
+        fuente como int64, igual que al cargar el CSV).
+        '''
+        builders = {
+            'device': lambda: pd.Categorical.from_codes(self.device, self.devices),
+            'end_ts': lambda: self.end.view('datetime64[ns]'),
+            'source_id': lambda: np.asarray(self.sources, dtype=np.int64)[self.source_id],
+            'start_ts': lambda: self.start.view('datetime64[ns]'),
+            'uid': lambda: self.dictionary.decode(self.user),
+        }
+        return pd.DataFrame({name: builders[name]() for name in columns}, copy=False)
+
+
+def load_store(path, store_dir=STORE_DIR):
+    '''
+    Función que abre el almacén de sesiones del CSV `path`, construyéndolo si no existe, si
+    el archivo de origen cambió o si se escribió con otra versión del formato.
+    '''
+    if not _cache_is_valid(path, os.path.join(store_dir, _META), {'format': STORE_FORMAT}):
+        build_store(path, store_dir)
+    return SessionStore.open(store_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--visits', default='/datasets/visits_log_us.csv')
+    parser.add_argument('--store', default=STORE_DIR, help='directorio del almacén')
+    args = parser.parse_args()
+
+    from analitica import pipeline
+
+    begin = time.perf_counter()
+    store = load_store(args.visits, args.store)
+    opened = time.perf_counter()
+    metrics = pipeline.product(store.frame(), store.user)
+    print(f'{len(store)} sesiones abiertas en {opened - begin:.3f} s, '
+          f'informe del producto en {time.perf_counter() - opened:.3f} s')
+    for name in ('dau_total', 'wau_total', 'mau_total', 'sticky_wau', 'sticky_mau'):
+        print(f'  {name:<10} {metrics[name]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+'''
+Atribución de los costos de marketing a las cohortes de primer pedido por fuente de adquisición.
+
+Antes los costos diarios (`costs_us`) se unían con el reporte por la fecha del primer día
+del mes del pedido (`order_month == dt`), de modo que sólo se contaba el gasto del día 1 de
+cada mes, y la unión repetía cada fila del reporte por fuente. Aquí:
+
+    1. los costos se agregan por (mes, source_id) en una pasada (`monthly_costs`);
+    2. cada comprador/a se atribuye a la fuente de su primera sesión (`acquisition_sources`)
+       y se cuentan los/las compradores/as por (mes del primer pedido, fuente)
+       (`cohort_sources`);
+    3. con las dos tablas como matrices densas meses × fuentes se calculan el CAC por
+       cohorte y fuente, el CAC por fuente y el CAC y el ROMI de cada fila del reporte
+       (`attribute_costs`), por posición y sin `merge`.
+
+Los meses son códigos enteros de `analitica.calendario` y las fuentes se guardan como
+enteros (`source_id`).
+'''
+import numpy as np
+import pandas as pd
+
+from analitica.calendario import MONTH_DTYPE, month_codes, month_start
+from analitica.usuarios import first_per_user, has_rows
+
+
+def _source_ids(values):
+    # las fuentes se comparan como enteros aunque lleguen como category
+    return np.asarray(pd.Series(values).astype('int64'))
+
+
+def _grid(months, sources, values, first_month, n_months, axis):
+    # matriz densa meses × fuentes con la suma de `values` en cada celda
+    cells = (np.asarray(months, dtype=np.int64) - first_month) * len(axis) + np.searchsorted(axis, sources)
+    totals = np.bincount(cells, weights=values, minlength=n_months * len(axis))
+    if values is not None:
+        # sin celdas np.bincount devuelve enteros aunque haya pesos
+        totals = totals.astype(np.float64)
+    return totals.reshape(n_months, len(axis))
+
+
+def monthly_costs(costs):
+    '''
+    Función que suma los costos de `costs_us` (columnas `dt`, `source_id`, `costs`) por mes
+    y fuente. Devuelve una tabla con las columnas `month`, `source_id` y `costs`.
+    '''
+    months = month_codes(costs['dt'].to_numpy())
+    sources = _source_ids(costs['source_id'])
+    axis = np.unique(sources)
+    first_month = int(months.min()) if len(months) else 0
+    n_months = int(months.max()) - first_month + 1 if len(months) else 0
+    spend = _grid(months, sources, costs['costs'].to_numpy(dtype=np.float64), first_month, n_months, axis)
+    counts = _grid(months, sources, None, first_month, n_months, axis)
+    month, source = np.nonzero(counts)
+    return pd.DataFrame({'month': (first_month + month).astype(MONTH_DTYPE),
+                         'source_id': axis[source],
+                         'costs': spend[month, source]})
+
+
+def first_session_rows(visits, visit_users, n_users):
+    '''
+    Función que devuelve, por código de usuario/a (`analitica.usuarios`), la posición de la
+    fila de su primera sesión (resultado de `first_per_user`, ver `has_rows`). Si hay varias
+    sesiones a la misma hora se toma la primera fila, como `idxmin`.
+    '''
+    start = visits['start_ts'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    first = first_per_user(visit_users, start, n_users)
+    rows = np.flatnonzero(start == first[visit_users])
+    return first_per_user(visit_users[rows], rows, n_users)
+
+
+def acquisition_sources(visits, visit_users, n_users):
+    '''
+    Función que devuelve, por código de usuario/a (`analitica.usuarios`), la fuente de su
+    primera sesión; -1 para los/las usuarios/as sin visitas.
+    '''
+    first_row = first_session_rows(visits, visit_users, n_users)
+    seen = has_rows(first_row)
+    sources = np.full(n_users, -1, dtype=np.int64)
+    sources[seen] = _source_ids(visits['source_id'].iloc[first_row[seen]])
+    return sources
+
+
+def cohort_sources(first_order, sources):
+    '''
+    Función que cuenta los/las compradores/as por mes del primer pedido y fuente de
+    adquisición, a partir de los arreglos por código de usuario/a `first_order` (resultado
+    de `first_per_user`) y `sources` (resultado de `acquisition_sources`). Los/las
+    compradores/as sin visitas no se atribuyen a ninguna fuente.
+    '''
+    buyers = np.flatnonzero(has_rows(first_order) & (sources >= 0))
+    months, buyer_sources = first_order[buyers], sources[buyers]
+    axis = np.unique(buyer_sources)
+    first_month = int(months.min()) if len(months) else 0
+    n_months = int(months.max()) - first_month + 1 if len(months) else 0
+    counts = _grid(months, buyer_sources, None, first_month, n_months, axis)
+    month, source = np.nonzero(counts)
+    return pd.DataFrame({'first_order_month': (first_month + month).astype(MONTH_DTYPE),
+                         'source_id': axis[source],
+                         'n_buyers': counts[month, source].astype(np.int64)})
+
+
+def attribute_costs(report, cohort_sources, monthly_costs):
+    '''
+    Función que atribuye los costos de cada mes y fuente a la cohorte de ese mes de primer
+    pedido. Devuelve un diccionario con:
+
+        report_with_costs  el reporte con los costos del mes de la cohorte (`costs`), el CAC
+                           de la cohorte (`cac`) y el ROMI de cada edad (`romi`)
+        cohort_cac         compradores/as, costos y CAC por cohorte y fuente
+        cac_by_source      costos totales de cada fuente entre sus compradores/as
+    '''
+    months = np.concatenate([report['first_order_month'], cohort_sources['first_order_month'],
+                             monthly_costs['month']]).astype(np.int64)
+    first_month = int(months.min()) if len(months) else 0
+    n_months = int(months.max()) - first_month + 1 if len(months) else 0
+    axis = np.union1d(cohort_sources['source_id'], monthly_costs['source_id'])
+    buyers = _grid(cohort_sources['first_order_month'], cohort_sources['source_id'],
+                   cohort_sources['n_buyers'].to_numpy(dtype=np.float64), first_month, n_months, axis)
+    spend = _grid(monthly_costs['month'], monthly_costs['source_id'],
+                  monthly_costs['costs'].to_numpy(dtype=np.float64), first_month, n_months, axis)
+    # las celdas (y los meses, y las fuentes) sin ningún registro de costos quedan en NaN, no en 0
+    present = _grid(monthly_costs['month'], monthly_costs['source_id'], None, first_month, n_months, axis) > 0
+    spend[~present] = np.nan
+
+    month, source = np.nonzero(buyers)
+    cohort_cac = pd.DataFrame({'first_order_month': (first_month + month).astype(MONTH_DTYPE),
+                               'source_id': axis[source],
+                               'n_buyers': buyers[month, source].astype(np.int64),
+                               'costs': spend[month, source]})
+    cohort_cac['cac'] = cohort_cac['costs'] / cohort_cac['n_buyers']
+
+    source_buyers = buyers.sum(axis=0)
+    source_cac = np.divide(np.nansum(spend, axis=0), source_buyers, out=np.full(len(axis), np.nan),
+                           where=(source_buyers > 0) & present.any(axis=0))
+    cac_by_source = pd.Series(source_cac, index=pd.Index(axis, name='source_id'), name='cac')
+
+    # los costos de la cohorte se buscan por la posición de su mes en la matriz
+    report_with_costs = report.copy()
+    position = report['first_order_month'].to_numpy(dtype=np.int64) - first_month
+    month_spend = np.where(present.any(axis=1), np.nansum(spend, axis=1), np.nan)
+    report_with_costs['costs'] = month_spend[position]
+    report_with_costs['cac'] = report_with_costs['costs'] / report_with_costs['n_buyers']
+    report_with_costs['romi'] = report_with_costs['ltv'] / report_with_costs['cac']
+    return {
+        'report_with_costs': report_with_costs,
+        'cohort_cac': cohort_cac,
+        'cac_by_source': cac_by_source.sort_values(ascending=False),
+    }
+
+
+def costs_by_month(monthly_costs):
+    '''
+    Función que devuelve los costos totales de cada mes (indexados por el primer día del mes),
+    de mayor a menor.
+    '''
+    totals = monthly_costs.groupby('month')['costs'].sum()
+    totals.index = month_start(totals.index).rename('month')
+    return totals.sort_values(ascending=False)
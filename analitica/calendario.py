@@ -0,0 +1,73 @@
+'''
+Calendario de cohortes con meses representados como códigos enteros.
+
+Un mes se representa con el código `año * 12 + (mes - 1)`, de modo que la edad de una
+cohorte es una resta de enteros y el año y el mes se recuperan con `divmod(código, 12)`.
+Así se evita `astype('datetime64[M]')` y la división entre `np.timedelta64(1, 'M')`,
+que es aproximada y ya no está soportada en las versiones recientes de pandas.
+
+Las fechas sólo se reconstruyen para mostrar las tablas (`month_start()`).
+'''
+import numpy as np
+import pandas as pd
+
+
+# código del mes de enero de 1970, el origen de datetime64 en NumPy
+EPOCH_CODE = 1970 * 12
+
+MONTH_DTYPE = np.int32
+
+
+def month_codes(timestamps):
+    '''
+    Función que convierte fechas (Series, índice o arreglo datetime64) a códigos de mes.
+    '''
+    values = np.asarray(timestamps, dtype='datetime64[ns]').astype('datetime64[M]')
+    codes = values.astype(np.int64) + EPOCH_CODE
+    if isinstance(timestamps, pd.Series):
+        return pd.Series(codes.astype(MONTH_DTYPE), index=timestamps.index, name=timestamps.name)
+    return codes.astype(MONTH_DTYPE)
+
+
+def month_code(year, month):
+    '''
+    Función que devuelve el código de un mes a partir del año y del número de mes.
+    '''
+    return year * 12 + (month - 1)
+
+
+def split_codes(codes):
+    '''
+    Función que devuelve el año y el número de mes (1-12) de cada código.
+    '''
+    year, month = np.divmod(np.asarray(codes), 12)
+    return year, month + 1
+
+
+def month_start(codes):
+    '''
+    Función que convierte códigos de mes a la fecha del primer día de cada mes.
+    Conserva el tipo de entrada: Series, índice o arreglo.
+    '''
+    values = (np.asarray(codes, dtype=np.int64) - EPOCH_CODE).astype('datetime64[M]').astype('datetime64[ns]')
+    if isinstance(codes, pd.Series):
+        return pd.Series(values, index=codes.index, name=codes.name)
+    if isinstance(codes, pd.Index):
+        return pd.DatetimeIndex(values, name=codes.name)
+    return values
+
+
+def month_start_days(codes):
+    '''
+    Función que devuelve el número de días desde 1970-01-01 hasta el inicio de cada mes.
+    '''
+    return (np.asarray(codes, dtype=np.int64) - EPOCH_CODE).astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+
+
+def with_month_index(table):
+    '''
+    Función que convierte a fechas el índice de códigos de mes de una tabla, para mostrarla.
+    '''
+    table = table.copy()
+    table.index = month_start(table.index)
+    return table
@@ -0,0 +1,191 @@
+'''
+Carga de los registros de Y.Afisha con una caché columnar en Parquet.
+
+La primera vez que se lee un CSV se convierte a Parquet con los tipos de datos
+correctos (uid como uint64, Device como category, source_id como int64, para que
+las fuentes se ordenen como números, y las fechas como datetime64). Las siguientes ejecuciones leen la caché y sólo las columnas que se
+piden, sin volver a interpretar las fechas del CSV.
+
+La caché se invalida cuando cambia el archivo de origen: primero se compara el
+tamaño y la fecha de modificación y, si no coinciden, se calcula el hash del
+contenido para decidir si realmente hay que reconstruirla. El nombre de la caché lleva
+un hash de la ruta absoluta del CSV (dos CSV con el mismo nombre en directorios
+distintos no comparten caché) y los metadatos guardan la tabla y su esquema: si cambia
+`SCHEMAS` o se lee el archivo como otra tabla, la caché se reconstruye.
+'''
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:  # sin pyarrow se lee directamente el CSV
+    pyarrow = None
+
+
+# directorio por defecto para guardar la caché
+CACHE_DIR = 'files/cache'
+
+# tipos de datos de cada archivo; las fechas se indican por separado
+SCHEMAS = {
+    'visits_log_us': {
+        'dtypes': {'Uid': 'uint64', 'Device': 'category', 'Source Id': 'int64'},
+        'dates': ['Start Ts', 'End Ts'],
+    },
+    'orders_log_us': {
+        'dtypes': {'Uid': 'uint64', 'Revenue': 'float64'},
+        'dates': ['Buy Ts'],
+    },
+    'costs_us': {
+        'dtypes': {'source_id': 'int64', 'costs': 'float64'},
+        'dates': ['dt'],
+    },
+}
+
+# tamaño del bloque para calcular el hash del archivo
+_HASH_BLOCK = 1 << 20
+
+
+def file_hash(path):
+    '''
+    Función que calcula el hash sha256 del contenido de un archivo leyéndolo por bloques.
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _table_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _source_stat(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _schema(path, table=None):
+    # esquema de `table` o, si no se indica, el del nombre del archivo
+    return SCHEMAS.get(table or _table_name(path), {'dtypes': {}, 'dates': []})
+
+
+def read_csv_typed(path, columns=None, table=None, **kwargs):
+    '''
+    Función que lee un CSV de Y.Afisha con los tipos de datos de `SCHEMAS`.
+    Si se indican `columns` sólo se leen esas columnas. El esquema se elige por el
+    nombre del archivo, salvo que se indique la tabla con `table`.
+    '''
+    schema = _schema(path, table)
+    dtypes = schema['dtypes']
+    dates = schema['dates']
+    if columns is not None:
+        dtypes = {col: kind for col, kind in dtypes.items() if col in columns}
+        dates = [col for col in dates if col in columns]
+        kwargs['usecols'] = columns
+    return pd.read_csv(path, dtype=dtypes, parse_dates=dates, **kwargs)
+
+
+def cache_paths(path, cache_dir=CACHE_DIR):
+    '''
+    Función que devuelve las rutas del archivo Parquet y de sus metadatos para un CSV; el
+    nombre lleva un hash de la ruta absoluta del CSV.
+    '''
+    key = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:16]
+    name = f'{_table_name(path)}-{key}'
+    return (os.path.join(cache_dir, name + '.parquet'),
+            os.path.join(cache_dir, name + '.json'))
+
+
+def _cache_is_valid(path, meta_path, expected=None):
+    # `expected` son valores de los metadatos que tienen que coincidir (por ejemplo, el esquema)
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if any(meta.get(key) != value for key, value in (expected or {}).items()):
+        return False
+    stat = _source_stat(path)
+    if stat['size'] == meta['size'] and stat['mtime_ns'] == meta['mtime_ns']:
+        return True
+    # el archivo se tocó pero puede tener el mismo contenido
+    if stat['size'] != meta['size'] or file_hash(path) != meta['sha256']:
+        return False
+    meta.update(stat)
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    return True
+
+
+def build_cache(path, cache_dir=CACHE_DIR, table=None):
+    '''
+    Función que convierte un CSV a Parquet con los tipos correctos y guarda los metadatos
+    (tamaño, fecha de modificación y hash) del archivo de origen.
+    '''
+    parquet_path, meta_path = cache_paths(path, cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    data = read_csv_typed(path, table=table)
+    # se escribe primero en un archivo temporal para no dejar una caché a medias
+    tmp_path = parquet_path + '.tmp'
+    data.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, parquet_path)
+    meta = _source_stat(path)
+    meta['sha256'] = file_hash(path)
+    meta['columns'] = list(data.columns)
+    meta.update(_cache_key(path, table))
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    return parquet_path
+
+
+def _cache_key(path, table=None):
+    # tabla y esquema con que se construyó la caché
+    return {'table': table or _table_name(path), 'schema': _schema(path, table)}
+
+
+def cached_parquet(path, cache_dir=CACHE_DIR, table=None):
+    '''
+    Función que devuelve la ruta de la caché Parquet de un CSV si existe y está al día, o
+    None; a diferencia de `load_table()`, no la construye.
+    '''
+    if pyarrow is None or cache_dir is None:
+        return None
+    parquet_path, meta_path = cache_paths(path, cache_dir)
+    if os.path.exists(parquet_path) and _cache_is_valid(path, meta_path, _cache_key(path, table)):
+        return parquet_path
+    return None
+
+
+def load_table(path, columns=None, cache_dir=CACHE_DIR, table=None):
+    '''
+    Función que carga un CSV de Y.Afisha desde la caché Parquet, construyéndola si no existe
+    o si el archivo de origen cambió. Con `columns` sólo se leen las columnas indicadas.
+    '''
+    if pyarrow is None or cache_dir is None:
+        return read_csv_typed(path, columns=columns, table=table)
+    parquet_path = cached_parquet(path, cache_dir, table) or build_cache(path, cache_dir, table=table)
+    return pd.read_parquet(parquet_path, columns=columns)
+
+
+def load_visits(path='/datasets/visits_log_us.csv', columns=None, cache_dir=CACHE_DIR):
+    '''
+    Función que carga el registro de visitas.
+    '''
+    return load_table(path, columns=columns, cache_dir=cache_dir, table='visits_log_us')
+
+
+def load_orders(path='/datasets/orders_log_us.csv', columns=None, cache_dir=CACHE_DIR):
+    '''
+    Función que carga el registro de pedidos.
+    '''
+    return load_table(path, columns=columns, cache_dir=cache_dir, table='orders_log_us')
+
+
+def load_costs(path='/datasets/costs_us.csv', columns=None, cache_dir=CACHE_DIR):
+    '''
+    Función que carga los gastos de marketing.
+    '''
+    return load_table(path, columns=columns, cache_dir=cache_dir, table='costs_us')
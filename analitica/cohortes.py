@@ -0,0 +1,209 @@
+'''
+Tablas de cohortes del informe de ventas y de marketing: LTV y ROMI.
+
+Las funciones reciben las tablas intermedias del análisis (`cohort_sizes`, `cohorts`,
+`report_with_costs`) y devuelven las mismas tablas que se construyen en
+`proyecto_7_depto_analitico.py`, para poder obtenerlas también desde el modo incremental.
+Los costos se atribuyen a las cohortes con `analitica.atribucion`.
+
+Los meses (`first_order_month`, `order_month`) son códigos enteros de
+`analitica.calendario`, por lo que la edad de la cohorte es una resta de enteros.
+
+Las tablas cohorte × edad son triangulares: la cohorte de un mes sólo llega a las edades
+que caben hasta el último mes con datos y el resto de la tabla dinámica es NaN por
+construcción. `CohortMatrix` guarda sólo esas celdas, una fila de largo variable por
+cohorte empaquetada en un arreglo, y hace sobre ellas las sumas acumuladas por edad (LTV
+y ROMI acumulados), el mes de recuperación de la inversión, los recortes por cohorte o
+edad y la unión de dos matrices sin pasar por la tabla completa: las celdas de la edad `a`
+de cada fila están en `starts + a`. El DataFrame sólo se construye para mostrar la tabla.
+Las filas del reporte ya son únicas por (cohorte, edad), así que no hace falta volver a
+agruparlas con `pivot_table(aggfunc='mean')`.
+'''
+import numpy as np
+import pandas as pd
+
+from analitica.calendario import MONTH_DTYPE, month_codes, with_month_index
+
+
+def cohort_report(cohort_sizes, cohorts):
+    '''
+    Función que une el tamaño de cada cohorte con sus ganancias por mes y calcula la edad y el LTV.
+    '''
+    report = pd.merge(cohort_sizes, cohorts, on='first_order_month')
+    report['age'] = report['order_month'] - report['first_order_month']
+    report['ltv'] = report['revenue'] / report['n_buyers']
+    return report
+
+
+def _month_code(value):
+    # código de mes de un entero (ya es código) o de una fecha
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return int(month_codes(np.array([pd.Timestamp(value)], dtype='datetime64[ns]'))[0])
+
+
+class CohortMatrix:
+    '''
+    Valores por cohorte y edad en meses. La cohorte `first_month + i` tiene `lengths[i]`
+    edades (0, 1, ...) y sus valores son `values[starts[i]:starts[i] + lengths[i]]`; las
+    celdas sin dato dentro de una fila son NaN.
+    '''
+
+    def __init__(self, first_month, lengths, values, index_name='first_order_month'):
+        self.first_month = int(first_month)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.starts = np.concatenate([[0], np.cumsum(self.lengths)[:-1]]).astype(np.int64)
+        self.index_name = index_name
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @property
+    def n_ages(self):
+        return int(self.lengths.max()) if len(self.lengths) else 0
+
+    @classmethod
+    def from_cells(cls, cohorts, ages, values, last_month=None, index_name='first_order_month'):
+        '''
+        Construye la matriz a partir de celdas únicas (cohorte, edad, valor), por ejemplo
+        las filas del reporte. Cada cohorte llega hasta `last_month` (por omisión, el último
+        mes de las celdas).
+        '''
+        cohorts = np.asarray(cohorts, dtype=np.int64)
+        ages = np.asarray(ages, dtype=np.int64)
+        first_month = int(cohorts.min())
+        last_month = int((cohorts + ages).max()) if last_month is None else int(last_month)
+        lengths = last_month - np.arange(first_month, last_month + 1) + 1
+        matrix = cls(first_month, lengths, np.full(lengths.sum(), np.nan), index_name)
+        matrix.values[matrix.starts[cohorts - first_month] + ages] = values
+        return matrix
+
+    def _cells(self):
+        # fila y edad de cada valor
+        rows = np.repeat(np.arange(len(self)), self.lengths)
+        return rows, np.arange(len(self.values)) - self.starts[rows]
+
+    def dense(self):
+        '''
+        Devuelve la matriz como un arreglo cohortes × edades, con NaN fuera de las filas.
+        '''
+        grid = np.full((len(self), self.n_ages), np.nan)
+        grid[self._cells()] = self.values
+        return grid
+
+    def cumsum(self):
+        '''
+        Devuelve la suma acumulada por edad de cada cohorte (por ejemplo, el LTV o el ROMI
+        acumulado); las celdas sin dato cuentan como 0.
+        '''
+        values = np.nan_to_num(self.values)
+        # una pasada por edad: cada celda suma la anterior de su fila, en el mismo orden que
+        # np.cumsum por filas
+        for age in range(1, self.n_ages):
+            position = self.starts[self.lengths > age] + age
+            values[position] += values[position - 1]
+        # las cohortes sin ningún dato siguen sin datos
+        rows, _ = self._cells()
+        present = np.bincount(rows, weights=~np.isnan(self.values), minlength=len(self))
+        values[(present == 0)[rows]] = np.nan
+        return CohortMatrix(self.first_month, self.lengths, values, self.index_name)
+
+    def first_age(self, threshold):
+        '''
+        Devuelve, por cohorte, la primera edad cuyo valor llega a `threshold`; NaN si no llega.
+        '''
+        rows, ages = self._cells()
+        reached = self.values >= threshold
+        first = np.full(len(self), np.inf)
+        np.minimum.at(first, rows[reached], ages[reached])
+        first[np.isinf(first)] = np.nan
+        return pd.Series(first, index=self._index(), name='first_age')
+
+    def payback_age(self, threshold=1.0):
+        '''
+        Devuelve, por cohorte, la primera edad en la que la suma acumulada llega a
+        `threshold` (con el ROMI, el mes en que se recupera la inversión); NaN si no llega.
+        Si ya se tiene la suma acumulada, `cumsum().first_age(threshold)` evita repetirla.
+        '''
+        return self.cumsum().first_age(threshold).rename('payback_age')
+
+    def slice(self, first=None, last=None, max_age=None):
+        '''
+        Devuelve las cohortes entre `first` y `last` (incluidas; códigos de mes o fechas) y
+        sólo las edades menores que `max_age`.
+        '''
+        start = 0 if first is None else max(_month_code(first) - self.first_month, 0)
+        stop = len(self) if last is None else min(_month_code(last) - self.first_month + 1, len(self))
+        stop = max(stop, start)
+        lengths = self.lengths[start:stop]
+        if max_age is not None:
+            lengths = np.minimum(lengths, max(max_age, 0))
+        matrix = CohortMatrix(self.first_month + start, lengths, np.empty(lengths.sum()), self.index_name)
+        # cada fila recortada empieza donde empezaba en la matriz original
+        rows, ages = matrix._cells()
+        matrix.values = self.values[self.starts[start:stop][rows] + ages]
+        return matrix
+
+    def merge(self, other):
+        '''
+        Une dos matrices (por ejemplo, las ganancias de dos partes del registro): las celdas
+        que están en las dos se suman y las demás se conservan. La fila de cada cohorte llega
+        hasta la edad más lejana de las dos.
+        '''
+        first_month = min(self.first_month, other.first_month)
+        n_rows = max(self.first_month + len(self), other.first_month + len(other)) - first_month
+        lengths = np.zeros(n_rows, dtype=np.int64)
+        for matrix in (self, other):
+            offset = matrix.first_month - first_month
+            lengths[offset:offset + len(matrix)] = np.maximum(lengths[offset:offset + len(matrix)], matrix.lengths)
+        result = CohortMatrix(first_month, lengths, np.full(lengths.sum(), np.nan), self.index_name)
+        for matrix in (self, other):
+            rows, ages = matrix._cells()
+            target = result.starts[rows + matrix.first_month - first_month] + ages
+            current = result.values[target]
+            result.values[target] = np.where(np.isnan(current), matrix.values,
+                                             current + np.nan_to_num(matrix.values))
+        return result
+
+    def _index(self):
+        codes = pd.Index((self.first_month + np.arange(len(self))).astype(MONTH_DTYPE), name=self.index_name)
+        return with_month_index(pd.DataFrame(index=codes)).index
+
+    def to_frame(self):
+        '''
+        Devuelve la tabla cohortes × edades para mostrarla, como `pivot_table`: con las
+        cohortes como fechas y sin las filas ni las columnas que no tienen datos.
+        '''
+        frame = pd.DataFrame(self.dense(), index=self._index(),
+                             columns=pd.Index(np.arange(self.n_ages, dtype=MONTH_DTYPE), name='age'))
+        return frame.dropna(how='all').dropna(axis=1, how='all')
+
+
+def report_matrix(report, column):
+    '''
+    Función que guarda la columna `column` del reporte (`ltv`, `romi`, ...) como `CohortMatrix`.
+    '''
+    return CohortMatrix.from_cells(report['first_order_month'], report['age'], report[column])
+
+
+def ltv_table(report):
+    '''
+    Función que devuelve el LTV promedio por cohorte y por edad de la cohorte.
+    '''
+    return report_matrix(report, 'ltv').to_frame().round()
+
+
+def romi_table(report_with_costs):
+    '''
+    Función que devuelve el ROMI promedio por cohorte y por edad de la cohorte.
+    '''
+    return report_matrix(report_with_costs, 'romi').to_frame()
+
+
+def cumulative_table(report, column):
+    '''
+    Función que devuelve la suma acumulada por edad de la columna `column` del reporte
+    (LTV o ROMI acumulado) por cohorte.
+    '''
+    return report_matrix(report, column).cumsum().to_frame()
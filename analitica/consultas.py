@@ -0,0 +1,321 @@
+'''
+Backend fuera de memoria de las etapas del análisis, con consultas de DuckDB.
+
+Con cientos de millones de visitas el código de pandas ya no cabe en memoria: cada etapa
+carga todas las filas como columnas de NumPy. Aquí las mismas etapas (`product`,
+`conversion`, `ltv`, `acquisition`, `retention`) se expresan como consultas SQL sobre los registros que
+ejecuta DuckDB dentro del proceso: las tablas por usuario/a y las uniones por `uid` se
+quedan en el motor, que usa como máximo `memory_limit` y escribe lo que no cabe en
+`temp_directory`. A pandas sólo llegan los resultados ya agregados (por día, por mes, por
+cohorte y fuente), que se terminan de dar forma con las mismas funciones que usa el
+backend de pandas (`analitica.conversion`, `analitica.cohortes`, `analitica.streaming`),
+de modo que las tablas son las mismas (ver `benchmarks/check_backends.py`).
+
+Los costos son una tabla pequeña (un registro por día y fuente) y se cargan con
+`analitica.carga`; el CAC y el ROMI se calculan con las etapas de pandas sobre las tablas
+agregadas. Las tablas por usuario/a (`first_session_dates`, `users_conversion`,
+`first_orders`, ...) no son salidas de este backend.
+
+Todas las etapas de una ejecución usan la misma base de datos (`open_database()`), en la que
+cada registro se abre una sola vez como la vista `visits` u `orders` (ver `register()`): sobre
+la caché Parquet de `analitica.carga` si está al día o, si no, sobre una tabla temporal con
+el CSV leído una sola vez.
+
+Los meses son códigos enteros de `analitica.calendario` (`año * 12 + mes - 1`).
+'''
+import os
+
+import numpy as np
+import pandas as pd
+
+from analitica import cohortes
+from analitica.actividad import TRAILING_WINDOWS, WINDOWS, trailing_table
+from analitica.calendario import MONTH_DTYPE, month_start, with_month_index
+from analitica.carga import CACHE_DIR, cached_parquet
+from analitica.conversion import cohort_matrix, latency_bins, source_matrix
+from analitica.retencion import retention_tables
+from analitica.streaming import activity_metrics
+
+try:
+    import duckdb
+except ImportError:  # el backend de DuckDB es opcional
+    duckdb = None
+
+
+# directorio donde DuckDB escribe lo que no cabe en `memory_limit`
+TEMP_DIR = os.path.join(CACHE_DIR, 'duckdb')
+
+# columnas (nombre en el CSV, nombre en la consulta, tipo) de cada registro
+VISITS_COLUMNS = [('Uid', 'uid', 'UBIGINT'), ('Source Id', 'source_id', 'BIGINT'),
+                  ('Start Ts', 'start_ts', 'TIMESTAMP'), ('End Ts', 'end_ts', 'TIMESTAMP')]
+ORDERS_COLUMNS = [('Uid', 'uid', 'UBIGINT'), ('Buy Ts', 'buy_ts', 'TIMESTAMP'), ('Revenue', 'revenue', 'DOUBLE')]
+
+
+def _literal(text):
+    return "'" + text.replace("'", "''") + "'"
+
+
+def connect(memory_limit=None, temp_directory=None):
+    '''
+    Función que abre una base de datos de DuckDB en memoria que escribe en `temp_directory`
+    lo que no cabe en `memory_limit` (por ejemplo, '4GB').
+    '''
+    if duckdb is None:
+        raise ImportError('el backend de DuckDB necesita el paquete duckdb (pip install duckdb)')
+    temp_directory = temp_directory or TEMP_DIR
+    os.makedirs(temp_directory, exist_ok=True)
+    config = {'temp_directory': temp_directory}
+    if memory_limit:
+        config['memory_limit'] = memory_limit
+    con = duckdb.connect(config=config)
+    con.execute('CREATE TEMP MACRO month_code(ts) AS year(ts) * 12 + month(ts) - 1')
+    return con
+
+
+def open_database(memory_limit=None, temp_directory=None):
+    '''
+    Función que abre la base de datos que comparten las etapas de una ejecución.
+    '''
+    return {'database': connect(memory_limit, temp_directory)}
+
+
+def register(con, name, path, columns, cache_dir=CACHE_DIR, table=None):
+    '''
+    Función que crea, si no existe, la vista `name` con las `columns` del registro `path`, con
+    sus tipos y con el número de fila en el archivo (`row_index`). Si la caché Parquet de
+    `analitica.carga` está al día la vista la lee directamente; si no, el CSV se carga una
+    sola vez en una tabla temporal.
+    '''
+    exists = con.execute('SELECT count(*) FROM duckdb_views() WHERE view_name = ?', [name]).fetchone()[0]
+    if exists:
+        return
+    parquet_path = cached_parquet(path, cache_dir, table)
+    if parquet_path is not None:
+        select = ', '.join(f'CAST("{source}" AS {kind}) AS {target}' for source, target, kind in columns)
+        con.execute(f'CREATE TEMP VIEW {name} AS SELECT {select}, file_row_number AS row_index '
+                    f'FROM read_parquet({_literal(parquet_path)}, file_row_number = true)')
+        return
+    types = ', '.join(f'{_literal(source)}: {_literal(kind)}' for source, _, kind in columns)
+    select = ', '.join(f'"{source}" AS {target}' for source, target, _ in columns)
+    # en la tabla el `rowid` es el número de fila del archivo
+    con.execute(f'CREATE TEMP TABLE {name}_csv AS SELECT {select} '
+                f'FROM read_csv({_literal(path)}, header = true, types = {{{types}}})')
+    con.execute(f'CREATE TEMP VIEW {name} AS SELECT *, rowid AS row_index FROM {name}_csv')
+
+
+def _visits(con, path, cache_dir):
+    register(con, 'visits', path, VISITS_COLUMNS, cache_dir, 'visits_log_us')
+
+
+def _orders(con, path, cache_dir):
+    register(con, 'orders', path, ORDERS_COLUMNS, cache_dir, 'orders_log_us')
+
+
+def _describe(values, counts, name):
+    # `Series.describe()` a partir de los valores distintos (ordenados) y sus frecuencias
+    n = counts.sum()
+    mean = np.dot(values, counts) / n
+    std = np.sqrt(np.dot((values - mean) ** 2, counts) / (n - 1))
+    ends = np.cumsum(counts)
+
+    def quantile(q):
+        # interpolación lineal entre las posiciones vecinas, como `Series.quantile()`
+        position = (n - 1) * q
+        lower = int(np.floor(position))
+        below = values[np.searchsorted(ends, lower, side='right')]
+        above = values[np.searchsorted(ends, min(lower + 1, n - 1), side='right')]
+        return below + (position - lower) * (above - below)
+
+    stats = [n, mean, std, values[0], quantile(.25), quantile(.5), quantile(.75), values[-1]]
+    return pd.Series(stats, index=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'],
+                     dtype=np.float64, name=name)
+
+
+def _rolling_active(con, dates, windows=WINDOWS):
+    # cada par (uid, día) cubre [día, día + ventana) menos lo que ya cubría el par anterior del
+    # mismo uid, como en `analitica.actividad.rolling_active()`; a pandas llegan los cambios por día
+    first = dates[0].to_datetime64().astype('datetime64[D]').astype(np.int64)
+    n_days = (dates[-1] - dates[0]).days + 1
+    columns = {}
+    for window in windows:
+        delta = con.sql(f'''
+            WITH pairs AS (
+                SELECT day, lag(day) OVER (PARTITION BY uid ORDER BY day) AS previous
+                FROM (SELECT DISTINCT uid, CAST(start_ts AS DATE) - DATE '1970-01-01' AS day FROM visits))
+            SELECT day, sum(n) AS n FROM (
+                SELECT greatest(day, coalesce(previous + {window}, day)) AS day, 1 AS n FROM pairs
+                UNION ALL
+                SELECT day + {window}, -1 FROM pairs)
+            GROUP BY day
+        ''').fetchnumpy()
+        changes = np.bincount(delta['day'] - first, weights=delta['n'], minlength=n_days + window)
+        columns[f'active_{window}d'] = np.cumsum(changes.astype(np.int64))[:n_days]
+    days = (first + np.arange(n_days)).astype('datetime64[D]').astype('datetime64[ns]')
+    index = pd.DatetimeIndex(days, name='session_date')
+    return pd.DataFrame(columns, index=index)
+
+
+def product(database, visits_path, cache_dir=CACHE_DIR):
+    '''
+    Función que calcula el informe del producto (DAU, WAU, MAU, sesiones por usuario/a y
+    duración de las sesiones) con DuckDB.
+    '''
+    _visits(database, visits_path, cache_dir)
+    # usuarios únicos por día, por semana ISO (su lunes) y por mes (su código), en una sola pasada
+    activity = database.sql('''
+        SELECT session_year, session_date, session_week, session_month,
+               count(*) AS n_sessions, count(DISTINCT uid) AS n_users
+        FROM (SELECT uid, year(start_ts) AS session_year, CAST(start_ts AS DATE) AS session_date,
+                     CAST(date_trunc('week', start_ts) AS DATE) AS session_week,
+                     month_code(start_ts) AS session_month
+              FROM visits)
+        GROUP BY GROUPING SETS ((session_year, session_date), (session_week), (session_month))
+    ''').df()
+    daily = activity[activity['session_date'].notna()].sort_values(['session_year', 'session_date'])
+    weekly = activity[activity['session_week'].notna()]
+    monthly = activity[activity['session_month'].notna()]
+    metrics = activity_metrics(daily['n_users'], weekly['n_users'], monthly['n_users'])
+
+    index = pd.MultiIndex.from_arrays([daily['session_year'].to_numpy(dtype=np.int16),
+                                       daily['session_date'].to_numpy(dtype='datetime64[ns]')],
+                                      names=['session_year', 'session_date'])
+    sessions_per_user = pd.DataFrame({'n_sessions': daily['n_sessions'].to_numpy(dtype=np.int64),
+                                      'n_users': daily['n_users'].to_numpy(dtype=np.int64)}, index=index)
+    sessions_per_user['sess_per_user'] = sessions_per_user['n_sessions'] / sessions_per_user['n_users']
+    dates = index.get_level_values('session_date')
+    rolling_active_users = _rolling_active(database, dates)
+    dau = pd.Series(sessions_per_user['n_users'].to_numpy(), index=dates)
+    trailing_active_users = trailing_table(dau, _rolling_active(database, dates, TRAILING_WINDOWS))
+
+    # la duración sólo llega a pandas como valores distintos y sus frecuencias
+    durations = database.sql('''
+        SELECT (epoch_ns(end_ts) - epoch_ns(start_ts)) / 60000000000 AS duration, count(*) AS n
+        FROM visits WHERE end_ts IS NOT NULL
+        GROUP BY duration ORDER BY duration
+    ''').fetchnumpy()
+    values, counts = durations['duration'], durations['n'].astype(np.int64)
+    histogram, edges = np.histogram(values, bins=100, weights=counts)
+    mode = pd.Series(values[counts == counts.max()], name='session_duration_min')
+    return dict(metrics,
+                rolling_active_users=rolling_active_users,
+                trailing_active_users=trailing_active_users,
+                sessions_per_user=sessions_per_user,
+                session_duration=_describe(values, counts, 'session_duration_min'),
+                session_duration_mode=mode,
+                session_duration_histogram=pd.DataFrame({'left': edges[:-1], 'right': edges[1:],
+                                                         'count': histogram.astype(np.int64)}))
+
+
+def conversion(database, visits_path, orders_path, cache_dir=CACHE_DIR):
+    '''
+    Función que cuenta los/las compradores/as por cohorte de primera sesión y categoría de
+    conversión (días completos desde la primera sesión hasta el primer pedido), y por
+    categoría de conversión y fuente de anuncios, con DuckDB.
+    '''
+    _visits(database, visits_path, cache_dir)
+    _orders(database, orders_path, cache_dir)
+    # los días se calculan en microsegundos, la resolución de TIMESTAMP, para que la división sea exacta
+    database.execute(f'''
+        CREATE TEMP TABLE buyers AS
+        SELECT uid, month_code(first_session) AS first_session_month,
+               CAST(floor((epoch_us(first_buy) - epoch_us(first_session)) / {86_400 * 10**6}) AS BIGINT) AS days
+        FROM (SELECT uid, min(start_ts) AS first_session FROM visits GROUP BY uid)
+        JOIN (SELECT uid, min(buy_ts) AS first_buy FROM orders GROUP BY uid) USING (uid)
+    ''')
+    months = database.sql('''
+        SELECT first_session_month, days, count(*) AS n_buyers FROM buyers GROUP BY ALL
+    ''').fetchnumpy()
+    cohort = cohort_matrix(months['first_session_month'], latency_bins(months['days']),
+                           weights=months['n_buyers'])
+
+    pairs = database.sql('''
+        SELECT days, source_id, count(*) AS n_buyers
+        FROM buyers JOIN (SELECT DISTINCT uid, source_id FROM visits) USING (uid)
+        GROUP BY ALL
+    ''').fetchnumpy()
+    # todas las fuentes de las visitas, en orden numérico, como en el backend de pandas
+    names = database.sql('SELECT DISTINCT source_id FROM visits ORDER BY source_id').fetchnumpy()['source_id']
+    sources = pd.Index(names.astype(np.int64), name='source_id')
+    # la base de datos es de toda la ejecución: las tablas por usuario/a de la etapa se borran al terminar
+    database.execute('DROP TABLE buyers')
+    return {
+        'first_session_cohort': with_month_index(cohort),
+        'convertion_time_cohort': source_matrix(latency_bins(pairs['days']), sources.get_indexer(pairs['source_id']),
+                                                sources, weights=pairs['n_buyers']),
+    }
+
+
+def ltv(database, orders_path, cache_dir=CACHE_DIR):
+    '''
+    Función que calcula los pedidos por mes, el tamaño y las ganancias por mes de cada
+    cohorte de primer pedido y el LTV, con DuckDB.
+    '''
+    _orders(database, orders_path, cache_dir)
+    database.execute('''
+        CREATE TEMP TABLE first_orders AS
+        SELECT uid, month_code(min(buy_ts)) AS first_order_month FROM orders GROUP BY uid
+    ''')
+    order_period = database.sql('''
+        SELECT month_code(buy_ts) AS order_month, count(*) AS n_orders, count(DISTINCT uid) AS n_users
+        FROM orders GROUP BY order_month ORDER BY order_month
+    ''').df()
+    order_period['orders_per_user'] = order_period['n_orders'] / order_period['n_users']
+    order_period['order_month'] = month_start(order_period['order_month'].astype(MONTH_DTYPE))
+
+    cohort_sizes = database.sql('''
+        SELECT first_order_month, count(*) AS n_buyers
+        FROM first_orders GROUP BY first_order_month ORDER BY first_order_month
+    ''').df()
+    cohorts = database.sql('''
+        SELECT first_order_month, month_code(buy_ts) AS order_month, sum(revenue) AS revenue
+        FROM orders JOIN first_orders USING (uid)
+        GROUP BY ALL ORDER BY first_order_month, order_month
+    ''').df()
+    for table in (cohort_sizes, cohorts):
+        for column in ('first_order_month', 'order_month'):
+            if column in table:
+                table[column] = table[column].astype(MONTH_DTYPE)
+    database.execute('DROP TABLE first_orders')
+    report = cohortes.cohort_report(cohort_sizes, cohorts)
+    return {
+        'order_period': order_period,
+        'cohort_sizes': cohort_sizes,
+        'cohorts': cohorts,
+        'report': report,
+        'result': cohortes.ltv_table(report),
+        'ltv_cumulative': cohortes.cumulative_table(report, 'ltv'),
+    }
+
+
+def acquisition(database, visits_path, orders_path, cache_dir=CACHE_DIR):
+    '''
+    Función que cuenta los/las compradores/as por mes del primer pedido y fuente de su
+    primera sesión, con DuckDB. Entre sesiones a la misma hora gana la primera fila del
+    archivo, como con `idxmin`.
+    '''
+    _visits(database, visits_path, cache_dir)
+    _orders(database, orders_path, cache_dir)
+    cohort_sources = database.sql('''
+        SELECT first_order_month, source_id, count(*) AS n_buyers
+        FROM (SELECT uid, month_code(min(buy_ts)) AS first_order_month FROM orders GROUP BY uid)
+        JOIN (SELECT uid, arg_min(source_id, (start_ts, row_index)) AS source_id
+              FROM visits GROUP BY uid) USING (uid)
+        GROUP BY ALL ORDER BY first_order_month, source_id
+    ''').df()
+    cohort_sources['first_order_month'] = cohort_sources['first_order_month'].astype(MONTH_DTYPE)
+    return {'cohort_sources': cohort_sources}
+
+
+def retention(database, visits_path, cache_dir=CACHE_DIR):
+    '''
+    Función que cuenta los usuarios activos por cohorte de primera sesión y edad en meses,
+    con DuckDB.
+    '''
+    _visits(database, visits_path, cache_dir)
+    cells = database.sql('''
+        WITH activity AS (SELECT DISTINCT uid, month_code(start_ts) AS month FROM visits)
+        SELECT cohort, month - cohort AS age, count(*) AS n_users
+        FROM activity JOIN (SELECT uid, min(month) AS cohort FROM activity GROUP BY uid) USING (uid)
+        GROUP BY ALL
+    ''').fetchnumpy()
+    return retention_tables(cells['cohort'], cells['age'], cells['n_users'].astype(np.float64))
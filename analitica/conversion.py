@@ -0,0 +1,209 @@
+'''
+Tiempo de conversión (de la primera sesión al primer pedido) por usuario/a.
+
+Antes se unían todas las sesiones de cada usuario/a con todos sus pedidos
+(`visits_log_us_.merge(orders_log_us_, on='uid')`), lo que produce sesiones×pedidos
+filas por usuario/a sólo para obtener su mes de primera sesión y de primera compra.
+Aquí se trabaja con una tabla de una fila por comprador/a y, para la tabla por
+fuente de anuncios, con los pares distintos (uid, source_id) de las visitas.
+
+Los meses son códigos enteros de `analitica.calendario`. Si se tienen los códigos de
+usuario/a de `analitica.usuarios`, `conversion_users_by_code()` y `conversion_time_cohort()`
+evitan las uniones por `uid`.
+
+El tiempo de conversión de `conversion_users()` y `conversion_users_by_code()` es la
+diferencia entre los inicios de mes de la primera sesión y del primer pedido, como en el
+cuaderno original, así que las categorías de 0 días, 1 día y 1 semana sólo distinguen si
+los dos meses coinciden. `conversion_users_by_time()` usa en cambio los días completos
+entre la hora de la primera sesión y la del primer pedido. En los dos casos las tablas
+de cohortes se cuentan con `np.bincount` sobre el índice del intervalo de cada
+comprador/a (`latency_bins()`, con `np.searchsorted` sobre los límites enteros).
+'''
+import numpy as np
+import pandas as pd
+
+from analitica.calendario import MONTH_DTYPE, month_codes, month_start_days, with_month_index
+from analitica.sesiones import NS_PER_DAY
+from analitica.usuarios import _missing, has_rows
+
+
+# intervalos y etiquetas del tiempo de conversión en días
+CONVERSION_BINS = [-1, 0, 1, 7, 30, 60, 90, 120, 150, 180, 210, 240, 270, 300, 330, 360]
+CONVERSION_LABELS = ['Conversion 0d', 'Conversion 1d', 'Conversion 1w', 'Conversion 1m', 'Conversion 2m',
+                     'Conversion 3m', 'Conversion 4m', 'Conversion 5m', 'Conversion 6m', 'Conversion 7m',
+                     'Conversion 8m', 'Conversion 9m', 'Conversion 10m', 'Conversion 11m', 'Conversion 12m']
+
+
+def first_sources(visits):
+    '''
+    Función que devuelve la fuente de anuncios (`source_id`) de la primera sesión de cada usuario/a.
+    '''
+    first = visits.loc[visits.groupby('uid')['start_ts'].idxmin(), ['uid', 'source_id']]
+    first.columns = ['uid', 'first_source_id']
+    return first.reset_index(drop=True)
+
+
+def conversion_users(first_session_dates, first_buy_dates, bins=CONVERSION_BINS, labels=CONVERSION_LABELS):
+    '''
+    Función que construye una tabla con una fila por comprador/a con el mes de su primera
+    sesión, el mes de su primer pedido, los días de conversión y la categoría de conversión.
+    '''
+    users = first_session_dates.merge(first_buy_dates, on='uid')
+    return _categorize(users, bins, labels)
+
+
+def conversion_users_by_code(dictionary, first_session, first_buy, bins=CONVERSION_BINS, labels=CONVERSION_LABELS):
+    '''
+    Función que construye la misma tabla que `conversion_users()` a partir de los meses de
+    primera sesión y de primer pedido por código de usuario/a (resultados de
+    `analitica.usuarios.first_per_user`), sin unir tablas por `uid`.
+    '''
+    buyers = np.flatnonzero(has_rows(first_session) & has_rows(first_buy))
+    users = pd.DataFrame({'uid': dictionary.decode(buyers),
+                          'first_session_month': first_session[buyers],
+                          'first_buy_month': first_buy[buyers]})
+    return _categorize(users, bins, labels)
+
+
+def first_months(first_ts):
+    '''
+    Función que convierte a códigos de mes el resultado de `first_per_user` sobre horas en
+    nanosegundos (int64); los/las usuarios/as sin filas quedan sin valor, como en `has_rows`.
+    '''
+    months = np.full(len(first_ts), _missing(MONTH_DTYPE), dtype=MONTH_DTYPE)
+    present = has_rows(first_ts)
+    months[present] = month_codes(first_ts[present].view('datetime64[ns]'))
+    return months
+
+
+def latency_bins(days, bins=CONVERSION_BINS):
+    '''
+    Función que devuelve el índice del intervalo (`bins[i]`, `bins[i + 1]`] de cada tiempo de
+    conversión en días, como `pd.cut`; -1 para los que quedan fuera de los intervalos.
+    '''
+    codes = np.searchsorted(np.asarray(bins, dtype=np.int64), days, side='left') - 1
+    codes[codes >= len(bins) - 1] = -1
+    return codes
+
+
+def _categories(codes, labels):
+    return pd.Categorical.from_codes(codes, categories=labels, ordered=True)
+
+
+def conversion_users_by_time(dictionary, first_session_ts, first_buy_ts, bins=CONVERSION_BINS,
+                             labels=CONVERSION_LABELS):
+    '''
+    Función que construye la tabla de una fila por comprador/a a partir de la hora de la
+    primera sesión y del primer pedido por código de usuario/a (resultados de
+    `analitica.usuarios.first_per_user` sobre nanosegundos). `convertion_time_days` son los
+    días completos entre las dos horas.
+    '''
+    buyers = np.flatnonzero(has_rows(first_session_ts) & has_rows(first_buy_ts))
+    session, buy = first_session_ts[buyers], first_buy_ts[buyers]
+    days = (buy - session) // NS_PER_DAY
+    return pd.DataFrame({'uid': dictionary.decode(buyers),
+                         'first_session_month': first_months(session),
+                         'first_buy_month': first_months(buy),
+                         'convertion_time_days': days,
+                         'conversion_category': _categories(latency_bins(days, bins), labels)})
+
+
+def _categorize(users, bins, labels):
+    users['convertion_time_days'] = (month_start_days(users['first_buy_month'])
+                                     - month_start_days(users['first_session_month']))
+    users['conversion_category'] = _categories(latency_bins(users['convertion_time_days'].to_numpy(), bins), labels)
+    return users
+
+
+def _count_table(counts, index, columns):
+    # como pivot_table con 'nunique': sólo las filas y columnas con compradores/as y NaN en
+    # las celdas vacías (los conteos quedan enteros si no hay celdas vacías)
+    rows, cols = counts.any(axis=1), counts.any(axis=0)
+    counts = counts[rows][:, cols].astype(np.int64)
+    values = counts if counts.all() else np.where(counts > 0, counts, np.nan)
+    return pd.DataFrame(values, index=index[rows], columns=columns[cols])
+
+
+def _label_index(labels):
+    return pd.CategoricalIndex(labels, categories=labels, ordered=True, name='conversion_category')
+
+
+def cohort_matrix(months, codes, labels=CONVERSION_LABELS, weights=None):
+    '''
+    Función que cuenta los/las compradores/as por mes de primera sesión (códigos de mes) y
+    categoría de conversión (`codes`, resultado de `latency_bins()`); con `weights` cada
+    fila cuenta por su peso. Devuelve la tabla con los meses como códigos.
+    '''
+    months = np.asarray(months, dtype=np.int64)
+    keep = codes >= 0
+    first = int(months.min()) if len(months) else 0
+    n_months = int(months.max()) - first + 1 if len(months) else 0
+    cells = (months[keep] - first) * len(labels) + codes[keep]
+    counts = np.bincount(cells, weights=None if weights is None else np.asarray(weights)[keep],
+                         minlength=n_months * len(labels)).reshape(n_months, len(labels))
+    index = pd.Index(np.arange(first, first + n_months, dtype=MONTH_DTYPE), name='first_session_month')
+    return _count_table(counts, index, _label_index(labels))
+
+
+def source_matrix(codes, source_codes, sources, labels=CONVERSION_LABELS, weights=None):
+    '''
+    Función que cuenta los/las compradores/as por categoría de conversión (`codes`) y fuente
+    de anuncios (`source_codes`, posiciones en el índice `sources`); con `weights` cada
+    fila cuenta por su peso.
+    '''
+    keep = codes >= 0
+    cells = codes[keep] * len(sources) + np.asarray(source_codes)[keep]
+    counts = np.bincount(cells, weights=None if weights is None else np.asarray(weights)[keep],
+                         minlength=len(labels) * len(sources)).reshape(len(labels), len(sources))
+    return _count_table(counts, _label_index(labels), sources)
+
+
+def first_session_cohort(users):
+    '''
+    Función que cuenta los/las compradores/as por cohorte de primera sesión y categoría de conversión.
+    '''
+    categories = users['conversion_category'].cat
+    cohort = cohort_matrix(users['first_session_month'], categories.codes.to_numpy(), list(categories.categories))
+    return with_month_index(cohort)
+
+
+def _buyer_sources(users, visits, dictionary, visit_users):
+    # pares distintos (comprador/a, fuente) con los códigos de usuario/a: cada comprador/a
+    # recibe una fila de una matriz booleana compradores × fuentes, que se marca por posición
+    source_codes, sources = pd.factorize(visits['source_id'], sort=True)
+    buyer_codes = dictionary.encode(users['uid'])
+    row = np.full(len(dictionary), -1, dtype=np.int64)
+    row[buyer_codes] = np.arange(len(buyer_codes))
+    visit_rows = row[visit_users]
+    keep = visit_rows >= 0
+    seen = np.zeros((len(buyer_codes), len(sources)), dtype=bool)
+    seen[visit_rows[keep], source_codes[keep]] = True
+    buyer, source = np.nonzero(seen)
+    categories = users['conversion_category'].cat
+    return source_matrix(categories.codes.to_numpy()[buyer], source, sources.rename('source_id'),
+                         list(categories.categories))
+
+
+def conversion_time_cohort(users, visits=None, source='any', dictionary=None, visit_users=None):
+    '''
+    Función que cuenta los/las compradores/as por categoría de conversión y fuente de anuncios.
+
+    Con `source='any'` cada comprador/a cuenta en todas las fuentes desde las que tuvo
+    alguna sesión (igual que la tabla original). Con `source='first'` sólo cuenta en la
+    fuente de su primera sesión; en ese caso `users` debe tener la columna `first_source_id`.
+    Con `dictionary` y los códigos de usuario/a de las visitas (`visit_users`) los pares
+    (uid, source_id) se obtienen sin `drop_duplicates` ni `merge` y se cuentan con `np.bincount`.
+    '''
+    if source == 'any' and dictionary is not None:
+        return _buyer_sources(users, visits, dictionary, visit_users)
+    if source == 'first':
+        pairs = users.rename(columns={'first_source_id': 'source_id'})
+    elif source == 'any':
+        sources = visits[['uid', 'source_id']].drop_duplicates()
+        pairs = users[['uid', 'conversion_category']].merge(sources, on='uid')
+    else:
+        raise ValueError(f"source debe ser 'any' o 'first', no {source!r}")
+    return pairs.pivot_table(index='conversion_category',
+                             columns='source_id',
+                             values='uid',
+                             aggfunc='nunique')
@@ -0,0 +1,137 @@
+'''
+Cubo de métricas del producto por día × dispositivo × fuente de anuncios.
+
+El cubo se construye una sola vez a partir del registro de visitas. Cada celda
+(`session_date`, `device`, `source_id`) guarda el número de sesiones, la media de la
+duración y la suma de los cuadrados de sus desviaciones (para la desviación estándar, que
+se combina entre celdas con la fórmula de Chan como en `analitica.distribuciones.Moments`),
+la duración mínima y máxima y un sketch HyperLogLog de los usuarios únicos. Las consultas para cualquier corte
+(un dispositivo, una fuente, un rango de fechas) sólo combinan celdas del cubo, sin
+volver a agrupar las visitas.
+'''
+import numpy as np
+import pandas as pd
+
+from analitica.hll import BucketSketches
+from analitica.sesiones import session_features
+from analitica.streaming import activity_metrics
+
+
+DIMENSIONS = ['session_date', 'device', 'source_id']
+
+
+class SessionCube:
+    '''
+    Cubo de sesiones con una fila por celda en `cells` y una fila de registros
+    HyperLogLog por celda en `sketches` (en el mismo orden).
+    '''
+
+    def __init__(self, cells, sketches):
+        self.cells = cells
+        self.sketches = sketches
+
+    @classmethod
+    def build(cls, visits, precision=12):
+        '''
+        Construye el cubo a partir de las visitas con las columnas `start_ts`, `end_ts`,
+        `device`, `source_id` y `uid`.
+        '''
+        features = session_features(visits['start_ts'], visits['end_ts'],
+                                    features=['session_date', 'session_duration_min'])
+        keys = pd.DataFrame({'session_date': features['session_date'],
+                             'device': visits['device'].astype(str).to_numpy(),
+                             'source_id': visits['source_id'].astype(np.int64).to_numpy()})
+        sketches = BucketSketches.build(keys, visits['uid'].to_numpy(), precision)
+        duration = features['session_duration_min']
+        groups = [keys[name] for name in DIMENSIONS]
+        measures = pd.DataFrame({'sessions': 1, 'duration_mean': duration,
+                                 'duration_min': duration, 'duration_max': duration})
+        cells = (measures.groupby(groups)
+                 .agg({'sessions': 'sum', 'duration_mean': 'mean',
+                       'duration_min': 'min', 'duration_max': 'max'}))
+        # suma de los cuadrados de las desviaciones respecto de la media de cada celda
+        deviation = duration - measures.groupby(groups)['duration_mean'].transform('mean')
+        cells['duration_m2'] = (deviation ** 2).groupby(groups).sum()
+        cells = cells.reindex(sketches.index).reset_index()
+        return cls(cells, sketches)
+
+    def _mask(self, device=None, source_id=None, start=None, end=None):
+        mask = np.ones(len(self.cells), dtype=bool)
+        if device is not None:
+            mask &= self.cells['device'].isin(np.atleast_1d(device)).to_numpy()
+        if source_id is not None:
+            mask &= self.cells['source_id'].isin(np.atleast_1d(source_id)).to_numpy()
+        if start is not None:
+            mask &= (self.cells['session_date'] >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            mask &= (self.cells['session_date'] <= pd.Timestamp(end)).to_numpy()
+        return mask
+
+    def _daily_sketches(self, mask):
+        dates = pd.DatetimeIndex(self.cells['session_date'].to_numpy()[mask])
+        selected = BucketSketches(self.sketches.index[mask], self.sketches.registers[mask],
+                                  self.sketches.precision)
+        return selected.rollup(dates)
+
+    def sessions_per_user(self, **where):
+        '''
+        Devuelve por día el número de sesiones, de usuarios (aproximado) y de sesiones por
+        usuario, como la tabla `sessions_per_user` del informe del producto.
+        Los filtros son `device`, `source_id`, `start` y `end`.
+        '''
+        mask = self._mask(**where)
+        sessions = self.cells[mask].groupby('session_date')['sessions'].sum()
+        users = self._daily_sketches(mask).counts()
+        table = pd.DataFrame({'n_sessions': sessions, 'n_users': users.round().astype('int64')})
+        table['sess_per_user'] = table['n_sessions'] / table['n_users']
+        return table
+
+    def active_users(self, **where):
+        '''
+        Devuelve el DAU, WAU, MAU (aproximados) y el factor de adherencia del corte pedido.
+        '''
+        daily = self._daily_sketches(self._mask(**where))
+        weekly = daily.rollup(lambda index: index.to_period('W'))
+        monthly = daily.rollup(lambda index: index.to_period('M'))
+        return activity_metrics(daily.counts(), weekly.counts(), monthly.counts())
+
+    def duration_stats(self, **where):
+        '''
+        Devuelve el número de sesiones y la duración media, desviación estándar, mínima y
+        máxima (en minutos) del corte pedido; sin sesiones, las estadísticas quedan en NaN.
+        '''
+        cells = self.cells[self._mask(**where)]
+        sessions = cells['sessions'].to_numpy(dtype=np.float64)
+        means = cells['duration_mean'].to_numpy(dtype=np.float64)
+        count = int(sessions.sum())
+        mean = m2 = np.nan
+        if count:
+            # fórmula de Chan para varias celdas: M2 = Σ M2_i + Σ n_i (media_i - media)²
+            mean = np.sum(sessions * means) / count
+            m2 = cells['duration_m2'].sum() + np.sum(sessions * (means - mean) ** 2)
+        return pd.Series({'count': count, 'mean': mean, 'std': np.sqrt(m2 / (count - 1)) if count > 1 else np.nan,
+                          'min': cells['duration_min'].min(), 'max': cells['duration_max'].max()},
+                         name='session_duration_min')
+
+    def save(self, path):
+        '''
+        Guarda el cubo en un archivo `.npz`.
+        '''
+        columns = {}
+        for name in self.cells.columns:
+            values = self.cells[name].to_numpy()
+            # los textos se guardan como unicode de NumPy para no depender de pickle
+            columns[name] = values.astype(str) if values.dtype == object else values
+        np.savez(path, registers=self.sketches.registers, precision=self.sketches.precision, **columns)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Carga un cubo guardado con `save()`.
+        '''
+        with np.load(path, allow_pickle=False) as data:
+            cells = pd.DataFrame({name: data[name] for name in data.files
+                                  if name not in ('registers', 'precision')})
+            sketches = BucketSketches(pd.MultiIndex.from_frame(cells[DIMENSIONS]),
+                                      data['registers'], int(data['precision']))
+        return cls(cells, sketches)
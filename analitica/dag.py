@@ -0,0 +1,177 @@
+'''
+Grafo de etapas con evaluación perezosa y resultados intermedios guardados en disco.
+
+Cada etapa se declara como `(nombre, función, entradas, salidas)`. Su llave es un hash
+del código de la función (incluyendo los módulos del paquete que usa), de los parámetros
+que recibe (para los archivos: ruta, tamaño y fecha de modificación) y de las llaves de
+las etapas que producen sus entradas. Así, la llave de una etapa cambia sólo si cambia su
+código o algo de lo que depende, y se puede calcular sin ejecutar nada.
+
+Al pedir unas salidas, `Graph.evaluate()` recorre el grafo desde ellas hacia atrás: una
+etapa cuyo resultado ya está guardado con su llave se lee del disco y sus entradas no se
+calculan; las demás se ejecutan y su resultado se guarda para la próxima vez.
+'''
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+
+
+def fingerprint(value):
+    '''
+    Función que describe un parámetro para la llave de una etapa. Los archivos se describen
+    por su ruta, tamaño y fecha de modificación, sin leerlos.
+    '''
+    if isinstance(value, (str, os.PathLike)) and os.path.isfile(value):
+        stat = os.stat(value)
+        return f'file:{os.path.abspath(value)}:{stat.st_size}:{stat.st_mtime_ns}'
+    return repr(value)
+
+
+def _package_modules(value, package):
+    # módulos del paquete a los que se refiere un objeto global (módulo, función o clase)
+    module = value if inspect.ismodule(value) else inspect.getmodule(value)
+    if module is None or not module.__name__.startswith(package + '.'):
+        return set()
+    return {module}
+
+
+@functools.lru_cache(maxsize=None)
+def code_hash(function):
+    '''
+    Función que calcula el hash del código de `function` y de todos los módulos de su
+    paquete de los que depende, directa o indirectamente.
+    '''
+    package = function.__module__.split('.')[0]
+    pending = set()
+    for name in function.__code__.co_names:
+        if name in function.__globals__:
+            pending |= _package_modules(function.__globals__[name], package)
+    modules = set()
+    while pending:
+        module = pending.pop()
+        modules.add(module)
+        for value in vars(module).values():
+            pending |= _package_modules(value, package) - modules
+    digest = hashlib.sha256(inspect.getsource(function).encode())
+    for module in sorted(modules, key=lambda module: module.__name__):
+        digest.update(inspect.getsource(module).encode())
+    return digest.hexdigest()
+
+
+class Graph:
+    '''
+    Grafo de etapas. `volatile` son las etapas cuyo resultado no se guarda (por ejemplo,
+    las cargas, que ya tienen su propia caché) y `unkeyed` los parámetros que no cambian
+    el resultado y por eso no entran en las llaves.
+    '''
+
+    def __init__(self, stages, volatile=(), unkeyed=()):
+        self.stages = list(stages)
+        self.volatile = set(volatile)
+        self.unkeyed = set(unkeyed)
+        self.producers = {}
+        for stage in self.stages:
+            for output in stage[3]:
+                if output in self.producers:
+                    raise ValueError(f'la salida {output!r} la producen dos etapas')
+                self.producers[output] = stage
+
+    def outputs(self):
+        return list(self.producers)
+
+    def keys(self, params):
+        '''
+        Devuelve la llave de cada etapa para los parámetros `params`.
+        '''
+        keys = {}
+        for name, function, inputs, outputs in self.stages:
+            digest = hashlib.sha256(name.encode())
+            digest.update(code_hash(function).encode())
+            for key in inputs:
+                if key in self.producers:
+                    source = keys[self.producers[key][0]]
+                elif key in self.unkeyed:
+                    continue
+                else:
+                    source = fingerprint(params[key])
+                digest.update(f'{key}={source};'.encode())
+            keys[name] = digest.hexdigest()
+        return keys
+
+    def _memo_path(self, memo_dir, name, key):
+        return os.path.join(memo_dir, f'{name}-{key[:20]}.pkl')
+
+    def plan(self, targets, params, memo_dir=None):
+        '''
+        Devuelve, en orden de ejecución, las etapas necesarias para `targets` como pares
+        (etapa, acción), donde la acción es 'run' o 'memo' (leer el resultado guardado).
+        '''
+        keys = self.keys(params) if memo_dir else {}
+        needed = set(targets)
+        unknown = needed - set(self.producers) - set(params)
+        if unknown:
+            raise KeyError(f'salidas desconocidas: {sorted(unknown)}')
+        plan = []
+        for stage in reversed(self.stages):
+            name, function, inputs, outputs = stage
+            if needed.isdisjoint(outputs):
+                continue
+            if memo_dir and name not in self.volatile \
+                    and os.path.exists(self._memo_path(memo_dir, name, keys[name])):
+                plan.append((stage, 'memo'))
+            else:
+                plan.append((stage, 'run'))
+                needed.update(inputs)
+        return plan[::-1]
+
+    def evaluate(self, targets, params, memo_dir=None, instrumentation=None):
+        '''
+        Calcula las salidas `targets` (todas si es None) y devuelve un diccionario con los
+        parámetros y todo lo que se calculó o leyó del disco para obtenerlas.
+        '''
+        targets = self.outputs() if targets is None else targets
+        keys = self.keys(params) if memo_dir else {}
+        context = dict(params)
+        for (name, function, inputs, outputs), action in self.plan(targets, params, memo_dir):
+            if action == 'memo':
+                path = self._memo_path(memo_dir, name, keys[name])
+                if instrumentation is None:
+                    values = _read(path)
+                else:
+                    with instrumentation.stage(name + ':memo') as record:
+                        values = record['outputs'] = _read(path)
+                context.update(values)
+                continue
+            arguments = {key: context[key] for key in inputs}
+            if instrumentation is None:
+                values = function(**arguments)
+            else:
+                with instrumentation.stage(name, arguments) as record:
+                    values = record['outputs'] = function(**arguments)
+            context.update(values)
+            if memo_dir and name not in self.volatile:
+                _write(self._memo_path(memo_dir, name, keys[name]), values)
+        return context
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _write(path, values):
+    '''
+    Guarda el resultado de una etapa y borra los resultados anteriores de la misma etapa.
+    '''
+    directory, filename = os.path.split(path)
+    os.makedirs(directory, exist_ok=True)
+    prefix = filename.rsplit('-', 1)[0] + '-'
+    for old in os.listdir(directory):
+        if old.startswith(prefix) and old != filename and old.endswith('.pkl'):
+            os.remove(os.path.join(directory, old))
+    # se escribe a un archivo temporal para no dejar resultados incompletos
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(values, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,333 @@
+'''
+Distribuciones por bloques (streaming) de la duración de las sesiones y de las sesiones
+por usuario/a, con memoria constante y combinables entre procesos.
+
+El informe del producto necesita la columna completa `session_duration_min` para
+`describe()`, `mode()` y el histograma de 100 intervalos. Aquí cada bloque de visitas
+actualiza tres resúmenes de tamaño fijo:
+
+    Moments         número de valores, media, varianza (fórmula de Chan), mínimo y máximo,
+                    exactos
+    FixedHistogram  conteos en intervalos fijos; para la duración, un intervalo por
+                    segundo, de modo que la moda es exacta y el histograma de 100
+                    intervalos se obtiene reagrupando los conteos
+    KLLSketch       sketch de cuantiles KLL (Karnin, Lang y Liberty, 2016): con `k`
+                    elementos por nivel el error en el rango de los cuantiles es de
+                    alrededor de 1.7 / k
+
+Los tres se combinan con `merge()`, así que cada proceso puede leer una parte del
+registro y los resultados se unen al final. Las sesiones por usuario/a de cada día
+(`sessions_per_user`) son una fila por día: se acumulan las sesiones por día (exactas) y
+los usuarios únicos por día con un sketch HyperLogLog por día
+(`analitica.hll.BucketSketches`), de tamaño fijo sin importar cuántos/as usuarios/as haya;
+con `exact=True` se guardan los conjuntos de usuarios/as de cada día
+(`analitica.streaming.DistinctUsers`), que ocupan O(pares usuario/a-día).
+'''
+import numpy as np
+import pandas as pd
+
+from analitica.hll import BucketSketches, precision_for_error
+from analitica.sesiones import NS_PER_DAY, NS_PER_MINUTE, civil_from_days
+from analitica.streaming import DistinctUsers, iter_visit_chunks
+
+
+# columnas del CSV que se necesitan para las distribuciones de las sesiones
+SESSION_COLUMNS = ['Uid', 'Start Ts', 'End Ts']
+
+
+class Moments:
+    '''
+    Número de valores, media, suma de cuadrados de las desviaciones, mínimo y máximo.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def _combine(self, count, mean, m2, low, high):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values):
+            mean = values.mean()
+            self._combine(len(values), mean, np.sum((values - mean) ** 2), values.min(), values.max())
+
+    def merge(self, other):
+        if other.count:
+            self._combine(other.count, other.mean, other.m2, other.min, other.max)
+        return self
+
+    def std(self):
+        return np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+
+
+class FixedHistogram:
+    '''
+    Histograma con `n_bins` intervalos de ancho `width` a partir de `low`; los valores fuera
+    del rango se cuentan en `underflow` y `overflow`.
+    '''
+
+    def __init__(self, low, width, n_bins):
+        self.low = low
+        self.width = width
+        self.counts = np.zeros(n_bins, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    def edges(self):
+        return self.low + self.width * np.arange(len(self.counts) + 1)
+
+    def update(self, values):
+        bins = np.floor((np.asarray(values, dtype=np.float64) - self.low) / self.width).astype(np.int64)
+        inside = (bins >= 0) & (bins < len(self.counts))
+        self.underflow += int((bins < 0).sum())
+        self.overflow += int((bins >= len(self.counts)).sum())
+        self.counts += np.bincount(bins[inside], minlength=len(self.counts))
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    def mode(self):
+        '''
+        Devuelve el centro de los intervalos con más valores (ninguno si no hay valores).
+        '''
+        if not self.counts.any():
+            return np.empty(0)
+        centers = self.low + self.width * (np.flatnonzero(self.counts == self.counts.max()) + 0.5)
+        return centers
+
+    def rebin(self, low, high, bins=100):
+        '''
+        Reagrupa los conteos en `bins` intervalos iguales entre `low` y `high` según el centro
+        de cada intervalo; los valores fuera del rango van al primer y al último intervalo.
+        Devuelve los conteos y los límites, como `np.histogram`.
+        '''
+        centers = self.edges()[:-1] + self.width / 2
+        counts, edges = np.histogram(np.clip(centers, low, high), bins=bins, range=(low, high),
+                                     weights=self.counts)
+        counts = counts.astype(np.int64)
+        counts[0] += self.underflow
+        counts[-1] += self.overflow
+        return counts, edges
+
+
+class KLLSketch:
+    '''
+    Sketch de cuantiles KLL. El nivel `h` guarda elementos que representan `2**h` valores;
+    cuando un nivel supera su capacidad se ordena y se promueve uno de cada dos elementos
+    (los pares o los impares, al azar) al nivel siguiente.
+    '''
+
+    def __init__(self, k=200, seed=0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.n = 0
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (len(self.levels) - 1 - level))))
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) <= self._capacity(level):
+                level += 1
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(items)
+            # si el número de elementos es impar, el último se queda en el nivel
+            keep = len(items) % 2
+            promoted = items[:len(items) - keep][self._rng.integers(2)::2]
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            self.levels[level] = items[len(items) - keep:]
+            # al agregar un nivel cambian las capacidades: se vuelve a revisar desde abajo
+            level = 0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.n += len(values)
+        self._compress()
+
+    def merge(self, other):
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        '''
+        Devuelve los cuantiles aproximados `q` (un número o un arreglo entre 0 y 1); NaN si el
+        sketch está vacío.
+        '''
+        if not self.n:
+            return np.full(np.shape(q), np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        ranks = np.cumsum(weights[order])
+        position = np.searchsorted(ranks, np.asarray(q) * ranks[-1], side='left')
+        return items[order][np.minimum(position, len(items) - 1)]
+
+
+class DistributionStream:
+    '''
+    Momentos, histograma fijo y sketch de cuantiles de una misma variable.
+    '''
+
+    def __init__(self, low, width, n_bins, k=200, seed=0):
+        self.moments = Moments()
+        self.histogram = FixedHistogram(low, width, n_bins)
+        self.sketch = KLLSketch(k, seed)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self.moments.update(values)
+        self.histogram.update(values)
+        self.sketch.update(values)
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.histogram.merge(other.histogram)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def describe(self, name=None):
+        '''
+        Devuelve una Series como la de `Series.describe()`: el número de valores, la media, la
+        desviación estándar, el mínimo y el máximo son exactos y los cuartiles, aproximados.
+        '''
+        quartiles = self.sketch.quantile([.25, .5, .75])
+        count = self.moments.count
+        # sin valores, todo menos el conteo queda en NaN, como en `Series.describe()`
+        low, high = (self.moments.min, self.moments.max) if count else (np.nan, np.nan)
+        stats = [count, self.moments.mean if count else np.nan, self.moments.std(), low, *quartiles, high]
+        return pd.Series(stats, index=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'],
+                         dtype=np.float64, name=name)
+
+    def mode(self, name=None):
+        return pd.Series(self.histogram.mode(), name=name)
+
+    def histogram_frame(self, bins=100):
+        '''
+        Devuelve el histograma de `bins` intervalos entre el mínimo y el máximo, con las
+        columnas `left`, `right` y `count`; sin valores, la tabla no tiene filas.
+        '''
+        if not self.moments.count:
+            return pd.DataFrame({'left': np.empty(0), 'right': np.empty(0), 'count': np.empty(0, dtype=np.int64)})
+        counts, edges = self.histogram.rebin(self.moments.min, self.moments.max, bins)
+        return pd.DataFrame({'left': edges[:-1], 'right': edges[1:], 'count': counts})
+
+
+class SessionStatsStream:
+    '''
+    Duración de las sesiones (en minutos, con un intervalo del histograma por segundo hasta
+    `max_minutes`) y sesiones por usuario/a de cada día, acumuladas por bloques. Los
+    usuarios únicos por día son aproximados, con un error relativo típico de `error`, salvo
+    con `exact=True`.
+    '''
+
+    def __init__(self, max_minutes=24 * 60, k=200, seed=0, error=0.01, exact=False):
+        # intervalos centrados en cada segundo, para que los valores no caigan en los bordes
+        self.duration = DistributionStream(-1 / 120, 1 / 60, max_minutes * 60 + 1, k, seed)
+        self.daily_sessions = pd.Series(dtype=np.int64)
+        self.exact = exact
+        self.precision = None if exact else precision_for_error(error)
+        self.daily_users = DistinctUsers() if exact else None
+
+    def update(self, start_ts, end_ts, uids):
+        '''
+        Procesa un bloque de visitas a partir de sus columnas `start_ts`, `end_ts` y `uid`.
+        '''
+        start = np.asarray(start_ts, dtype='datetime64[ns]').view(np.int64)
+        end = np.asarray(end_ts, dtype='datetime64[ns]')
+        present = ~np.isnat(end)
+        self.duration.update((end[present].view(np.int64) - start[present]) / NS_PER_MINUTE)
+        days = start // NS_PER_DAY
+        self.daily_sessions = self.daily_sessions.add(pd.Series(days).value_counts(), fill_value=0)
+        uids = np.asarray(uids, dtype=np.uint64)
+        if self.exact:
+            self.daily_users.update(days, uids)
+        else:
+            self._merge_sketches(BucketSketches.build(pd.Index(days), uids, self.precision))
+
+    def _merge_sketches(self, sketches):
+        if sketches is not None:
+            self.daily_users = sketches if self.daily_users is None else self.daily_users.merge(sketches)
+
+    def merge(self, other):
+        if other.exact != self.exact or other.precision != self.precision:
+            raise ValueError('sólo se pueden unir resúmenes con los mismos usuarios únicos (exact y error)')
+        self.duration.merge(other.duration)
+        self.daily_sessions = self.daily_sessions.add(other.daily_sessions, fill_value=0)
+        if self.exact:
+            self.daily_users.merge(other.daily_users)
+        else:
+            self._merge_sketches(other.daily_users)
+        return self
+
+    def _user_counts(self):
+        # usuarios únicos por día (redondeados si son aproximados)
+        if self.exact:
+            return self.daily_users.counts()
+        if self.daily_users is None:
+            return pd.Series(dtype=np.int64)
+        return self.daily_users.counts().round()
+
+    def sessions_per_user(self):
+        '''
+        Devuelve la tabla `sessions_per_user` del informe del producto.
+        '''
+        sessions = self.daily_sessions.sort_index()
+        days = sessions.index.to_numpy(dtype=np.int64)
+        users = self._user_counts().reindex(sessions.index)
+        index = pd.MultiIndex.from_arrays([civil_from_days(days)[0].astype(np.int16),
+                                           (days * NS_PER_DAY).view('datetime64[ns]')],
+                                          names=['session_year', 'session_date'])
+        table = pd.DataFrame({'n_sessions': sessions.to_numpy(dtype=np.int64),
+                              'n_users': users.to_numpy(dtype=np.int64)}, index=index)
+        table['sess_per_user'] = table['n_sessions'] / table['n_users']
+        return table
+
+    def tables(self, bins=100):
+        '''
+        Devuelve `sessions_per_user`, `session_duration` (describe), `session_duration_mode` y
+        `session_duration_histogram`, con los nombres de las salidas de `analitica.pipeline`.
+        '''
+        name = 'session_duration_min'
+        return {
+            'sessions_per_user': self.sessions_per_user(),
+            'session_duration': self.duration.describe(name),
+            'session_duration_mode': self.duration.mode(name),
+            'session_duration_histogram': self.duration.histogram_frame(bins),
+        }
+
+
+def stream_session_stats(path='/datasets/visits_log_us.csv', chunksize=1_000_000, **options):
+    '''
+    Función que calcula las distribuciones de las sesiones leyendo el registro de visitas
+    por bloques; `options` se pasan a `SessionStatsStream`.
+    '''
+    stream = SessionStatsStream(**options)
+    for chunk in iter_visit_chunks(path, chunksize=chunksize, columns=SESSION_COLUMNS):
+        stream.update(chunk['Start Ts'], chunk['End Ts'], chunk['Uid'])
+    return stream.tables()
@@ -0,0 +1,225 @@
+'''
+Conteo aproximado de usuarios únicos con sketches HyperLogLog combinables.
+
+Para los tableros no hace falta el `nunique` exacto sobre `uid`: se construye un
+sketch HyperLogLog por día (y opcionalmente por `device` o `source_id`) y el WAU y
+el MAU se obtienen uniendo los sketches diarios, sin volver a leer las visitas.
+
+El error relativo típico de un sketch con `m = 2**precision` registros es
+`1.04 / sqrt(m)`; con `precision_for_error()` se elige la precisión para un error dado.
+'''
+import math
+
+import numpy as np
+import pandas as pd
+
+from analitica.streaming import activity_metrics
+
+
+MIN_PRECISION = 4
+MAX_PRECISION = 18
+
+
+def precision_for_error(error):
+    '''
+    Función que devuelve la precisión mínima cuyo error relativo típico no supera `error`.
+    '''
+    precision = math.ceil(2 * math.log2(1.04 / error))
+    if not MIN_PRECISION <= precision <= MAX_PRECISION:
+        raise ValueError(f'no se puede obtener un error de {error} con HyperLogLog '
+                         f'(precisión {precision} fuera de [{MIN_PRECISION}, {MAX_PRECISION}])')
+    return precision
+
+
+def relative_error(precision):
+    '''
+    Función que devuelve el error relativo típico de un sketch con la precisión dada.
+    '''
+    return 1.04 / math.sqrt(1 << precision)
+
+
+def hash_uids(uids):
+    '''
+    Función que mezcla los `uid` con splitmix64 para obtener hashes uniformes de 64 bits.
+    '''
+    x = np.asarray(uids).astype(np.uint64, copy=True)
+    x += np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _leading_zeros(values):
+    # búsqueda binaria vectorizada del bit más significativo
+    zeros = np.zeros(values.shape, dtype=np.uint8)
+    x = values.copy()
+    for shift in (32, 16, 8, 4, 2, 1):
+        mask = x < (np.uint64(1) << np.uint64(64 - shift))
+        zeros[mask] += shift
+        x[mask] <<= np.uint64(shift)
+    zeros[values == 0] = 64
+    return zeros
+
+
+def register_updates(uids, precision):
+    '''
+    Función que devuelve, para cada `uid`, el índice del registro y el rango que le corresponden.
+    '''
+    hashes = hash_uids(uids)
+    index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    rest = hashes << np.uint64(precision)
+    rank = np.minimum(_leading_zeros(rest), 64 - precision) + 1
+    return index, rank.astype(np.uint8)
+
+
+def estimate(registers):
+    '''
+    Función que estima la cardinalidad de uno o varios sketches (una fila por sketch).
+    '''
+    registers = np.atleast_2d(registers)
+    m = registers.shape[1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.exp2(-registers.astype(np.float64)), axis=1)
+    zeros = np.count_nonzero(registers == 0, axis=1)
+    # corrección para cardinalidades pequeñas (conteo lineal)
+    small = (raw <= 2.5 * m) & (zeros > 0)
+    linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where(small, linear, raw)
+
+
+class HyperLogLog:
+    '''
+    Sketch HyperLogLog de `2**precision` registros de un byte.
+    '''
+
+    def __init__(self, precision=14, registers=None):
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError(f'la precisión debe estar entre {MIN_PRECISION} y {MAX_PRECISION}')
+        self.precision = precision
+        if registers is None:
+            registers = np.zeros(1 << precision, dtype=np.uint8)
+        self.registers = registers
+
+    @classmethod
+    def from_error(cls, error):
+        return cls(precision_for_error(error))
+
+    @property
+    def error(self):
+        return relative_error(self.precision)
+
+    def add(self, uids):
+        index, rank = register_updates(uids, self.precision)
+        np.maximum.at(self.registers, index, rank)
+        return self
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('sólo se pueden unir sketches con la misma precisión')
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def __or__(self, other):
+        return HyperLogLog(self.precision, self.registers.copy()).merge(other)
+
+    def count(self):
+        return float(estimate(self.registers)[0])
+
+
+def _factorize(keys):
+    if isinstance(keys, pd.DataFrame):
+        keys = pd.MultiIndex.from_frame(keys)
+    elif not isinstance(keys, pd.Index):
+        keys = pd.Index(keys)
+    codes, uniques = keys.factorize(sort=True)
+    # factorize no conserva los nombres de los niveles
+    uniques.names = keys.names
+    return codes, uniques
+
+
+class BucketSketches:
+    '''
+    Conjunto de sketches HyperLogLog, uno por cada clave (`index`), guardados como una
+    matriz de registros para poder combinarlos de forma vectorizada.
+    '''
+
+    def __init__(self, index, registers, precision):
+        self.index = index
+        self.registers = registers
+        self.precision = precision
+
+    @classmethod
+    def build(cls, keys, uids, precision=14):
+        '''
+        Construye un sketch por cada clave distinta de `keys` a partir de los `uids`.
+        Las claves pueden ser una Series o un DataFrame (varias dimensiones).
+        '''
+        codes, index = _factorize(keys)
+        registers = np.zeros((len(index), 1 << precision), dtype=np.uint8)
+        slot, rank = register_updates(uids, precision)
+        np.maximum.at(registers, (codes, slot), rank)
+        return cls(index, registers, precision)
+
+    def merge(self, other):
+        '''
+        Une dos conjuntos de sketches clave a clave, por ejemplo los de dos bloques de visitas.
+        '''
+        if other.precision != self.precision:
+            raise ValueError('sólo se pueden unir sketches con la misma precisión')
+        return self._reduce(self.index.append(other.index),
+                            np.concatenate([self.registers, other.registers]))
+
+    def rollup(self, keys):
+        '''
+        Agrupa los sketches por una nueva clave (por ejemplo, de día a semana) uniendo sus
+        registros. `keys` es un arreglo de claves o una función que recibe el índice actual.
+        '''
+        new_keys = keys(self.index) if callable(keys) else keys
+        return self._reduce(new_keys, self.registers)
+
+    def _reduce(self, keys, registers):
+        codes, index = _factorize(keys)
+        if len(codes) == 0:
+            return BucketSketches(index, registers[:0], self.precision)
+        # se ordenan los sketches por clave y se une cada grupo contiguo
+        # (un max por bloque es mucho más rápido que np.maximum.reduceat con uint8)
+        order = np.argsort(codes, kind='stable')
+        if np.any(order != np.arange(len(order))):
+            registers = registers[order]
+        bounds = np.flatnonzero(np.diff(codes[order])) + 1
+        merged = np.stack([block.max(axis=0) for block in np.split(registers, bounds)])
+        return BucketSketches(index, merged, self.precision)
+
+    def counts(self):
+        '''
+        Devuelve una Series con la cardinalidad estimada de cada clave.
+        '''
+        return pd.Series(estimate(self.registers), index=self.index, name='uid')
+
+
+def approx_active_users(start_ts, uids, error=0.01, by=None):
+    '''
+    Función que estima el DAU, WAU, MAU y el factor de adherencia con sketches HyperLogLog.
+    Los sketches diarios se construyen una sola vez y el WAU y el MAU se obtienen uniéndolos
+    por semana ISO y por mes, con su año (los mismos periodos que el informe del producto).
+    Con `by` (una Series como `device` o `source_id`) se obtiene una fila por segmento.
+    '''
+    dates = pd.Series(start_ts).reset_index(drop=True).dt.normalize()
+    precision = precision_for_error(error)
+    if by is None:
+        daily = BucketSketches.build(dates, uids, precision)
+        weekly = daily.rollup(lambda index: index.to_period('W'))
+        monthly = daily.rollup(lambda index: index.to_period('M'))
+        return activity_metrics(daily.counts(), weekly.counts(), monthly.counts())
+
+    keys = pd.DataFrame({'segment': pd.Series(by).reset_index(drop=True), 'date': dates})
+    daily = BucketSketches.build(keys, uids, precision)
+    segment = daily.index.get_level_values(0)
+    day = pd.DatetimeIndex(daily.index.get_level_values(1))
+    weekly = daily.rollup(pd.MultiIndex.from_arrays([segment, day.to_period('W')]))
+    monthly = daily.rollup(pd.MultiIndex.from_arrays([segment, day.to_period('M')]))
+    weekly_counts = weekly.counts().groupby(level=0)
+    monthly_counts = monthly.counts().groupby(level=0)
+    rows = {name: activity_metrics(group, weekly_counts.get_group(name), monthly_counts.get_group(name))
+            for name, group in daily.counts().groupby(level=0)}
+    return pd.DataFrame.from_dict(rows, orient='index')
@@ -0,0 +1,279 @@
+'''
+Modo incremental: se guarda el estado de las cohortes y sólo se procesan los nuevos
+bloques (particiones) de los registros de visitas, pedidos y costos.
+
+El estado contiene, por usuario/a, la hora de su primera sesión y de su primer pedido y
+la fuente de su primera sesión (el índice de `analitica.indice`), las ganancias por
+(mes de la primera compra, mes de la compra), el número de compradores por cohorte y por
+(cohorte, fuente de adquisición) y los costos por (mes, source_id). A partir de él se
+reconstruyen `report`, el LTV, el CAC y el ROMI sin volver a leer el historial completo.
+
+Las particiones deben llegar en orden cronológico: un pedido anterior al primer pedido
+ya registrado de un/una usuario/a cambiaría su cohorte y se rechaza con `ValueError`.
+Los nombres de partición se ordenan alfabéticamente, por lo que se recomienda usar
+fechas ISO (`2018-06-01.csv`). Se leen las particiones escritas con
+`analitica.particiones.write_partitions()` (Parquet o CSV, según su `meta.json`) y los
+archivos `.csv` o `.parquet` copiados a mano en la misma estructura.
+
+El archivo del estado guarda su versión de formato (`STATE_FORMAT`); un estado de otra
+versión se rechaza con `ValueError` y hay que reconstruirlo desde las particiones.
+'''
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from analitica import atribucion, cohortes
+from analitica.calendario import MONTH_DTYPE, month_codes
+from analitica.carga import read_csv_typed
+from analitica.indice import FIELDS, FirstTouchIndex
+
+
+# subdirectorios con las particiones de cada registro
+PARTITION_DIRS = {'visits': 'visits_log_us', 'orders': 'orders_log_us', 'costs': 'costs_us'}
+
+# manifiesto (frecuencia, formato y particiones) que escribe analitica.particiones.write_partitions()
+PARTITION_META = 'meta.json'
+
+# formatos de las particiones sin manifiesto
+PARTITION_FORMATS = ('csv', 'parquet')
+
+# versión del formato del archivo del estado; cambia cada vez que cambian sus arreglos
+STATE_FORMAT = 3
+
+
+class CohortState:
+    '''
+    Estado persistente del análisis de cohortes.
+    '''
+
+    def __init__(self):
+        self.index = FirstTouchIndex()
+        self.cohorts = pd.DataFrame({'first_order_month': pd.Series(dtype=MONTH_DTYPE),
+                                     'order_month': pd.Series(dtype=MONTH_DTYPE),
+                                     'revenue': pd.Series(dtype='float64')})
+        self.cohort_sizes = pd.Series(dtype='int64', index=pd.Index([], dtype=MONTH_DTYPE), name='n_buyers')
+        self.cohort_sources = pd.DataFrame({'first_order_month': pd.Series(dtype=MONTH_DTYPE),
+                                            'source_id': pd.Series(dtype='int64'),
+                                            'n_buyers': pd.Series(dtype='int64')})
+        self.costs = pd.DataFrame({'month': pd.Series(dtype=MONTH_DTYPE),
+                                   'source_id': pd.Series(dtype='int64'),
+                                   'costs': pd.Series(dtype='float64')})
+        self.partitions = set()
+
+    def add_visits(self, visits):
+        '''
+        Procesa un bloque de visitas con las columnas del CSV (`Uid`, `Start Ts`, `Source Id`,
+        `Device`).
+        '''
+        self.index.add_visits(visits['Uid'], visits['Start Ts'], visits['Source Id'], visits['Device'])
+
+    def add_orders(self, orders):
+        '''
+        Procesa un bloque de pedidos con las columnas del CSV (`Uid`, `Buy Ts`, `Revenue`).
+        '''
+        uids = orders['Uid'].to_numpy(dtype=np.uint64)
+        buy = orders['Buy Ts'].to_numpy(dtype='datetime64[ns]')
+        months = month_codes(buy)
+        known = self.index.cohort_months(uids, 'order')
+        found = known >= 0
+        if np.any(months[found] < known[found]):
+            raise ValueError('hay pedidos anteriores al primer pedido registrado; '
+                             'las particiones deben procesarse en orden cronológico')
+        self.index.add_orders(uids, buy, orders['Revenue'])
+        # el mes de la primera compra de los compradores nuevos es el mínimo dentro del bloque
+        first_month = self.index.cohort_months(uids, 'order')
+        new_uids = np.unique(uids[~found])
+        new_months = self.index.cohort_months(new_uids, 'order')
+        batch = pd.DataFrame({'first_order_month': first_month,
+                              'order_month': months,
+                              'revenue': orders['Revenue'].to_numpy()})
+        batch = batch.groupby(['first_order_month', 'order_month'])['revenue'].sum().reset_index()
+        self.cohorts = (pd.concat([self.cohorts, batch])
+                        .groupby(['first_order_month', 'order_month'])['revenue'].sum().reset_index())
+        sizes = pd.Series(new_months).value_counts()
+        self.cohort_sizes = self.cohort_sizes.add(sizes, fill_value=0).astype('int64').rename('n_buyers')
+        # los compradores nuevos se atribuyen a la fuente de su primera sesión
+        sources = self.index.lookup(new_uids, 'first_source_id')
+        batch = pd.DataFrame({'first_order_month': new_months, 'source_id': sources, 'n_buyers': 1})
+        self.cohort_sources = (pd.concat([self.cohort_sources, batch[batch['source_id'] >= 0]])
+                               .groupby(['first_order_month', 'source_id'])['n_buyers'].sum().reset_index())
+
+    def add_costs(self, costs):
+        '''
+        Procesa un bloque de costos con las columnas del CSV (`source_id`, `dt`, `costs`).
+        '''
+        self.costs = (pd.concat([self.costs, atribucion.monthly_costs(costs)])
+                      .groupby(['month', 'source_id'])['costs'].sum().reset_index())
+
+    def ingest(self, partition, visits=None, orders=None, costs=None):
+        '''
+        Procesa una partición con sus bloques de visitas, pedidos y costos. Si la partición
+        ya se había procesado no se hace nada y se devuelve False.
+        '''
+        if partition in self.partitions:
+            return False
+        if visits is not None:
+            self.add_visits(visits)
+        if orders is not None:
+            self.add_orders(orders)
+        if costs is not None:
+            self.add_costs(costs)
+        self.partitions.add(partition)
+        return True
+
+    def _first_months(self, event, column):
+        # mes de la primera sesión o del primer pedido de los/las usuarios/as que lo tienen
+        months = self.index.cohort_months(self.index.uids, event)
+        present = months >= 0
+        return pd.DataFrame({'uid': self.index.uids[present], column: months[present]})
+
+    def first_session_dates(self):
+        return self._first_months('session', 'first_session_month')
+
+    def first_buy_dates(self):
+        return self._first_months('order', 'first_buy_month')
+
+    def cohort_sizes_frame(self):
+        sizes = self.cohort_sizes.sort_index().rename_axis('first_order_month').reset_index()
+        sizes.columns = ['first_order_month', 'n_buyers']
+        return sizes
+
+    def report(self):
+        '''
+        Devuelve el `report` del informe de ventas (tamaño, ganancias, edad y LTV por cohorte).
+        '''
+        return cohortes.cohort_report(self.cohort_sizes_frame(), self.cohorts)
+
+    def tables(self):
+        '''
+        Devuelve un diccionario con `report`, `result` (LTV), `report_with_costs`,
+        `cohort_cac`, `cac_by_source` y `result_romi`. Si todavía no se procesó ningún pedido
+        no hay cohortes y se lanza `ValueError`.
+        '''
+        if self.cohorts.empty:
+            raise ValueError(f'el estado no tiene pedidos ({len(self.partitions)} particiones procesadas); '
+                             'hay que procesar particiones de orders_log_us con update() o ingest()')
+        report = self.report()
+        attribution = atribucion.attribute_costs(report, self.cohort_sources, self.costs)
+        return dict(attribution,
+                    report=report,
+                    result=cohortes.ltv_table(report),
+                    result_romi=cohortes.romi_table(attribution['report_with_costs']))
+
+    def save(self, path):
+        '''
+        Guarda el estado en un archivo `.npz`.
+        '''
+        tmp_path = path + '.tmp.npz'
+        index = {'index_' + name: values for name, values in self.index.columns.items()}
+        np.savez(tmp_path, format=STATE_FORMAT,
+                 index_uids=self.index.uids, index_devices=np.array(self.index.devices, dtype=str), **index,
+                 cohort_first=self.cohorts['first_order_month'].to_numpy(dtype=MONTH_DTYPE),
+                 cohort_month=self.cohorts['order_month'].to_numpy(dtype=MONTH_DTYPE),
+                 cohort_revenue=self.cohorts['revenue'].to_numpy(),
+                 size_month=self.cohort_sizes.index.to_numpy(dtype=MONTH_DTYPE),
+                 size_buyers=self.cohort_sizes.to_numpy(),
+                 cohort_source_month=self.cohort_sources['first_order_month'].to_numpy(dtype=MONTH_DTYPE),
+                 cohort_source_id=self.cohort_sources['source_id'].to_numpy(),
+                 cohort_source_buyers=self.cohort_sources['n_buyers'].to_numpy(),
+                 costs_month=self.costs['month'].to_numpy(dtype=MONTH_DTYPE),
+                 costs_source=self.costs['source_id'].to_numpy(),
+                 costs_value=self.costs['costs'].to_numpy(),
+                 partitions=np.array(sorted(self.partitions), dtype=str))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Carga el estado guardado con `save()`; si el archivo no existe devuelve un estado vacío.
+        Un estado guardado con otra versión del formato se rechaza con `ValueError`.
+        '''
+        state = cls()
+        if not os.path.exists(path):
+            return state
+        with np.load(path) as data:
+            version = int(data['format']) if 'format' in data.files else None
+            if version != STATE_FORMAT:
+                raise ValueError(f'el estado {path} tiene el formato {version} y se espera el {STATE_FORMAT}; '
+                                 'hay que borrarlo y reconstruirlo desde las particiones')
+            state.index = FirstTouchIndex(data['index_uids'], {name: data['index_' + name] for name in FIELDS},
+                                          data['index_devices'].tolist())
+            state.cohorts = pd.DataFrame({'first_order_month': data['cohort_first'],
+                                          'order_month': data['cohort_month'],
+                                          'revenue': data['cohort_revenue']})
+            state.cohort_sizes = pd.Series(data['size_buyers'], index=pd.Index(data['size_month']),
+                                           name='n_buyers')
+            state.costs = pd.DataFrame({'month': data['costs_month'],
+                                        'source_id': data['costs_source'],
+                                        'costs': data['costs_value']})
+            state.cohort_sources = pd.DataFrame({'first_order_month': data['cohort_source_month'],
+                                                 'source_id': data['cohort_source_id'],
+                                                 'n_buyers': data['cohort_source_buyers']})
+            state.partitions = set(data['partitions'].tolist())
+        return state
+
+
+def partition_files(root, folder):
+    '''
+    Función que devuelve {partición: ruta} de los archivos del registro `folder` en `root`.
+    Si el directorio tiene el `meta.json` de `analitica.particiones.write_partitions()` se
+    usan sus particiones y su formato; si no, los archivos `.csv` y `.parquet`.
+    '''
+    directory = os.path.join(root, folder)
+    if not os.path.isdir(directory):
+        return {}
+    meta_path = os.path.join(directory, PARTITION_META)
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        return {name: os.path.join(directory, f"{name}.{meta['fmt']}") for name in meta['partitions']}
+    files = {}
+    for filename in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(filename)
+        if extension[1:] not in PARTITION_FORMATS:
+            continue
+        if name in files:
+            raise ValueError(f'la partición {name} de {directory} está en más de un formato')
+        files[name] = os.path.join(directory, filename)
+    return files
+
+
+def read_partition(path, folder):
+    '''
+    Función que lee una partición del registro `folder` (CSV o Parquet) con los tipos de
+    `analitica.carga`.
+    '''
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return read_csv_typed(path, table=folder)
+
+
+def pending_partitions(root, state):
+    '''
+    Función que devuelve, en orden, las particiones de `root` que aún no están en el estado.
+    '''
+    names = set()
+    for folder in PARTITION_DIRS.values():
+        names.update(partition_files(root, folder))
+    return sorted(names - state.partitions)
+
+
+def update(state_path, root):
+    '''
+    Función que carga el estado, procesa las particiones nuevas de `root` y guarda el estado.
+
+    Se espera la estructura `root/visits_log_us/<partición>.<formato>`,
+    `root/orders_log_us/<partición>.<formato>` y `root/costs_us/<partición>.<formato>`, como
+    la que escribe `analitica.particiones.write_partitions()` (ver `partition_files()`);
+    una partición puede no tener los tres archivos.
+    '''
+    state = CohortState.load(state_path)
+    files = {kind: partition_files(root, folder) for kind, folder in PARTITION_DIRS.items()}
+    for partition in pending_partitions(root, state):
+        blocks = {kind: read_partition(files[kind][partition], PARTITION_DIRS[kind])
+                  for kind in PARTITION_DIRS if partition in files[kind]}
+        state.ingest(partition, **blocks)
+    state.save(state_path)
+    return state
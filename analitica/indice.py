@@ -0,0 +1,251 @@
+'''
+Índice persistente del primer contacto y de la primera compra de cada usuario/a.
+
+El índice guarda, por `uid`, la hora de la primera sesión, su fuente de anuncios
+(`source_id`) y su dispositivo, y la hora y las ganancias del primer pedido, como arreglos
+de ancho fijo ordenados por `uid`. La cohorte de cualquier fila (el mes de la primera
+sesión o del primer pedido de su usuario/a) se obtiene con una búsqueda binaria
+(`np.searchsorted`) en lugar de agrupar todo el registro por `uid` y unir el resultado.
+
+El índice se actualiza con bloques nuevos de visitas o de pedidos sin volver a leer el
+historial: en cada bloque se toma la primera fila de cada usuario/a (entre filas a la misma
+hora, la primera del bloque) y sólo se reemplaza lo guardado si es anterior, por lo que
+los bloques pueden llegar en cualquier orden. Los `uid` nuevos de un bloque no se insertan
+en los arreglos completos (eso copiaría todo el índice en cada bloque): forman un tramo
+ordenado aparte y los tramos se unen cuando el anterior no es al menos el doble del último,
+así que hay O(log n) tramos, cada `uid` se copia O(log n) veces en total y un bloque
+cuesta O(b log n) amortizado en lugar de O(n). Los valores faltantes (usuarios/as sin
+visitas o sin pedidos) son el máximo de int64 en las horas, -1 en los códigos y NaN en las
+ganancias.
+
+Uso:
+    python -m analitica.indice --index files/cache/primeros.npz \
+        --visits /datasets/visits_log_us.csv --orders /datasets/orders_log_us.csv
+'''
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from analitica.calendario import MONTH_DTYPE, month_codes
+from analitica.carga import CACHE_DIR, read_csv_typed
+
+
+# archivo por defecto del índice
+INDEX_PATH = os.path.join(CACHE_DIR, 'primeros.npz')
+
+# columnas del índice: (tipo de datos, valor faltante)
+FIELDS = {
+    'first_session_ts': (np.int64, np.iinfo(np.int64).max),
+    'first_source_id': (np.int64, -1),
+    'first_device': (np.int8, -1),
+    'first_order_ts': (np.int64, np.iinfo(np.int64).max),
+    'first_order_revenue': (np.float64, np.nan),
+}
+
+# columnas que se actualizan con cada tipo de bloque; la primera es la hora
+SESSION_FIELDS = ['first_session_ts', 'first_source_id', 'first_device']
+ORDER_FIELDS = ['first_order_ts', 'first_order_revenue']
+
+
+def _ns(timestamps):
+    return np.asarray(timestamps, dtype='datetime64[ns]').view(np.int64)
+
+
+def _first_rows(uids, times):
+    # primera fila de cada uid (la de menor hora; entre iguales, la primera) ordenada por uid
+    order = np.lexsort((times, uids))
+    sorted_uids = uids[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_uids[1:] != sorted_uids[:-1]
+    return order[first]
+
+
+class FirstTouchIndex:
+    '''
+    Índice de primeros contactos ordenado por `uid`, guardado en tramos ordenados con `uid`
+    distintos. `devices` son los nombres de los códigos de `first_device`.
+    '''
+
+    def __init__(self, uids=None, columns=None, devices=None):
+        uids = np.empty(0, dtype=np.uint64) if uids is None else np.asarray(uids, dtype=np.uint64)
+        columns = columns or {}
+        run = {'uids': uids}
+        run.update({name: np.asarray(columns[name], dtype=dtype) if name in columns
+                    else np.full(len(uids), missing, dtype=dtype)
+                    for name, (dtype, missing) in FIELDS.items()})
+        self._runs = [run] if len(uids) else []
+        self.devices = list(devices or [])
+
+    def __len__(self):
+        return sum(len(run['uids']) for run in self._runs)
+
+    def _compact(self, full=False):
+        # une los dos últimos tramos mientras el anterior no sea al menos el doble del último
+        # (o todos, con `full`); los uid de los tramos son distintos, así que basta reordenar
+        while len(self._runs) > 1 and (full or len(self._runs[-2]['uids']) < 2 * len(self._runs[-1]['uids'])):
+            last = self._runs.pop()
+            previous = self._runs.pop()
+            order = np.argsort(np.concatenate([previous['uids'], last['uids']]), kind='stable')
+            self._runs.append({name: np.concatenate([previous[name], last[name]])[order] for name in previous})
+
+    def _merged(self):
+        # todo el índice en un solo tramo
+        self._compact(full=True)
+        return self._runs[0] if self._runs else self._empty_run()
+
+    @staticmethod
+    def _empty_run():
+        run = {'uids': np.empty(0, dtype=np.uint64)}
+        run.update({name: np.empty(0, dtype=dtype) for name, (dtype, _) in FIELDS.items()})
+        return run
+
+    @property
+    def uids(self):
+        return self._merged()['uids']
+
+    @property
+    def columns(self):
+        run = self._merged()
+        return {name: run[name] for name in FIELDS}
+
+    def _matches(self, uids):
+        # por cada tramo, la posición de cada `uid` en él y la máscara de los que están
+        for run in self._runs:
+            keys = run['uids']
+            position = np.minimum(np.searchsorted(keys, uids), len(keys) - 1)
+            yield run, position, keys[position] == uids
+
+    def _merge(self, fields, uids, values):
+        # `values` son las columnas `fields` de la primera fila de cada uid del bloque
+        times = values[fields[0]]
+        seen = np.zeros(len(uids), dtype=bool)
+        for run, position, found in self._matches(uids):
+            known = position[found]
+            earlier = times[found] < run[fields[0]][known]
+            for name in fields:
+                run[name][known[earlier]] = values[name][found][earlier]
+            seen |= found
+        # los uid nuevos forman un tramo nuevo; sus otras columnas quedan faltantes
+        new = ~seen
+        if new.any():
+            run = {'uids': uids[new]}
+            run.update({name: values[name][new] if name in fields else np.full(int(new.sum()), missing, dtype=dtype)
+                        for name, (dtype, missing) in FIELDS.items()})
+            self._runs.append(run)
+            self._compact()
+        return uids[new]
+
+    def add_visits(self, uids, start_ts, source_ids, devices):
+        '''
+        Actualiza el índice con un bloque de visitas. Devuelve los `uid` (ordenados) de los/las
+        usuarios/as que no estaban en el índice.
+        '''
+        uids = np.asarray(uids, dtype=np.uint64)
+        start = _ns(start_ts)
+        rows = _first_rows(uids, start)
+        names = pd.Series(np.asarray(devices)[rows]).astype(str)
+        for name in sorted(set(names) - set(self.devices)):
+            self.devices.append(name)
+        codes = pd.Index(self.devices).get_indexer(names).astype(np.int8)
+        values = {'first_session_ts': start[rows],
+                  'first_source_id': np.asarray(source_ids).astype(np.int64)[rows],
+                  'first_device': codes}
+        return self._merge(SESSION_FIELDS, uids[rows], values)
+
+    def add_orders(self, uids, buy_ts, revenue):
+        '''
+        Actualiza el índice con un bloque de pedidos. Devuelve los `uid` (ordenados) de los/las
+        usuarios/as que no estaban en el índice.
+        '''
+        uids = np.asarray(uids, dtype=np.uint64)
+        buy = _ns(buy_ts)
+        rows = _first_rows(uids, buy)
+        values = {'first_order_ts': buy[rows],
+                  'first_order_revenue': np.asarray(revenue, dtype=np.float64)[rows]}
+        return self._merge(ORDER_FIELDS, uids[rows], values)
+
+    def lookup(self, uids, field):
+        '''
+        Devuelve el valor de `field` para cada `uid` (una fila de un registro, por ejemplo);
+        los `uid` que no están en el índice reciben el valor faltante.
+        '''
+        dtype, missing = FIELDS[field]
+        uids = np.asarray(uids, dtype=np.uint64)
+        values = np.full(len(uids), missing, dtype=dtype)
+        for run, position, found in self._matches(uids):
+            values[found] = run[field][position[found]]
+        return values
+
+    def cohort_months(self, uids, event='order'):
+        '''
+        Devuelve el código de mes (`analitica.calendario`) de la primera sesión
+        (`event='session'`) o del primer pedido (`event='order'`) de cada `uid`; -1 si no lo tiene.
+        '''
+        field = {'session': 'first_session_ts', 'order': 'first_order_ts'}[event]
+        times = self.lookup(uids, field)
+        present = times != FIELDS[field][1]
+        months = np.full(len(times), -1, dtype=MONTH_DTYPE)
+        months[present] = month_codes(times[present].view('datetime64[ns]'))
+        return months
+
+    def frame(self):
+        '''
+        Devuelve el índice como tabla, con las horas como fechas (NaT si faltan) y el
+        dispositivo como category.
+        '''
+        run = self._merged()
+        table = pd.DataFrame({'uid': run['uids']})
+        for name in ('first_session_ts', 'first_order_ts'):
+            times = run[name].copy()
+            times[times == FIELDS[name][1]] = np.iinfo(np.int64).min
+            table[name] = times.view('datetime64[ns]')
+        table['first_source_id'] = run['first_source_id']
+        table['first_device'] = pd.Categorical.from_codes(run['first_device'], self.devices)
+        table['first_order_revenue'] = run['first_order_revenue']
+        return table
+
+    def save(self, path):
+        '''
+        Guarda el índice en un archivo `.npz`.
+        '''
+        tmp_path = path + '.tmp.npz'
+        run = self._merged()
+        np.savez(tmp_path, devices=np.array(self.devices, dtype=str), **run)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Carga el índice guardado con `save()`; si el archivo no existe devuelve un índice vacío.
+        '''
+        if not os.path.exists(path):
+            return cls()
+        with np.load(path) as data:
+            return cls(data['uids'], {name: data[name] for name in FIELDS}, data['devices'].tolist())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--index', default=INDEX_PATH, help='archivo del índice (se crea si no existe)')
+    parser.add_argument('--visits', nargs='*', default=[], help='bloques de visitas (CSV)')
+    parser.add_argument('--orders', nargs='*', default=[], help='bloques de pedidos (CSV)')
+    args = parser.parse_args()
+
+    index = FirstTouchIndex.load(args.index)
+    for path in args.visits:
+        visits = read_csv_typed(path, table='visits_log_us')
+        added = index.add_visits(visits['Uid'], visits['Start Ts'], visits['Source Id'], visits['Device'])
+        print(f'{path}: {len(visits)} visitas, {len(added)} usuarios/as nuevos/as')
+    for path in args.orders:
+        orders = read_csv_typed(path, table='orders_log_us')
+        added = index.add_orders(orders['Uid'], orders['Buy Ts'], orders['Revenue'])
+        print(f'{path}: {len(orders)} pedidos, {len(added)} usuarios/as nuevos/as')
+    os.makedirs(os.path.dirname(args.index) or '.', exist_ok=True)
+    index.save(args.index)
+    print(f'{args.index}: {len(index)} usuarios/as')
+
+
+if __name__ == '__main__':
+    main()
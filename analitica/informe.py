@@ -0,0 +1,164 @@
+'''
+Informe por lotes, sin interfaz gráfica: calcula todas las tablas, las guarda y después grafica.
+
+Primero se ejecutan todas las etapas de `analitica.pipeline` y se escriben las tablas en
+CSV (y las métricas sueltas en `metricas.json`); sólo entonces se dibujan los histogramas,
+mapas de calor y gráficos de líneas del cuaderno, cada uno en un proceso del grupo y con
+el backend no interactivo Agg, de modo que ningún gráfico bloquea ni retrasa los cálculos.
+Con `--no-plots` no se importa matplotlib y sólo se escriben las tablas.
+
+Uso:
+    python -m analitica.informe --output files/informe
+    python -m analitica.informe --output files/informe --no-plots --profile perfil.json
+'''
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from analitica import pipeline
+
+
+# tablas del contexto que se guardan como CSV
+TABLES = [
+    'sessions_per_user', 'session_duration', 'session_duration_histogram',
+    'first_session_cohort', 'convertion_time_cohort', 'order_period', 'result',
+    'source_costs', 'report_with_costs', 'cohort_cac', 'cac_by_source', 'result_romi',
+]
+
+# métricas escalares que se guardan en metricas.json
+METRICS = ['dau_total', 'wau_total', 'mau_total', 'sticky_wau', 'sticky_mau']
+
+# (nombre del archivo, tabla, tipo de gráfico, opciones) de cada figura del cuaderno
+FIGURES = [
+    ('sesiones_por_usuario', 'sessions_per_user', 'hist',
+     {'column': 'sess_per_user', 'bins': 100, 'figsize': (12, 8), 'title': 'Número de sesiones por usuario',
+      'xlabel': 'Número de Sesiones por Día', 'ylabel': 'Frecuencia'}),
+    ('duracion_sesiones', 'session_duration_histogram', 'stairs',
+     {'figsize': (10, 6), 'title': 'Duración de las Sesiones',
+      'xlabel': 'Duración de las Sesiones en Minutos', 'ylabel': 'Frecuencia'}),
+    ('cohortes_primera_sesion', 'first_session_cohort', 'heatmap',
+     {'fmt': 'g', 'figsize': (18, 9), 'title': 'Cantidad de Usuarios por Primer Pedido',
+      'xlabel': 'Categoría de conversión'}),
+    ('cohortes_tiempo_conversion', 'convertion_time_cohort', 'heatmap',
+     {'fmt': 'g', 'figsize': (18, 9), 'title': '',
+      'xlabel': 'Fuente de anuncios de la que proviene el usuario'}),
+    ('pedidos_por_mes', 'order_period', 'line',
+     {'x': 'order_month', 'y': 'n_orders', 'figsize': (12, 8), 'rot': 90, 'color': 'darkcyan',
+      'title': 'Pedidos de los Usuarios por Mes', 'xlabel': 'Mes del Pedido',
+      'ylabel': 'Cantidad Total de Pedidos'}),
+    ('ltv', 'result', 'heatmap',
+     {'fmt': '0.1f', 'figsize': (16, 9), 'title': 'LTV promedio de los/las Clientes.',
+      'xlabel': 'Edad de la Cohorte'}),
+    ('costos', 'source_costs', 'line',
+     {'figsize': (12, 8), 'color': 'darkblue', 'title': 'Costos Totales a lo largo del tiempo',
+      'xlabel': 'Fecha', 'ylabel': 'Cantidad Total de Costos'}),
+    ('cac_por_fuente', 'cac_by_source', 'bar',
+     {'figsize': (10, 6), 'rot': 0, 'color': 'darkblue', 'title': 'Costo de Adquisición por Fuente del Anuncio',
+      'xlabel': 'Fuente del Anuncio', 'ylabel': 'Costo de Adquisición'}),
+    ('romi', 'result_romi', 'heatmap',
+     {'fmt': '0.0f', 'figsize': (16, 9), 'title': 'ROMI promedio de los/las Clientes.',
+      'xlabel': 'Edad de la Cohorte'}),
+]
+
+
+def _scalar(value):
+    # las métricas pueden venir como escalares de NumPy o como Series de un elemento
+    if isinstance(value, pd.Series):
+        value = value.iloc[0]
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def write_tables(context, directory, tables=TABLES, metrics=METRICS):
+    '''
+    Función que guarda en `directory` las tablas del contexto como CSV y las métricas
+    escalares en `metricas.json`. Devuelve las rutas escritas.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name in tables:
+        path = os.path.join(directory, name + '.csv')
+        context[name].to_csv(path)
+        paths.append(path)
+    path = os.path.join(directory, 'metricas.json')
+    with open(path, 'w') as f:
+        json.dump({name: _scalar(context[name]) for name in metrics}, f, indent=2)
+    paths.append(path)
+    return paths
+
+
+def _use_agg():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def render_figure(kind, data, path, options):
+    '''
+    Función que dibuja una figura con el backend Agg y la guarda en `path`.
+    '''
+    _use_agg()
+    import matplotlib.pyplot as plt
+
+    options = dict(options)
+    title = options.pop('title', '')
+    xlabel = options.pop('xlabel', None)
+    ylabel = options.pop('ylabel', None)
+    figure, ax = plt.subplots(figsize=options.pop('figsize', None))
+    if kind == 'heatmap':
+        import seaborn as sns
+        sns.heatmap(data, annot=True, fmt=options.pop('fmt'), cmap='crest', linewidth=.01, ax=ax)
+        ax.set_title(title, fontsize=16)
+        ax.set_xlabel(xlabel, fontsize=14)
+    else:
+        if kind == 'hist':
+            data[options.pop('column')].plot(kind='hist', bins=options.pop('bins'), color='darkcyan', ax=ax)
+        elif kind == 'stairs':
+            ax.stairs(data['count'], np.append(data['left'].to_numpy(), data['right'].iloc[-1]),
+                      fill=True, color='darkcyan')
+        else:
+            data.plot(kind=kind, fontsize=12, ax=ax, **options)
+        ax.set_title(title, fontsize=15)
+        ax.set_xlabel(xlabel, fontsize=15)
+        ax.set_ylabel(ylabel, fontsize=15)
+    figure.savefig(path, bbox_inches='tight')
+    plt.close(figure)
+    return path
+
+
+def render_figures(context, directory, figures=FIGURES, workers=None):
+    '''
+    Función que dibuja las `figures` en `directory` como PNG, repartidas entre `workers`
+    procesos (en este mismo proceso si `workers` es 1). Devuelve las rutas escritas.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    jobs = [(kind, context[table], os.path.join(directory, name + '.png'), options)
+            for name, table, kind, options in figures]
+    workers = workers or min(len(jobs), os.cpu_count() or 1)
+    if workers == 1:
+        return [render_figure(*job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_use_agg) as pool:
+        return list(pool.map(render_figure, *zip(*jobs)))
+
+
+def main():
+    parser = pipeline.add_run_arguments(argparse.ArgumentParser(description=__doc__.splitlines()[1]))
+    parser.add_argument('--output', default='files/informe', help='carpeta donde guardar tablas y figuras')
+    parser.add_argument('--no-plots', action='store_true', help='sólo calcular y guardar las tablas')
+    parser.add_argument('--workers', type=int, help='procesos para dibujar las figuras')
+    args = parser.parse_args()
+
+    # las figuras sólo usan tablas que también se guardan
+    context = pipeline.run_from_args(args, outputs=TABLES + METRICS)
+    for path in write_tables(context, os.path.join(args.output, 'tablas')):
+        print(path)
+    if args.no_plots:
+        return
+    for path in render_figures(context, os.path.join(args.output, 'figuras'), workers=args.workers):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
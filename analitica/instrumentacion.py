@@ -0,0 +1,131 @@
+'''
+Instrumentación de las etapas del análisis: tiempo, CPU, memoria y filas por etapa.
+
+`Instrumentation.stage()` es un administrador de contexto que registra, para cada etapa:
+el tiempo de reloj y de CPU, el pico de memoria residente (RSS) del proceso, las filas
+de entrada y de salida y, si se activa `memory=True`, los bytes asignados según
+`tracemalloc` (que tiene un costo apreciable, por eso es opcional).
+
+Cualquier objeto con un método `stage(name, inputs)` que devuelva un administrador de
+contexto sirve como instrumentación para `analitica.pipeline.run()`; si no se pasa
+ninguna, las etapas se ejecutan sin medir nada.
+
+Los registros se pueden guardar como reporte JSON (`to_json`), como traza de eventos
+de Chrome/Perfetto (`to_trace`) o como pilas plegadas para flamegraph.pl (`to_folded`).
+'''
+import contextlib
+import json
+import os
+import resource
+import time
+import tracemalloc
+
+
+def _rows(value):
+    # número de filas de un DataFrame o Series; None para otros objetos
+    shape = getattr(value, 'shape', None)
+    return shape[0] if shape else None
+
+
+def count_rows(values):
+    '''
+    Función que suma las filas de los DataFrame/Series de un diccionario.
+    '''
+    rows = [_rows(value) for value in values.values()]
+    return sum(row for row in rows if row is not None)
+
+
+def _reset_peak_rss():
+    # en Linux escribir 5 en clear_refs reinicia el pico de memoria residente (VmHWM)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mib():
+    '''
+    Función que devuelve el pico de memoria residente del proceso en MiB.
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Instrumentation:
+    '''
+    Registro de las mediciones de cada etapa.
+    '''
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.records = []
+        self.origin = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name, inputs=None):
+        '''
+        Mide el bloque como la etapa `name`. El diccionario que se entrega con `as` recibe
+        las salidas de la etapa en la llave `outputs` para contar sus filas.
+        '''
+        record = {'stage': name, 'rows_in': count_rows(inputs or {})}
+        per_stage_rss = _reset_peak_rss()
+        if self.memory:
+            tracemalloc.start()
+        cpu = time.process_time()
+        begin = time.perf_counter()
+        try:
+            yield record
+        finally:
+            end = time.perf_counter()
+            record['start_s'] = begin - self.origin
+            record['wall_s'] = end - begin
+            record['cpu_s'] = time.process_time() - cpu
+            if self.memory:
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                record['allocated_bytes'] = current
+                record['peak_allocated_bytes'] = peak
+            record['peak_rss_mib'] = peak_rss_mib()
+            record['peak_rss_scope'] = 'stage' if per_stage_rss else 'process'
+            record['rows_out'] = count_rows(record.pop('outputs', {}))
+            self.records.append(record)
+
+    def report(self):
+        '''
+        Devuelve las mediciones como una lista de diccionarios, una por etapa.
+        '''
+        return [dict(record) for record in self.records]
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({'stages': self.report()}, f, indent=2)
+
+    def to_trace(self, path):
+        '''
+        Guarda las etapas en el formato de eventos de Chrome (chrome://tracing, Perfetto,
+        speedscope), que se puede ver como flame graph.
+        '''
+        pid = os.getpid()
+        events = [{'name': record['stage'], 'cat': 'stage', 'ph': 'X', 'pid': pid, 'tid': 0,
+                   'ts': record['start_s'] * 1e6, 'dur': record['wall_s'] * 1e6,
+                   'args': {key: value for key, value in record.items()
+                            if key not in ('stage', 'start_s', 'wall_s')}}
+                  for record in self.records]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def to_folded(self, path, root='pipeline'):
+        '''
+        Guarda las etapas como pilas plegadas (`pipeline;etapa microsegundos`) para flamegraph.pl.
+        '''
+        with open(path, 'w') as f:
+            for record in self.records:
+                f.write(f'{root};{record["stage"]} {round(record["wall_s"] * 1e6)}\n')
@@ -0,0 +1,79 @@
+'''
+Cálculo del LTV por cohortes en varios procesos.
+
+Los pedidos se reparten entre particiones según el hash del `uid`, de modo que todos los
+pedidos de un/una usuario/a quedan en la misma partición y su mes de primera compra se
+puede calcular localmente. Cada proceso devuelve sus ganancias por (mes de la primera
+compra, mes de la compra) y sus compradores por cohorte, y los resultados parciales se
+suman para obtener `cohort_sizes`, `cohorts`, `report` y `result`.
+'''
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from analitica import cohortes
+from analitica.hll import hash_uids
+
+
+def partial_cohorts(uids, months, revenue):
+    '''
+    Función que calcula, para una partición de pedidos, las ganancias por cohorte y mes
+    de compra y el número de compradores por cohorte.
+    '''
+    orders = pd.DataFrame({'uid': uids, 'order_month': months, 'revenue': revenue})
+    first_order_month = orders.groupby('uid')['order_month'].transform('min')
+    cohorts = orders.groupby([first_order_month.rename('first_order_month'), 'order_month'])['revenue'].sum()
+    sizes = first_order_month.groupby(orders['uid']).first().value_counts()
+    return cohorts, sizes
+
+
+def split_by_uid(uids, partitions):
+    '''
+    Función que devuelve, para cada partición, las posiciones de los pedidos que le tocan.
+    '''
+    part = (hash_uids(uids) % np.uint64(partitions)).astype(np.int64)
+    order = np.argsort(part, kind='stable')
+    bounds = np.searchsorted(part[order], np.arange(1, partitions))
+    return np.split(order, bounds)
+
+
+def parallel_cohorts(orders, workers=None, partitions=None):
+    '''
+    Función que calcula `cohort_sizes` y `cohorts` repartiendo los pedidos por hash del `uid`
+    entre `workers` procesos. `orders` necesita las columnas `uid`, `order_month` (código
+    de mes) y `revenue`.
+    '''
+    workers = workers or os.cpu_count() or 1
+    partitions = partitions or workers
+    uids = orders['uid'].to_numpy(dtype=np.uint64)
+    months = orders['order_month'].to_numpy()
+    revenue = orders['revenue'].to_numpy()
+    tasks = [(uids[rows], months[rows], revenue[rows]) for rows in split_by_uid(uids, partitions)]
+    if workers == 1:
+        partials = [partial_cohorts(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            partials = list(pool.map(partial_cohorts, *zip(*tasks)))
+
+    cohorts = (pd.concat([part[0] for part in partials]).groupby(level=[0, 1]).sum()
+               .rename('revenue').reset_index())
+    cohort_sizes = pd.concat([part[1] for part in partials]).groupby(level=0).sum().sort_index()
+    cohort_sizes = cohort_sizes.rename_axis('first_order_month').rename('n_buyers').reset_index()
+    return cohort_sizes, cohorts
+
+
+def parallel_ltv(orders, workers=None, partitions=None):
+    '''
+    Función que devuelve un diccionario con `cohort_sizes`, `cohorts`, `report` y `result`
+    (LTV promedio por cohorte y edad) calculados en paralelo.
+    '''
+    cohort_sizes, cohorts = parallel_cohorts(orders, workers=workers, partitions=partitions)
+    report = cohortes.cohort_report(cohort_sizes, cohorts)
+    return {
+        'cohort_sizes': cohort_sizes,
+        'cohorts': cohorts,
+        'report': report,
+        'result': cohortes.ltv_table(report),
+    }
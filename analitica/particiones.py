@@ -0,0 +1,264 @@
+'''
+Registros particionados por mes (o por día) y consultas por rango de fechas.
+
+`write_partitions()` reparte cada registro (visitas, pedidos y costos) en un archivo por
+mes o por día, según la fecha de la sesión, del pedido o del gasto:
+
+    root/visits_log_us/2017-06.parquet
+    root/orders_log_us/2017-06.parquet
+    root/costs_us/2017-06.parquet
+
+Dentro de cada partición las filas quedan ordenadas por fecha (de forma estable). Los
+nombres son fechas ISO, así que se ordenan cronológicamente; sin pyarrow (o con
+`fmt='csv'`) las particiones se escriben como CSV con la misma estructura que procesa
+`analitica.incremental.update()`.
+
+Cada registro se escribe completo en `root/<registro>.tmp` con un `meta.json` (frecuencia,
+formato y lista de particiones) y luego reemplaza al directorio anterior, como el almacén
+de `analitica.almacen`: volver a particionar con otra frecuencia u otro formato no deja
+archivos viejos junto a los nuevos. Las lecturas sólo usan las particiones de `meta.json`.
+
+`PartitionedLog.read()` recibe un rango de fechas y filtros de fuente (`source_id`) y de
+dispositivo (`device`), lee sólo las particiones que se cruzan con el rango y, en Parquet,
+aplica los filtros al leer. `window_report()` ejecuta las etapas de `analitica.pipeline`
+sobre esa ventana, de modo que el DAU, la conversión o el CAC de una campaña de unas
+semanas cuestan lo que la ventana y no lo que el historial completo. Los pedidos no
+tienen fuente ni dispositivo: sólo se filtran por fecha.
+
+Uso:
+    python -m analitica.particiones write --root files/particiones
+    python -m analitica.particiones report --root files/particiones --start 2017-11-01 \
+        --end 2017-11-30 --source-id 3 --outputs dau_total cac_by_source
+'''
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from analitica import pipeline
+from analitica.carga import SCHEMAS, read_csv_typed
+from analitica.dag import Graph
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:  # sin pyarrow las particiones se escriben como CSV
+    pyarrow = None
+
+
+# columna de fecha por la que se particiona cada registro
+TIME_COLUMNS = {'visits_log_us': 'Start Ts', 'orders_log_us': 'Buy Ts', 'costs_us': 'dt'}
+
+# columnas de cada registro sobre las que se puede filtrar
+FILTER_COLUMNS = {
+    'visits_log_us': {'source_id': 'Source Id', 'device': 'Device'},
+    'orders_log_us': {},
+    'costs_us': {'source_id': 'source_id'},
+}
+
+# formato de fecha del nombre de cada partición
+FREQUENCIES = {'month': '%Y-%m', 'day': '%Y-%m-%d'}
+
+# frecuencia, formato y particiones de cada registro
+_META = 'meta.json'
+
+# las etapas del análisis sin las cargas: las tablas llegan ya leídas de la ventana
+WINDOW_GRAPH = Graph([stage for stage in pipeline.STAGES if stage[0] not in pipeline.LOAD_STAGES],
+                     volatile=['uids'])
+
+
+def write_partitions(path, root, table, freq='month', fmt=None):
+    '''
+    Función que reparte el CSV `path` del registro `table` en particiones por mes o por día
+    (`freq`) dentro de `root/table`. `fmt` es 'parquet' o 'csv'; por omisión, Parquet si
+    está instalado pyarrow. Devuelve los nombres de las particiones escritas.
+    '''
+    fmt = fmt or ('csv' if pyarrow is None else 'parquet')
+    data = read_csv_typed(path, table=table)
+    dates = data[TIME_COLUMNS[table]]
+    data = data.iloc[np.argsort(dates.to_numpy(), kind='stable')]
+    names = data[TIME_COLUMNS[table]].dt.strftime(FREQUENCIES[freq])
+    directory = os.path.join(root, table)
+    tmp_dir = directory + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    written = []
+    for name, partition in data.groupby(names.to_numpy(), sort=True):
+        target = os.path.join(tmp_dir, f'{name}.{fmt}')
+        if fmt == 'parquet':
+            partition.to_parquet(target, index=False)
+        else:
+            partition.to_csv(target, index=False)
+        written.append(name)
+    with open(os.path.join(tmp_dir, _META), 'w') as f:
+        json.dump({'freq': freq, 'fmt': fmt, 'partitions': written}, f)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+    return written
+
+
+def partition_range(name):
+    '''
+    Función que devuelve el intervalo [inicio, fin) de fechas que cubre una partición por
+    su nombre ('2017-06' o '2017-06-01').
+    '''
+    start = pd.Timestamp(name if len(name) > 7 else name + '-01')
+    return start, start + (pd.Timedelta(days=1) if len(name) > 7 else pd.offsets.MonthBegin(1))
+
+
+def _bounds(start, end):
+    # el rango incluye los días `start` y `end` completos
+    start = None if start is None else pd.Timestamp(start).normalize()
+    end = None if end is None else pd.Timestamp(end).normalize() + pd.Timedelta(days=1)
+    return start, end
+
+
+def _as_list(values, kind):
+    # valores del filtro con el tipo de la columna (las fuentes son enteros, los dispositivos textos)
+    return None if values is None else [kind(value) for value in np.atleast_1d(values)]
+
+
+class PartitionedLog:
+    '''
+    Registros particionados escritos con `write_partitions()` en `root`. Si se dan `freq` o
+    `fmt`, los registros tienen que estar escritos con esa frecuencia y ese formato.
+    '''
+
+    def __init__(self, root, freq=None, fmt=None):
+        self.root = root
+        self.freq = freq
+        self.fmt = fmt
+
+    def meta(self, table):
+        '''
+        Devuelve la frecuencia, el formato y las particiones de `table` según su `meta.json`;
+        sin `meta.json` (un directorio que no escribió `write_partitions()`) o con otra
+        frecuencia u otro formato que los pedidos se lanza `ValueError`.
+        '''
+        path = os.path.join(self.root, table, _META)
+        if not os.path.exists(path):
+            raise ValueError(f'{os.path.dirname(path)} no tiene {_META}; hay que escribirlo con write_partitions()')
+        with open(path) as f:
+            meta = json.load(f)
+        for key, expected in (('freq', self.freq), ('fmt', self.fmt)):
+            if expected is not None and meta[key] != expected:
+                raise ValueError(f'{table} está particionado con {key}={meta[key]!r} y se pidió {expected!r}')
+        return meta
+
+    def partitions(self, table, start=None, end=None):
+        '''
+        Devuelve, en orden, las rutas de las particiones de `table` que se cruzan con el
+        rango de fechas [`start`, `end`] (los dos días incluidos).
+        '''
+        start, end = _bounds(start, end)
+        meta = self.meta(table)
+        paths = []
+        for name in meta['partitions']:
+            first, last = partition_range(name)
+            if (start is None or last > start) and (end is None or first < end):
+                paths.append(os.path.join(self.root, table, f"{name}.{meta['fmt']}"))
+        return paths
+
+    def read(self, table, start=None, end=None, source_id=None, device=None, columns=None):
+        '''
+        Lee las filas de `table` entre los días `start` y `end` (incluidos) de las fuentes
+        `source_id` y los dispositivos `device` (uno o varios; todos si es None), con los
+        tipos de datos de `analitica.carga`.
+        '''
+        time_column = TIME_COLUMNS[table]
+        bounds = _bounds(start, end)
+        wanted = {'source_id': _as_list(source_id, int), 'device': _as_list(device, str)}
+        filters = [(FILTER_COLUMNS[table][key], 'in', values)
+                   for key, values in wanted.items() if values is not None and key in FILTER_COLUMNS[table]]
+        if bounds[0] is not None:
+            filters.append((time_column, '>=', bounds[0]))
+        if bounds[1] is not None:
+            filters.append((time_column, '<', bounds[1]))
+
+        frames = []
+        for path in self.partitions(table, start, end):
+            if path.endswith('.parquet'):
+                frames.append(pd.read_parquet(path, columns=columns, filters=filters or None))
+                continue
+            frame = read_csv_typed(path, table=table)
+            mask = np.ones(len(frame), dtype=bool)
+            for column, operator, value in filters:
+                if operator == 'in':
+                    mask &= frame[column].isin(value).to_numpy()
+                elif operator == '>=':
+                    mask &= (frame[column] >= value).to_numpy()
+                else:
+                    mask &= (frame[column] < value).to_numpy()
+            frames.append(frame.loc[mask, columns or frame.columns])
+        if not frames:
+            return _empty(table, columns)
+        data = pd.concat(frames, ignore_index=True)
+        # cada partición tiene sus propias categorías; se unen como al leer el CSV completo
+        for column, dtype in SCHEMAS[table]['dtypes'].items():
+            if dtype == 'category' and column in data:
+                data[column] = data[column].astype(str).astype('category')
+        return data
+
+
+def _empty(table, columns=None):
+    # tabla sin filas con los tipos de datos del registro
+    schema = SCHEMAS[table]
+    frame = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in schema['dtypes'].items()})
+    for column in schema['dates']:
+        frame[column] = pd.Series(dtype='datetime64[ns]')
+    return frame[columns] if columns else frame
+
+
+def window_report(root, start=None, end=None, source_id=None, device=None, outputs=None):
+    '''
+    Función que calcula las salidas `outputs` de `analitica.pipeline` (todas si es None)
+    sólo con las visitas, pedidos y costos entre los días `start` y `end`, y con las visitas
+    y costos de las fuentes `source_id` y los dispositivos `device`. Las cohortes (primera
+    sesión, primer pedido) se determinan dentro de la ventana.
+    '''
+    log = PartitionedLog(root)
+    visits = log.read('visits_log_us', start, end, source_id=source_id, device=device)
+    if visits.empty:
+        raise ValueError('no hay visitas en el rango y los filtros pedidos')
+    params = {
+        'visits': pipeline.snake_case_columns(visits),
+        'orders': pipeline.snake_case_columns(log.read('orders_log_us', start, end)),
+        'costs': log.read('costs_us', start, end, source_id=source_id),
+    }
+    return WINDOW_GRAPH.evaluate(outputs, params)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest='command', required=True)
+    write = commands.add_parser('write', help='particionar los registros')
+    write.add_argument('--visits', default='/datasets/visits_log_us.csv')
+    write.add_argument('--orders', default='/datasets/orders_log_us.csv')
+    write.add_argument('--costs', default='/datasets/costs_us.csv')
+    write.add_argument('--root', default='files/particiones')
+    write.add_argument('--freq', choices=sorted(FREQUENCIES), default='month')
+    write.add_argument('--format', choices=['parquet', 'csv'], help='por omisión, Parquet si hay pyarrow')
+    report = commands.add_parser('report', help='calcular tablas de una ventana de fechas')
+    report.add_argument('--root', default='files/particiones')
+    report.add_argument('--start', help='primer día de la ventana (incluido)')
+    report.add_argument('--end', help='último día de la ventana (incluido)')
+    report.add_argument('--source-id', nargs='+', help='fuentes de anuncios')
+    report.add_argument('--device', nargs='+', help='dispositivos')
+    report.add_argument('--outputs', nargs='+', default=['dau_total', 'wau_total', 'mau_total'])
+    args = parser.parse_args()
+
+    if args.command == 'write':
+        for table, path in (('visits_log_us', args.visits), ('orders_log_us', args.orders),
+                            ('costs_us', args.costs)):
+            names = write_partitions(path, args.root, table, args.freq, args.format)
+            print(f'{table}: {len(names)} particiones ({names[0]} … {names[-1]})')
+        return
+    context = window_report(args.root, args.start, args.end, args.source_id, args.device, args.outputs)
+    for name in args.outputs:
+        print(name, context[name], sep='\n')
+
+
+if __name__ == '__main__':
+    main()
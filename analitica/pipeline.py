@@ -0,0 +1,321 @@
+'''
+El análisis de `proyecto_7_depto_analitico.py` como una secuencia de etapas con nombre.
+
+Cada etapa es una función que recibe sus entradas por nombre y devuelve un diccionario
+con sus salidas; `run()` evalúa el grafo de etapas (ver `analitica.dag`) sobre un contexto
+común. Así se puede medir cada etapa por separado y ejecutar el análisis sin el cuaderno.
+
+Con `memo_dir` el resultado de cada etapa se guarda en disco con una llave que depende
+de su código y de sus entradas: si sólo cambió el archivo de costos, al volver a ejecutar
+sólo se recalculan `cac` y `romi`. Con `outputs` se calculan sólo las etapas necesarias
+para esas salidas (por ejemplo, `outputs=['cac_by_source']`).
+
+Con `instrumentation` (ver `analitica.instrumentacion`) se registran el tiempo, la CPU,
+la memoria y las filas de cada etapa. Desde la línea de comandos:
+
+    python -m analitica.pipeline --profile perfil.json --trace traza.json
+    python -m analitica.pipeline --outputs cac_by_source
+    python -m analitica.pipeline --backend duckdb --memory-limit 4GB
+
+Con `backend='duckdb'` las etapas de visitas y pedidos se ejecutan como consultas de
+DuckDB fuera de memoria (ver `analitica.consultas`) y producen las mismas tablas agregadas.
+
+Etapas:
+    load_visits carga de las visitas
+    load_orders carga de los pedidos
+    load_costs  carga de los costos
+    uids        diccionario de uid → código int32 de visitas y pedidos (`analitica.usuarios`)
+    product     informe del producto (DAU, WAU, MAU, activos en 7, 28 y 30 días, sesiones por usuario, duración)
+    conversion  cohortes de conversión (días desde la primera sesión hasta el primer pedido)
+    ltv         pedidos por mes y LTV (y LTV acumulado) por cohorte
+    acquisition compradores/as por cohorte y fuente de su primera sesión
+    retention   usuarios/as activos/as por cohorte de primera sesión y edad en meses
+    cac         costos de marketing por mes y fuente atribuidos a las cohortes (CAC)
+    romi        ROMI, ROMI acumulado y mes de recuperación de la inversión por cohorte
+'''
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from analitica import almacen, atribucion, carga, cohortes, consultas, retencion
+from analitica.actividad import active_users, trailing_active_users, visit_days
+from analitica.calendario import month_codes, month_start
+from analitica.carga import CACHE_DIR
+from analitica.conversion import conversion_time_cohort, conversion_users_by_time, first_months, first_session_cohort
+from analitica.dag import Graph
+from analitica.instrumentacion import Instrumentation
+from analitica.sesiones import session_features
+from analitica.streaming import activity_metrics
+from analitica.usuarios import UidDictionary, first_per_user, per_user_array, per_user_table
+
+
+def snake_case_columns(frame):
+    '''
+    Función que pone los nombres de las columnas en minúscula y cambia los espacios por '_'.
+    '''
+    frame.columns = [col.lower().replace(' ', '_') for col in frame.columns]
+    return frame
+
+
+# resultados intermedios de las etapas, dentro de la caché de los datos
+MEMO_DIR = os.path.join(CACHE_DIR, 'etapas')
+
+
+def load_visits(visits_path, cache_dir=CACHE_DIR, store_dir=None):
+    if store_dir is not None:
+        # columnas abiertas con mmap desde el almacén binario, ya con los nombres en minúscula
+        return {'visits': almacen.load_store(visits_path, store_dir).frame()}
+    return {'visits': snake_case_columns(carga.load_visits(visits_path, cache_dir=cache_dir))}
+
+
+def load_orders(orders_path, cache_dir=CACHE_DIR):
+    return {'orders': snake_case_columns(carga.load_orders(orders_path, cache_dir=cache_dir))}
+
+
+def load_costs(costs_path, cache_dir=CACHE_DIR):
+    return {'costs': carga.load_costs(costs_path, cache_dir=cache_dir)}
+
+
+def encode_uids(visits, orders):
+    dictionary, (visit_users, order_users) = UidDictionary.build(visits['uid'], orders['uid'])
+    return {'uid_dictionary': dictionary, 'visit_users': visit_users, 'order_users': order_users}
+
+
+def product(visits, visit_users):
+    features = session_features(visits['start_ts'], visits['end_ts'], features=('session_duration_min',))
+    # usuarios únicos por día, semana y mes (con su año) con un solo ordenamiento de los códigos int32
+    activity = active_users(visits['start_ts'], visit_users)
+    daily = activity['daily']
+    metrics = activity_metrics(daily, activity['weekly'], activity['monthly'])
+    days = visit_days(visits['start_ts'])
+    n_sessions = np.bincount(days - days.min())
+    index = pd.MultiIndex.from_arrays([daily.index.year.to_numpy(dtype=np.int16), daily.index.to_numpy()],
+                                      names=['session_year', 'session_date'])
+    sessions_per_user = pd.DataFrame({'n_sessions': n_sessions[n_sessions > 0],
+                                      'n_users': daily.to_numpy(dtype=np.int64)}, index=index)
+    sessions_per_user['sess_per_user'] = sessions_per_user['n_sessions'] / sessions_per_user['n_users']
+    duration = features['session_duration_min']
+    # histograma de 100 intervalos, como el del cuaderno, para graficar sin la columna completa
+    counts, edges = np.histogram(duration.dropna(), bins=100)
+    return dict(metrics,
+                rolling_active_users=activity['rolling'],
+                trailing_active_users=trailing_active_users(visits['start_ts'], visit_users),
+                sessions_per_user=sessions_per_user,
+                session_duration=duration.describe(),
+                session_duration_mode=duration.mode(),
+                session_duration_histogram=pd.DataFrame({'left': edges[:-1], 'right': edges[1:],
+                                                         'count': counts}))
+
+
+def conversion(visits, orders, uid_dictionary, visit_users, order_users):
+    n_users = len(uid_dictionary)
+    # hora exacta (en nanosegundos) de la primera sesión y del primer pedido de cada usuario/a
+    start = visits['start_ts'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    buy = orders['buy_ts'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    first_session_ts = first_per_user(visit_users, start, n_users)
+    first_buy_ts = first_per_user(order_users, buy, n_users)
+    first_session_dates = per_user_table(uid_dictionary, first_months(first_session_ts), 'first_session_month')
+    first_buy_dates = per_user_table(uid_dictionary, first_months(first_buy_ts), 'first_buy_month')
+    users_conversion = conversion_users_by_time(uid_dictionary, first_session_ts, first_buy_ts)
+    return {
+        'first_session_dates': first_session_dates,
+        'first_buy_dates': first_buy_dates,
+        'users_conversion': users_conversion,
+        'first_session_cohort': first_session_cohort(users_conversion),
+        'convertion_time_cohort': conversion_time_cohort(users_conversion, visits, dictionary=uid_dictionary,
+                                                         visit_users=visit_users),
+    }
+
+
+def ltv(orders, uid_dictionary, order_users):
+    order_month = month_codes(orders['buy_ts']).to_numpy()
+    orders = pd.DataFrame({'user': order_users, 'order_month': order_month,
+                           'revenue': orders['revenue'].to_numpy()})
+    order_period = orders.groupby('order_month')['user'].agg(['count', 'nunique']).reset_index()
+    order_period.columns = ['order_month', 'n_orders', 'n_users']
+    order_period['orders_per_user'] = order_period['n_orders'] / order_period['n_users']
+    order_period['order_month'] = month_start(order_period['order_month'])
+
+    first_order = first_per_user(order_users, order_month, len(uid_dictionary))
+    first_orders = per_user_table(uid_dictionary, first_order, 'first_order_month')
+    months, n_buyers = np.unique(first_orders['first_order_month'], return_counts=True)
+    cohort_sizes = pd.DataFrame({'first_order_month': months, 'n_buyers': n_buyers})
+    # el mes del primer pedido de cada pedido se busca por posición, sin merge por uid
+    orders_with_first_order = orders.assign(first_order_month=first_order[order_users])
+    cohorts = orders_with_first_order.groupby(['first_order_month', 'order_month']).agg({'revenue': 'sum'}).reset_index()
+    report = cohortes.cohort_report(cohort_sizes, cohorts)
+    return {
+        'order_period': order_period,
+        'first_orders': first_orders,
+        'cohort_sizes': cohort_sizes,
+        'cohorts': cohorts,
+        'report': report,
+        'result': cohortes.ltv_table(report),
+        'ltv_cumulative': cohortes.cumulative_table(report, 'ltv'),
+    }
+
+
+def acquisition(visits, uid_dictionary, visit_users, first_orders):
+    sources = atribucion.acquisition_sources(visits, visit_users, len(uid_dictionary))
+    first_order = per_user_array(uid_dictionary, first_orders, 'first_order_month')
+    return {'cohort_sources': atribucion.cohort_sources(first_order, sources)}
+
+
+def retention(visits, uid_dictionary, visit_users):
+    return retencion.retention(visits, visit_users, len(uid_dictionary))
+
+
+def cac(report, costs, cohort_sources):
+    monthly_costs = atribucion.monthly_costs(costs)
+    return dict(atribucion.attribute_costs(report, cohort_sources, monthly_costs),
+                monthly_costs=monthly_costs,
+                source_costs=atribucion.costs_by_month(monthly_costs))
+
+
+def romi(report_with_costs):
+    # la matriz y su suma acumulada se calculan una vez para las tres salidas
+    matrix = cohortes.report_matrix(report_with_costs, 'romi')
+    cumulative = matrix.cumsum()
+    return {'result_romi': matrix.to_frame(),
+            'romi_cumulative': cumulative.to_frame(),
+            'payback_age': cumulative.first_age(1.0).rename('payback_age')}
+
+
+# (nombre, función, entradas, salidas) de cada etapa, en orden de ejecución
+STAGES = [
+    ('load_visits', load_visits, ['visits_path', 'cache_dir', 'store_dir'], ['visits']),
+    ('load_orders', load_orders, ['orders_path', 'cache_dir'], ['orders']),
+    ('load_costs', load_costs, ['costs_path', 'cache_dir'], ['costs']),
+    ('uids', encode_uids, ['visits', 'orders'], ['uid_dictionary', 'visit_users', 'order_users']),
+    ('product', product, ['visits', 'visit_users'],
+     ['dau_total', 'wau_total', 'mau_total', 'sticky_wau', 'sticky_mau', 'rolling_active_users',
+      'trailing_active_users', 'sessions_per_user', 'session_duration', 'session_duration_mode', 'session_duration_histogram']),
+    ('conversion', conversion, ['visits', 'orders', 'uid_dictionary', 'visit_users', 'order_users'],
+     ['first_session_dates', 'first_buy_dates', 'users_conversion', 'first_session_cohort',
+      'convertion_time_cohort']),
+    ('ltv', ltv, ['orders', 'uid_dictionary', 'order_users'],
+     ['order_period', 'first_orders', 'cohort_sizes', 'cohorts', 'report', 'result', 'ltv_cumulative']),
+    ('acquisition', acquisition, ['visits', 'uid_dictionary', 'visit_users', 'first_orders'], ['cohort_sources']),
+    ('retention', retention, ['visits', 'uid_dictionary', 'visit_users'], ['retention', 'retention_rate']),
+    ('cac', cac, ['report', 'costs', 'cohort_sources'],
+     ['monthly_costs', 'report_with_costs', 'cohort_cac', 'source_costs', 'cac_by_source']),
+    ('romi', romi, ['report_with_costs'], ['result_romi', 'romi_cumulative', 'payback_age']),
+]
+
+# las cargas no se guardan como resultado intermedio: ya tienen la caché Parquet de analitica.carga
+LOAD_STAGES = ['load_visits', 'load_orders', 'load_costs']
+
+# el diccionario de uid se vuelve a construir en cada ejecución a partir de las cargas
+GRAPH = Graph(STAGES, volatile=LOAD_STAGES + ['uids'], unkeyed=['cache_dir', 'store_dir'])
+
+# las mismas salidas agregadas con las consultas de DuckDB; los costos, el CAC y el ROMI
+# se calculan con las etapas de pandas sobre las tablas agregadas. Todas las consultas usan
+# la base de datos de `duckdb_open`, que no se guarda y se abre una vez por ejecución
+DUCKDB_STAGES = [
+    ('load_costs', load_costs, ['costs_path', 'cache_dir'], ['costs']),
+    ('duckdb_open', consultas.open_database, ['memory_limit', 'temp_directory'], ['database']),
+    ('duckdb_product', consultas.product, ['database', 'visits_path', 'cache_dir'],
+     ['dau_total', 'wau_total', 'mau_total', 'sticky_wau', 'sticky_mau', 'rolling_active_users',
+      'trailing_active_users', 'sessions_per_user', 'session_duration', 'session_duration_mode', 'session_duration_histogram']),
+    ('duckdb_conversion', consultas.conversion, ['database', 'visits_path', 'orders_path', 'cache_dir'],
+     ['first_session_cohort', 'convertion_time_cohort']),
+    ('duckdb_ltv', consultas.ltv, ['database', 'orders_path', 'cache_dir'],
+     ['order_period', 'cohort_sizes', 'cohorts', 'report', 'result', 'ltv_cumulative']),
+    ('duckdb_acquisition', consultas.acquisition, ['database', 'visits_path', 'orders_path', 'cache_dir'],
+     ['cohort_sources']),
+    ('duckdb_retention', consultas.retention, ['database', 'visits_path', 'cache_dir'],
+     ['retention', 'retention_rate']),
+    ('duckdb_cac', cac, ['report', 'costs', 'cohort_sources'],
+     ['monthly_costs', 'report_with_costs', 'cohort_cac', 'source_costs', 'cac_by_source']),
+    ('duckdb_romi', romi, ['report_with_costs'], ['result_romi', 'romi_cumulative', 'payback_age']),
+]
+
+GRAPHS = {
+    'pandas': GRAPH,
+    'duckdb': Graph(DUCKDB_STAGES, volatile=['load_costs', 'duckdb_open'],
+                    unkeyed=['cache_dir', 'memory_limit', 'temp_directory']),
+}
+
+
+def run(visits_path='/datasets/visits_log_us.csv', orders_path='/datasets/orders_log_us.csv',
+        costs_path='/datasets/costs_us.csv', cache_dir=CACHE_DIR, outputs=None, memo_dir=None,
+        instrumentation=None, backend='pandas', memory_limit=None, store_dir=None):
+    '''
+    Función que calcula las salidas `outputs` (todas si es None) y devuelve el contexto con
+    las entradas y las tablas calculadas para obtenerlas. Con `memo_dir` se reutilizan los
+    resultados guardados de las etapas cuyo código y entradas no cambiaron. Si se pasa
+    `instrumentation`, cada etapa se ejecuta dentro de `instrumentation.stage(name, inputs)`.
+    Con `backend='duckdb'` se usan las consultas de `analitica.consultas`, que usan como
+    máximo `memory_limit` (por ejemplo, '4GB') y escriben el resto en disco. Con `store_dir`
+    las visitas se abren con mmap desde el almacén binario de `analitica.almacen`.
+    '''
+    if backend not in GRAPHS:
+        raise ValueError(f'backend debe ser uno de {sorted(GRAPHS)}, no {backend!r}')
+    params = {'visits_path': visits_path, 'orders_path': orders_path,
+              'costs_path': costs_path, 'cache_dir': cache_dir, 'store_dir': store_dir}
+    if backend == 'duckdb':
+        params.update(memory_limit=memory_limit, temp_directory=consultas.TEMP_DIR)
+    return GRAPHS[backend].evaluate(outputs, params, memo_dir=memo_dir, instrumentation=instrumentation)
+
+
+def add_run_arguments(parser):
+    '''
+    Función que agrega al `parser` las opciones comunes para ejecutar y medir las etapas.
+    '''
+    parser.add_argument('--visits', default='/datasets/visits_log_us.csv')
+    parser.add_argument('--orders', default='/datasets/orders_log_us.csv')
+    parser.add_argument('--costs', default='/datasets/costs_us.csv')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='leer siempre los CSV y recalcular todas las etapas')
+    parser.add_argument('--profile', help='archivo JSON con las mediciones de cada etapa')
+    parser.add_argument('--trace', help='archivo de traza para chrome://tracing, Perfetto o speedscope')
+    parser.add_argument('--folded', help='archivo de pilas plegadas para flamegraph.pl')
+    parser.add_argument('--memory', action='store_true', help='medir los bytes asignados con tracemalloc')
+    parser.add_argument('--backend', choices=sorted(GRAPHS), default='pandas',
+                        help='pandas en memoria o consultas de DuckDB fuera de memoria')
+    parser.add_argument('--memory-limit', help='memoria máxima de DuckDB (por ejemplo, 4GB)')
+    parser.add_argument('--store', nargs='?', const=almacen.STORE_DIR,
+                        help='abrir las visitas con mmap desde el almacén binario (se construye si hace falta)')
+    return parser
+
+
+def run_from_args(args, outputs=None):
+    '''
+    Función que ejecuta las etapas con las opciones de `add_run_arguments()`, guarda las
+    mediciones pedidas y devuelve el contexto.
+    '''
+    instrumentation = None
+    if args.profile or args.trace or args.folded:
+        instrumentation = Instrumentation(memory=args.memory)
+    cache_dir, memo_dir = (None, None) if args.no_cache else (CACHE_DIR, MEMO_DIR)
+    context = run(args.visits, args.orders, args.costs, cache_dir=cache_dir, outputs=outputs,
+                  memo_dir=memo_dir, instrumentation=instrumentation, backend=args.backend,
+                  memory_limit=args.memory_limit, store_dir=args.store)
+    if instrumentation is None:
+        return context
+    for record in instrumentation.records:
+        print(f"{record['stage']:<22} {record['wall_s']:9.3f} s  cpu {record['cpu_s']:9.3f} s  "
+              f"rss {record['peak_rss_mib']:9.1f} MiB  filas {record['rows_in']} -> {record['rows_out']}")
+    if args.profile:
+        instrumentation.to_json(args.profile)
+    if args.trace:
+        instrumentation.to_trace(args.trace)
+    if args.folded:
+        instrumentation.to_folded(args.folded)
+    return context
+
+
+def main():
+    parser = add_run_arguments(argparse.ArgumentParser(
+        description='Ejecuta las etapas del análisis y, opcionalmente, las mide.'))
+    parser.add_argument('--outputs', nargs='+', help='salidas a calcular (por omisión, todas)')
+    args = parser.parse_args()
+    context = run_from_args(args, outputs=args.outputs)
+    for name in args.outputs or []:
+        print(name, context[name], sep='\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+'''
+Matriz de retención por cohorte de primera sesión (`first_session_month`).
+
+Una cohorte son los/las usuarios/as cuya primera sesión fue en el mismo mes; la edad de un
+mes es el número de meses desde ese primero. La retención cuenta, por cohorte y edad,
+cuántos/as usuarios/as de la cohorte tuvieron alguna sesión ese mes, y la tasa divide ese
+número entre el tamaño de la cohorte (la edad 0).
+
+En lugar de unir `first_session_dates` con todas las visitas y agrupar por (cohorte, mes),
+la cohorte de cada visita se busca por posición en el primer mes por código de usuario/a
+(`analitica.usuarios`) y cada visita se codifica como un entero (segmento, cohorte, edad,
+usuario/a): con un solo ordenamiento se descartan las visitas repetidas del mismo
+usuario/a en el mismo mes y las celdas se cuentan con `np.bincount`.
+
+Con `by` ('device' o 'source_id') las cohortes se separan por el dispositivo o la fuente de
+la primera sesión de cada usuario/a, así que cada usuario/a está en una sola fila. Las
+edades que una cohorte todavía no alcanza (después del último mes con visitas) quedan en
+NaN, como en las tablas dinámicas del cuaderno, y las tablas se pueden pasar directamente
+a `sns.heatmap`.
+'''
+import numpy as np
+import pandas as pd
+
+from analitica.atribucion import first_session_rows
+from analitica.calendario import month_codes, month_start
+from analitica.usuarios import first_per_user, has_rows
+
+
+def retention_tables(cohorts, ages, counts=None, segments=None, names=None, by=None):
+    '''
+    Función que arma las tablas de retención a partir de celdas (cohorte, edad) con su
+    número de usuarios/as activos/as `counts` (1 por fila si es None) y, opcionalmente, el
+    código de segmento `segments` de cada celda con sus nombres `names`. Devuelve un
+    diccionario con `retention` (usuarios/as activos/as) y `retention_rate` (fracción de la
+    cohorte), con las cohortes como fechas en las filas y la edad en las columnas.
+    '''
+    cohorts = np.asarray(cohorts, dtype=np.int64)
+    ages = np.asarray(ages, dtype=np.int64)
+    if not len(cohorts):
+        return _empty_tables(by)
+    first_month = int(cohorts.min())
+    n_months = int((cohorts + ages).max()) - first_month + 1
+    n_segments = 1 if names is None else len(names)
+    segments = np.zeros(len(cohorts), dtype=np.int64) if segments is None else np.asarray(segments, dtype=np.int64)
+    cells = (segments * n_months + cohorts - first_month) * n_months + ages
+    grid = np.bincount(cells, weights=counts, minlength=n_segments * n_months * n_months)
+    grid = grid.reshape(n_segments * n_months, n_months).astype(np.float64)
+    # la cohorte del mes i sólo llega a la edad n_months - 1 - i
+    cohort_of_row = np.tile(np.arange(n_months), n_segments)
+    grid[cohort_of_row[:, None] + np.arange(n_months) >= n_months] = np.nan
+
+    months = month_start(first_month + cohort_of_row)
+    if names is None:
+        index = pd.DatetimeIndex(months, name='first_session_month')
+    else:
+        index = pd.MultiIndex.from_arrays([np.repeat(np.asarray(names), n_months), months],
+                                          names=[by, 'first_session_month'])
+    retention = pd.DataFrame(grid, index=index, columns=pd.RangeIndex(n_months, name='age'))
+    # sólo las cohortes con usuarios/as
+    retention = retention[retention[0] > 0]
+    return {'retention': retention, 'retention_rate': retention.div(retention[0], axis=0)}
+
+
+def _empty_tables(by=None):
+    # tablas sin cohortes (sin visitas), con los mismos nombres de índice y columnas
+    months = pd.DatetimeIndex([], dtype='datetime64[ns]', name='first_session_month')
+    if by is None:
+        index = months
+    else:
+        index = pd.MultiIndex.from_arrays([pd.Index([], dtype=object), months], names=[by, 'first_session_month'])
+    retention = pd.DataFrame(np.empty((0, 0)), index=index, columns=pd.RangeIndex(0, name='age'))
+    return {'retention': retention, 'retention_rate': retention.copy()}
+
+
+def _segments(visits, visit_users, n_users, by):
+    # código (y nombres) del `by` de la primera sesión de cada usuario/a
+    first_row = first_session_rows(visits, visit_users, n_users)
+    seen = has_rows(first_row)
+    # los valores se ordenan como su tipo (las fuentes, como números)
+    values, names = pd.factorize(visits[by].iloc[first_row[seen]], sort=True)
+    codes = np.full(n_users, -1, dtype=np.int64)
+    codes[seen] = values
+    return codes, list(names)
+
+
+def retention(visits, visit_users, n_users, by=None):
+    '''
+    Función que calcula la retención por cohorte de primera sesión y edad en meses a partir
+    de las visitas y del código de usuario/a de cada una; con `by` ('device' o
+    'source_id') separa las cohortes por el valor de la primera sesión de cada usuario/a.
+    Sin visitas devuelve tablas vacías.
+    '''
+    if not len(visits):
+        return _empty_tables(by)
+    months = month_codes(visits['start_ts']).to_numpy().astype(np.int64)
+    cohort = first_per_user(visit_users, months, n_users)[visit_users].astype(np.int64)
+    segment, names = (None, None) if by is None else _segments(visits, visit_users, n_users, by)
+    segment = np.zeros(len(months), dtype=np.int64) if segment is None else segment[visit_users]
+
+    # (segmento, cohorte, edad, usuario/a) en un entero: un ordenamiento y pares distintos
+    first_month = cohort.min()
+    n_months = months.max() - first_month + 1
+    cells = (segment * n_months + cohort - first_month) * n_months + (months - cohort)
+    keys = np.sort(cells * n_users + visit_users)
+    keep = np.ones(len(keys), dtype=bool)
+    keep[1:] = keys[1:] != keys[:-1]
+    cells = keys[keep] // n_users
+    rest, age = np.divmod(cells, n_months)
+    segment, cohort = np.divmod(rest, n_months)
+    return retention_tables(cohort + first_month, age, segments=segment, names=names, by=by)
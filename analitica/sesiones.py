@@ -0,0 +1,92 @@
+'''
+Cálculo en una sola pasada de las variables de calendario y de la duración de las sesiones.
+
+En lugar de recorrer la columna de fechas con un accesor `.dt` distinto para el año,
+el mes, la semana y el día, se trabaja directamente con los enteros de 64 bits
+(nanosegundos desde 1970) de `start_ts` y `end_ts`: del número de día se obtienen el
+año, el mes y la semana ISO con aritmética entera, y la duración es la diferencia
+exacta en minutos (`.dt.seconds` descartaba los días completos de las sesiones largas).
+'''
+import numpy as np
+import pandas as pd
+
+
+NS_PER_DAY = 86_400 * 10**9
+NS_PER_MINUTE = 60 * 10**9
+
+# variables que se pueden pedir a session_features()
+FEATURES = ('session_year', 'session_month', 'session_week', 'session_date', 'session_duration_min')
+
+
+def _ns(timestamps):
+    return np.asarray(timestamps, dtype='datetime64[ns]').view(np.int64)
+
+
+def civil_from_days(days):
+    '''
+    Función que convierte días desde 1970-01-01 en año, mes y día (algoritmo de H. Hinnant).
+    '''
+    z = days + 719_468
+    era = z // 146_097
+    doe = z - era * 146_097
+    yoe = (doe - doe // 1_460 + doe // 36_524 - doe // 146_096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = np.where(mp < 10, mp + 3, mp - 9)
+    year = yoe + era * 400 + (month <= 2)
+    return year, month, day
+
+
+def days_from_civil(year, month, day):
+    '''
+    Función inversa de `civil_from_days()`: días desde 1970-01-01 de una fecha.
+    '''
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * np.where(month > 2, month - 3, month + 9) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146_097 + doe - 719_468
+
+
+def iso_week(days):
+    '''
+    Función que devuelve el número de semana ISO (1-53) de cada día desde 1970-01-01.
+    '''
+    # el 1970-01-01 fue jueves; weekday 0 es lunes
+    weekday = (days + 3) % 7
+    thursday = days - weekday + 3
+    year = civil_from_days(thursday)[0]
+    return (thursday - days_from_civil(year, 1, 1)) // 7 + 1
+
+
+def session_features(start_ts, end_ts=None, features=FEATURES):
+    '''
+    Función que calcula en una pasada las variables de sesión pedidas en `features`:
+    `session_year`, `session_month` (número de mes), `session_week` (semana ISO),
+    `session_date` (fecha sin hora) y `session_duration_min` (duración exacta en minutos,
+    requiere `end_ts`). Sólo se materializan las columnas pedidas.
+    '''
+    unknown = set(features) - set(FEATURES)
+    if unknown:
+        raise ValueError(f'variables de sesión desconocidas: {sorted(unknown)}')
+    index = start_ts.index if isinstance(start_ts, pd.Series) else None
+    start = _ns(start_ts)
+    days = start // NS_PER_DAY
+    columns = {}
+    if 'session_year' in features or 'session_month' in features:
+        year, month, _ = civil_from_days(days)
+        if 'session_year' in features:
+            columns['session_year'] = year.astype(np.int16)
+        if 'session_month' in features:
+            columns['session_month'] = month.astype(np.int8)
+    if 'session_week' in features:
+        columns['session_week'] = iso_week(days).astype(np.int8)
+    if 'session_date' in features:
+        columns['session_date'] = (days * NS_PER_DAY).view('datetime64[ns]')
+    if 'session_duration_min' in features:
+        if end_ts is None:
+            raise ValueError('session_duration_min necesita end_ts')
+        columns['session_duration_min'] = (_ns(end_ts) - start) / NS_PER_MINUTE
+    return pd.DataFrame({name: columns[name] for name in features}, index=index)
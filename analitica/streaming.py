@@ -0,0 +1,124 @@
+'''
+Cálculo por bloques (streaming) del DAU, WAU, MAU y del factor de adherencia.
+
+En lugar de cargar todo el registro de visitas en memoria, se lee en bloques y para
+cada día, semana y mes se mantiene el conjunto exacto de usuarios únicos como un
+arreglo ordenado de enteros uint64, que es la representación más compacta de un
+conjunto exacto de `uid`.
+'''
+import numpy as np
+import pandas as pd
+
+from analitica.actividad import day_months, visit_days, week_starts
+from analitica.carga import read_csv_typed
+
+
+# columnas del CSV que se necesitan para las métricas de actividad
+VISIT_COLUMNS = ['Uid', 'Start Ts']
+
+
+def activity_metrics(daily_counts, weekly_counts, monthly_counts):
+    '''
+    Función que calcula el DAU, WAU, MAU (promedios redondeados) y el factor de adherencia
+    a partir del número de usuarios únicos por día, semana y mes.
+    '''
+    dau_total = round(daily_counts.mean())
+    wau_total = round(weekly_counts.mean())
+    mau_total = round(monthly_counts.mean())
+    return {
+        'dau_total': dau_total,
+        'wau_total': wau_total,
+        'mau_total': mau_total,
+        'sticky_wau': dau_total / wau_total,
+        'sticky_mau': dau_total / mau_total,
+    }
+
+
+class DistinctUsers:
+    '''
+    Conjuntos exactos de usuarios únicos por periodo. Cada conjunto se guarda como
+    un arreglo ordenado de uint64 y se combina con los nuevos bloques con `np.union1d`.
+    '''
+
+    def __init__(self):
+        self.sets = {}
+
+    def update(self, keys, uids):
+        '''
+        Agrega al conjunto de cada periodo (`keys`) los usuarios (`uids`) de un bloque.
+        '''
+        pairs = pd.DataFrame({'key': keys, 'uid': uids}).drop_duplicates()
+        for key, group in pairs.groupby('key', sort=False)['uid']:
+            values = np.sort(group.to_numpy(dtype=np.uint64))
+            current = self.sets.get(key)
+            self.sets[key] = values if current is None else np.union1d(current, values)
+
+    def merge(self, other):
+        '''
+        Combina los conjuntos de otro `DistinctUsers`, por ejemplo el de otro proceso.
+        '''
+        for key, values in other.sets.items():
+            current = self.sets.get(key)
+            self.sets[key] = values if current is None else np.union1d(current, values)
+        return self
+
+    def counts(self):
+        '''
+        Devuelve una Series con el número de usuarios únicos de cada periodo.
+        '''
+        return pd.Series({key: len(values) for key, values in self.sets.items()},
+                         name='uid').sort_index()
+
+
+class ActiveUsersStream:
+    '''
+    Acumula por bloques los usuarios únicos por día, semana ISO y mes de la sesión, con
+    los mismos periodos que el informe del producto: las semanas por su lunes y los meses
+    por su código (`analitica.actividad`), así que las de años distintos no se mezclan.
+    '''
+
+    def __init__(self):
+        self.daily = DistinctUsers()
+        self.weekly = DistinctUsers()
+        self.monthly = DistinctUsers()
+
+    def update(self, start_ts, uids):
+        '''
+        Procesa un bloque de visitas a partir de sus columnas `start_ts` y `uid`.
+        '''
+        uids = np.asarray(uids, dtype=np.uint64)
+        days = visit_days(start_ts)
+        self.daily.update(days, uids)
+        self.weekly.update(week_starts(days), uids)
+        self.monthly.update(day_months(days), uids)
+
+    def merge(self, other):
+        self.daily.merge(other.daily)
+        self.weekly.merge(other.weekly)
+        self.monthly.merge(other.monthly)
+        return self
+
+    def metrics(self):
+        '''
+        Devuelve un diccionario con `dau_total`, `wau_total`, `mau_total`, `sticky_wau`
+        y `sticky_mau` calculados igual que en el informe del producto.
+        '''
+        return activity_metrics(self.daily.counts(), self.weekly.counts(), self.monthly.counts())
+
+
+def iter_visit_chunks(path, chunksize=1_000_000, columns=VISIT_COLUMNS):
+    '''
+    Función que lee el registro de visitas en bloques de `chunksize` filas.
+    '''
+    return read_csv_typed(path, columns=columns, table='visits_log_us', chunksize=chunksize)
+
+
+def stream_active_users(path='/datasets/visits_log_us.csv', chunksize=1_000_000):
+    '''
+    Función que calcula el DAU, WAU, MAU y el factor de adherencia leyendo el registro
+    de visitas por bloques, con memoria acotada por el número de pares (periodo, usuario).
+    '''
+    stream = ActiveUsersStream()
+    for chunk in iter_visit_chunks(path, chunksize=chunksize):
+        stream.update(chunk['Start Ts'], chunk['Uid'])
+    return stream.metrics()
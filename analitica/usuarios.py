@@ -0,0 +1,122 @@
+'''
+Diccionario global de usuarios/as: cada `uid` (uint64) recibe un código entero denso (int32).
+
+El diccionario se construye una sola vez, al cargar las visitas y los pedidos, y los dos
+registros se codifican con los mismos códigos. Con códigos densos las agregaciones por
+usuario/a son operaciones sobre arreglos indexados por el código (`np.bincount`,
+`np.minimum.at`) y las uniones por `uid` son búsquedas posicionales (`valores[códigos]`),
+sin volver a calcular el hash de los `uid` en cada `merge`.
+
+Los `uid` del diccionario están ordenados, así que las tablas por usuario/a que se
+construyen a partir de los códigos salen en el mismo orden que las de `groupby('uid')`.
+'''
+import numpy as np
+import pandas as pd
+
+
+CODE_DTYPE = np.int32
+
+
+def _missing(dtype):
+    # valor para los/las usuarios/as sin filas: el máximo del tipo (o infinito)
+    dtype = np.dtype(dtype)
+    return np.iinfo(dtype).max if dtype.kind in 'iu' else np.inf
+
+
+class UidDictionary:
+    '''
+    Diccionario de `uid` ordenados; el código de un `uid` es su posición en `uids`.
+    '''
+
+    def __init__(self, uids):
+        self.uids = np.asarray(uids, dtype=np.uint64)
+        self._index = None
+
+    def __len__(self):
+        return len(self.uids)
+
+    @classmethod
+    def build(cls, *columns):
+        '''
+        Construye el diccionario con todos los `uid` de `columns` y devuelve el diccionario y
+        los códigos de cada columna, en el mismo orden.
+        '''
+        columns = [np.asarray(column, dtype=np.uint64) for column in columns]
+        codes, uniques = pd.factorize(np.concatenate(columns))
+        # se ordenan los uid y se traducen los códigos de factorize a la posición ordenada
+        order = np.argsort(uniques)
+        rank = np.empty(len(uniques), dtype=CODE_DTYPE)
+        rank[order] = np.arange(len(uniques), dtype=CODE_DTYPE)
+        codes = rank[codes]
+        bounds = np.cumsum([len(column) for column in columns])[:-1]
+        return cls(uniques[order]), np.split(codes, bounds)
+
+    def encode(self, uids):
+        '''
+        Devuelve los códigos de `uids`; los `uid` que no están en el diccionario reciben -1.
+        '''
+        if self._index is None:
+            self._index = pd.Index(self.uids)
+        return self._index.get_indexer(np.asarray(uids, dtype=np.uint64)).astype(CODE_DTYPE)
+
+    def decode(self, codes):
+        '''
+        Devuelve los `uid` de los códigos `codes`.
+        '''
+        return self.uids[codes]
+
+
+def count_per_user(codes, n_users):
+    '''
+    Función que cuenta las filas de cada usuario/a.
+    '''
+    return np.bincount(codes, minlength=n_users)
+
+
+def sum_per_user(codes, values, n_users):
+    '''
+    Función que suma `values` por usuario/a.
+    '''
+    return np.bincount(codes, weights=values, minlength=n_users)
+
+
+def first_per_user(codes, values, n_users):
+    '''
+    Función que devuelve el mínimo de `values` por usuario/a. Los/las usuarios/as sin filas
+    quedan con el máximo del tipo de datos (ver `has_rows`).
+    '''
+    values = np.asarray(values)
+    first = np.full(n_users, _missing(values.dtype), dtype=values.dtype)
+    np.minimum.at(first, codes, values)
+    return first
+
+
+def has_rows(first):
+    '''
+    Función que indica qué usuarios/as tienen valor en un resultado de `first_per_user`.
+    '''
+    return first != _missing(first.dtype)
+
+
+def per_user_table(dictionary, first, column):
+    '''
+    Función que construye una tabla `uid` → `column` con los/las usuarios/as que tienen valor
+    en `first` (resultado de `first_per_user`), ordenada por `uid` como la de `groupby('uid')`.
+    '''
+    users = np.flatnonzero(has_rows(first))
+    return pd.DataFrame({'uid': dictionary.decode(users), column: first[users]})
+
+
+def per_user_array(dictionary, table, column):
+    '''
+    Función inversa de `per_user_table`: devuelve el arreglo por código de usuario/a con los
+    valores de `column`; los/las usuarios/as que no están en `table` quedan sin valor. Las
+    filas de `table` con `uid` que no están en el diccionario se ignoran.
+    '''
+    values = table[column].to_numpy()
+    codes = dictionary.encode(table['uid'])
+    known = codes >= 0
+    first = np.full(len(dictionary), _missing(values.dtype), dtype=values.dtype)
+    # encode() devuelve -1 para los uid desconocidos, que si no escribirían en la última posición
+    first[codes[known]] = values[known]
+    return first
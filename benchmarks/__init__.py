@@ -0,0 +1,3 @@
+'''
+Mediciones de tiempo y precisión de las funciones de `analitica`.
+'''
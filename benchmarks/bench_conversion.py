@@ -0,0 +1,98 @@
+'''
+Compara el análisis de conversión original (merge de todas las sesiones con todos los
+pedidos de cada usuario/a) con la versión de una fila por usuario/a, en tiempo, en
+memoria máxima y en el resultado.
+
+Uso:
+    python -m benchmarks.bench_conversion --sessions 1000000 --orders 50000
+'''
+import argparse
+import time
+import tracemalloc
+
+import pandas as pd
+
+from analitica.calendario import month_codes
+from analitica.conversion import (CONVERSION_BINS, CONVERSION_LABELS, conversion_time_cohort,
+                                  conversion_users, first_session_cohort)
+from benchmarks.sinteticos import synthetic_orders, synthetic_visits
+
+
+def prepare(sessions, orders, seed=0):
+    visits = synthetic_visits(sessions, seed=seed)
+    purchases = synthetic_orders(visits, orders, seed=seed)
+    visits.columns = ['device', 'end_ts', 'source_id', 'start_ts', 'uid']
+    purchases.columns = ['buy_ts', 'revenue', 'uid']
+    return visits, purchases
+
+
+def merge_path(visits, orders):
+    '''
+    Función con los pasos originales del informe de ventas (con los meses como fechas).
+    '''
+    visits = visits.assign(session_month=visits['start_ts'].dt.to_period('M').dt.to_timestamp())
+    orders = orders.assign(order_month=orders['buy_ts'].dt.to_period('M').dt.to_timestamp())
+    first_session_dates = visits.groupby('uid')['session_month'].min().reset_index()
+    first_session_dates.columns = ['uid', 'first_session_month']
+    visits_ = visits.merge(first_session_dates, on='uid')
+    first_buy_dates = orders.groupby('uid')['order_month'].min().reset_index()
+    first_buy_dates.columns = ['uid', 'first_buy_month']
+    orders_ = orders.merge(first_buy_dates, on='uid')
+    visits_orders = visits_.merge(orders_, on='uid')
+    visits_orders['convertion_time_days'] = (visits_orders['first_buy_month']
+                                             - visits_orders['first_session_month']).dt.days
+    visits_orders['conversion_category'] = pd.cut(visits_orders['convertion_time_days'],
+                                                  bins=CONVERSION_BINS, labels=CONVERSION_LABELS)
+    cohort = visits_orders.pivot_table(index='first_session_month', columns='conversion_category',
+                                       values='uid', aggfunc='nunique')
+    by_source = visits_orders.pivot_table(index='conversion_category', columns='source_id',
+                                          values='uid', aggfunc='nunique')
+    return cohort, by_source, len(visits_orders)
+
+
+def per_user_path(visits, orders):
+    '''
+    Función con la tabla de una fila por usuario/a (con los meses como códigos enteros).
+    '''
+    visits = visits.assign(session_month=month_codes(visits['start_ts']))
+    orders = orders.assign(order_month=month_codes(orders['buy_ts']))
+    first_session_dates = visits.groupby('uid')['session_month'].min().reset_index()
+    first_session_dates.columns = ['uid', 'first_session_month']
+    first_buy_dates = orders.groupby('uid')['order_month'].min().reset_index()
+    first_buy_dates.columns = ['uid', 'first_buy_month']
+    users = conversion_users(first_session_dates, first_buy_dates)
+    return first_session_cohort(users), conversion_time_cohort(users, visits), len(users)
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    begin = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - begin
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run(sessions, orders, seed=0):
+    visits, purchases = prepare(sessions, orders, seed)
+    (cohort, by_source, rows), merge_time, merge_peak = measure(merge_path, visits, purchases)
+    (new_cohort, new_by_source, users), user_time, user_peak = measure(per_user_path, visits, purchases)
+    pd.testing.assert_frame_equal(cohort, new_cohort, check_index_type=False)
+    pd.testing.assert_frame_equal(by_source, new_by_source)
+    print(f'merge original:     {merge_time:.3f} s  {merge_peak / 2**20:.1f} MiB  {rows} filas')
+    print(f'una fila por uid:   {user_time:.3f} s  {user_peak / 2**20:.1f} MiB  {users} filas')
+    print('resultados idénticos')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sessions', type=int, default=1_000_000)
+    parser.add_argument('--orders', type=int, default=50_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args.sessions, args.orders, args.seed)
+
+
+if __name__ == '__main__':
+    main()
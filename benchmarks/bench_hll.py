@@ -0,0 +1,51 @@
+'''
+Compara el DAU/WAU/MAU exacto (groupby + nunique) con la versión aproximada con
+sketches HyperLogLog, en tiempo y en error relativo.
+
+Uso:
+    python -m benchmarks.bench_hll --sessions 1000000 --error 0.01 0.02 0.05
+'''
+import argparse
+import time
+
+from analitica.hll import approx_active_users
+from benchmarks.sinteticos import synthetic_visits
+
+
+def exact_active_users(visits):
+    '''
+    Función que calcula las métricas igual que el informe del producto.
+    '''
+    start_ts = visits['Start Ts']
+    dau_total = visits.groupby(start_ts.dt.date).agg({'Uid': 'nunique'}).mean().round().iloc[0].item()
+    wau_total = visits.groupby(start_ts.dt.to_period('W')).agg({'Uid': 'nunique'}).mean().round().iloc[0].item()
+    mau_total = visits.groupby(start_ts.dt.to_period('M')).agg({'Uid': 'nunique'}).mean().round().iloc[0].item()
+    return {'dau_total': dau_total, 'wau_total': wau_total, 'mau_total': mau_total}
+
+
+def run(sessions, errors, seed=0):
+    visits = synthetic_visits(sessions, seed=seed)
+    begin = time.perf_counter()
+    exact = exact_active_users(visits)
+    exact_time = time.perf_counter() - begin
+    print(f'exacto: {exact_time:.3f} s  {exact}')
+    for error in errors:
+        begin = time.perf_counter()
+        approx = approx_active_users(visits['Start Ts'], visits['Uid'], error=error)
+        approx_time = time.perf_counter() - begin
+        deviations = {key: abs(approx[key] - exact[key]) / exact[key] for key in exact}
+        print(f'hll error={error}: {approx_time:.3f} s  '
+              + '  '.join(f'{key}={approx[key]} ({deviations[key]:.2%})' for key in exact))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sessions', type=int, default=1_000_000)
+    parser.add_argument('--error', type=float, nargs='+', default=[0.01, 0.02, 0.05])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args.sessions, args.error, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+'''
+Mide el tiempo y la memoria máxima de cada etapa del análisis completo sobre datos sintéticos.
+
+Para cada escala se generan (una sola vez) los CSV sintéticos en `--data-dir` y se ejecutan
+las etapas de `analitica.pipeline` (cargas, product, conversion, ltv, cac, romi), medidas con
+`analitica.instrumentacion`. Los resultados se guardan en JSON y, si se indica `--baseline`,
+se comparan etapa por etapa con un archivo de resultados anterior.
+
+Uso:
+    python -m benchmarks.bench_pipeline --sessions 1000000 10000000 --output resultados.json \
+        --baseline benchmarks/baseline.json
+'''
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from analitica import pipeline
+from analitica.instrumentacion import Instrumentation
+from benchmarks.sinteticos import write_dataset
+
+
+def measure_stage(instrumentation, name, function, inputs):
+    '''
+    Función que ejecuta una etapa dentro de `instrumentation` y devuelve sus salidas y su
+    registro en el formato de los resultados del benchmark.
+    '''
+    with instrumentation.stage(name, inputs) as record:
+        outputs = function(**inputs)
+        record['outputs'] = outputs
+    peak = record.get('peak_allocated_bytes')
+    result = {'seconds': round(record['wall_s'], 4), 'cpu_seconds': round(record['cpu_s'], 4),
+              'peak_mib': None if peak is None else round(peak / 2**20, 1),
+              'peak_rss_mib': round(record['peak_rss_mib'], 1),
+              'rows_in': record['rows_in'], 'rows_out': record['rows_out']}
+    print(f'  {name:<18} {record["wall_s"]:9.3f} s' + ('' if peak is None else f'  {peak / 2**20:9.1f} MiB'))
+    return outputs, result
+
+
+def dataset(data_dir, sessions, seed):
+    directory = os.path.join(data_dir, f'sessions_{sessions}_seed_{seed}')
+    paths = {name: os.path.join(directory, name + '.csv')
+             for name in ('visits_log_us', 'orders_log_us', 'costs_us')}
+    if not all(os.path.exists(path) for path in paths.values()):
+        print(f'generando {sessions} sesiones en {directory} ...')
+        paths = write_dataset(directory, sessions, seed=seed)
+    return directory, paths
+
+
+def run_scale(data_dir, sessions, seed=0, cache=False, trace_memory=True):
+    '''
+    Función que ejecuta todas las etapas para una escala y devuelve sus mediciones.
+    '''
+    directory, paths = dataset(data_dir, sessions, seed)
+    # la primera carga siempre parte de los CSV
+    shutil.rmtree(os.path.join(directory, 'cache'), ignore_errors=True)
+    context = {'visits_path': paths['visits_log_us'], 'orders_path': paths['orders_log_us'],
+               'costs_path': paths['costs_us'],
+               'cache_dir': os.path.join(directory, 'cache') if cache else None, 'store_dir': None}
+    instrumentation = Instrumentation(memory=trace_memory)
+    results = {}
+    for name, function, inputs, _ in pipeline.STAGES:
+        arguments = {key: context[key] for key in inputs}
+        outputs, results[name] = measure_stage(instrumentation, name, function, arguments)
+        context.update(outputs)
+        if name in pipeline.LOAD_STAGES and cache:
+            # segunda carga, ya desde la caché Parquet
+            _, results[name + '_cached'] = measure_stage(instrumentation, name + '_cached', function, arguments)
+    results['max_rss_mib'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return results
+
+
+def compare(results, baseline):
+    '''
+    Función que imprime, para cada escala y etapa, la razón entre el tiempo actual y el de referencia.
+    '''
+    for scale, stages in results.items():
+        reference = baseline.get('results', {}).get(scale)
+        if reference is None:
+            continue
+        print(f'{scale} sesiones, comparado con la referencia:')
+        for name, values in stages.items():
+            if not isinstance(values, dict) or name not in reference:
+                continue
+            ratio = values['seconds'] / reference[name]['seconds'] if reference[name]['seconds'] else float('nan')
+            print(f'  {name:<18} {reference[name]["seconds"]:9.3f} s -> {values["seconds"]:9.3f} s  (x{ratio:.2f})')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1_000_000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default='files/bench')
+    parser.add_argument('--cache', action='store_true', help='cargar a través de la caché Parquet')
+    parser.add_argument('--no-memory', action='store_true', help='no medir la memoria con tracemalloc')
+    parser.add_argument('--output', help='archivo JSON donde guardar los resultados')
+    parser.add_argument('--baseline', help='archivo JSON de resultados de referencia')
+    args = parser.parse_args()
+
+    results = {}
+    for sessions in args.sessions:
+        print(f'{sessions} sesiones')
+        results[str(sessions)] = run_scale(args.data_dir, sessions, args.seed, args.cache, not args.no_memory)
+    report = {
+        'meta': {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                 'machine': platform.machine(), 'cpus': os.cpu_count(), 'seed': args.seed,
+                 'cache': args.cache, 'memory': not args.no_memory},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
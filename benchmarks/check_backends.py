@@ -0,0 +1,87 @@
+'''
+Comprueba que el backend de DuckDB produce las mismas tablas que el de pandas.
+
+Se generan (una sola vez) los CSV sintéticos en `--data-dir`, se ejecutan las etapas de
+`analitica.pipeline` con los dos backends, sin caché ni resultados guardados, y se comparan
+todas las salidas comunes. Las sumas en coma flotante se hacen en otro orden en DuckDB, así
+que los números se comparan con una tolerancia relativa (`--rtol`). Termina con código 1
+si alguna tabla no coincide.
+
+Uso:
+    python -m benchmarks.check_backends --sessions 1000000 --memory-limit 1GB
+'''
+import argparse
+import sys
+import time
+
+import pandas as pd
+
+from analitica import pipeline
+from benchmarks.bench_pipeline import dataset
+
+
+def outputs():
+    '''
+    Función que devuelve las salidas que calculan los dos backends.
+    '''
+    return sorted(set(pipeline.GRAPHS['pandas'].outputs()) & set(pipeline.GRAPHS['duckdb'].outputs()))
+
+
+def compare(expected, actual, rtol):
+    '''
+    Función que compara dos salidas (tablas, series o escalares) y devuelve el mensaje de la
+    primera diferencia, o None si coinciden.
+    '''
+    try:
+        if isinstance(expected, pd.DataFrame):
+            pd.testing.assert_frame_equal(expected, actual, check_exact=False, rtol=rtol)
+        elif isinstance(expected, pd.Series):
+            pd.testing.assert_series_equal(expected, actual, check_exact=False, rtol=rtol)
+        elif expected != actual and abs(expected - actual) > rtol * abs(expected):
+            raise AssertionError(f'{expected!r} != {actual!r}')
+    except AssertionError as error:
+        return str(error)
+    return None
+
+
+def run(paths, memory_limit=None, rtol=1e-9, cache_dir=None):
+    '''
+    Función que ejecuta los dos backends sobre los CSV de `paths` y devuelve las salidas que
+    no coinciden, con el mensaje de la diferencia. Con `cache_dir` los dos backends leen la
+    caché Parquet de `analitica.carga` (la construye el de pandas, que se ejecuta primero).
+    '''
+    names = outputs()
+    contexts = {}
+    for backend in ('pandas', 'duckdb'):
+        begin = time.perf_counter()
+        contexts[backend] = pipeline.run(paths['visits_log_us'], paths['orders_log_us'], paths['costs_us'],
+                                         cache_dir=cache_dir, outputs=names, backend=backend,
+                                         memory_limit=memory_limit)
+        print(f'{backend:<8} {time.perf_counter() - begin:9.3f} s')
+    mismatches = {}
+    for name in names:
+        message = compare(contexts['pandas'][name], contexts['duckdb'][name], rtol)
+        print(f'  {name:<28} {"ok" if message is None else "DISTINTA"}')
+        if message is not None:
+            mismatches[name] = message
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sessions', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default='files/bench')
+    parser.add_argument('--memory-limit', help='memoria máxima de DuckDB (por ejemplo, 1GB)')
+    parser.add_argument('--rtol', type=float, default=1e-9)
+    args = parser.parse_args()
+
+    _, paths = dataset(args.data_dir, args.sessions, args.seed)
+    mismatches = run(paths, args.memory_limit, args.rtol)
+    for name, message in mismatches.items():
+        print(f'\n{name}:\n{message}')
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+'''
+Generador determinista de datos sintéticos con el formato de los registros de Y.Afisha.
+
+Los datos se generan por bloques: cada bloque usa su propia semilla (`seed`, `chunk`) y
+el `uid` se obtiene del índice del usuario con un hash, así que no hace falta guardar
+ninguna tabla de usuarios y se pueden escribir cientos de millones de sesiones con
+memoria acotada.
+'''
+import os
+
+import numpy as np
+import pandas as pd
+
+from analitica.hll import hash_uids
+
+
+START = pd.Timestamp('2017-06-01')
+END = pd.Timestamp('2018-06-01')
+
+SOURCES = [1, 2, 3, 4, 5, 6, 7, 9, 10]
+
+# pedidos por sesión en los datos generados con write_dataset()
+ORDER_RATE = 0.05
+
+
+def _rng(seed, chunk):
+    return np.random.default_rng([seed, chunk])
+
+
+def synthetic_visits(n_sessions, n_users=None, seed=0, chunk=0):
+    '''
+    Función que genera `n_sessions` visitas con las columnas del CSV `visits_log_us`.
+    Algunos usuarios concentran muchas más sesiones que otros, como en los registros reales.
+    '''
+    rng = _rng(seed, chunk)
+    n_users = n_users or max(n_sessions // 5, 1)
+    # los índices bajos son mucho más frecuentes: P(índice < k) = sqrt(k / n_users). No se
+    # usa Zipf(1.3) (`(rng.zipf(1.3) - 1) % n_users`): con esa cola un/una solo/a usuario/a
+    # reúne ~25 % de las sesiones y el merge sesiones × pedidos de bench_conversion pasa de
+    # O(filas) a miles de millones de filas; aquí el más activo tiene ~0.2 %
+    user_index = (n_users * rng.random(n_sessions) ** 2).astype(np.uint64)
+    span = int((END - START).total_seconds())
+    start = START + pd.to_timedelta(rng.integers(0, span, size=n_sessions), unit='s')
+    duration = pd.to_timedelta(rng.exponential(600, size=n_sessions).astype(np.int64), unit='s')
+    return pd.DataFrame({
+        'Device': pd.Categorical(rng.choice(['desktop', 'touch'], size=n_sessions, p=[0.73, 0.27])),
+        'End Ts': start + duration,
+        'Source Id': rng.choice(SOURCES, size=n_sessions),
+        'Start Ts': start,
+        'Uid': hash_uids(user_index + np.uint64(seed)),
+    })
+
+
+def synthetic_orders(visits, n_orders, seed=0, chunk=0):
+    '''
+    Función que genera `n_orders` pedidos con las columnas del CSV `orders_log_us`.
+    Cada pedido parte de una visita al azar, así que todo comprador tiene al menos una sesión.
+    '''
+    rng = _rng(seed + 1, chunk)
+    rows = rng.integers(0, len(visits), size=n_orders)
+    delay = pd.to_timedelta(rng.exponential(3 * 86400, size=n_orders).astype(np.int64), unit='s')
+    buy_ts = (visits['Start Ts'].to_numpy()[rows] + delay).floor('min')
+    return pd.DataFrame({
+        'Buy Ts': buy_ts,
+        'Revenue': np.round(rng.lognormal(1.0, 1.0, size=n_orders), 2),
+        'Uid': visits['Uid'].to_numpy()[rows],
+    })
+
+
+def synthetic_costs(seed=0):
+    '''
+    Función que genera los gastos diarios por fuente con las columnas del CSV `costs_us`.
+    '''
+    rng = _rng(seed + 2, 0)
+    days = pd.date_range(START, END - pd.Timedelta(days=1), freq='D')
+    return pd.DataFrame({
+        'source_id': np.repeat(SOURCES, len(days)),
+        'dt': np.tile(days, len(SOURCES)),
+        'costs': np.round(rng.gamma(2.0, 50.0, size=len(SOURCES) * len(days)), 2),
+    })
+
+
+def write_dataset(directory, n_sessions, seed=0, chunk_size=5_000_000, order_rate=ORDER_RATE):
+    '''
+    Función que escribe en `directory` los tres CSV (`visits_log_us.csv`, `orders_log_us.csv`
+    y `costs_us.csv`) con `n_sessions` visitas, generados por bloques de `chunk_size` filas.
+    Devuelve las rutas de los archivos.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    paths = {name: os.path.join(directory, name + '.csv')
+             for name in ('visits_log_us', 'orders_log_us', 'costs_us')}
+    n_users = max(n_sessions // 5, 1)
+    for chunk, begin in enumerate(range(0, n_sessions, chunk_size)):
+        size = min(chunk_size, n_sessions - begin)
+        visits = synthetic_visits(size, n_users=n_users, seed=seed, chunk=chunk)
+        orders = synthetic_orders(visits, int(size * order_rate), seed=seed, chunk=chunk)
+        mode, header = ('w', True) if chunk == 0 else ('a', False)
+        visits.to_csv(paths['visits_log_us'], mode=mode, header=header, index=False)
+        orders.to_csv(paths['orders_log_us'], mode=mode, header=header, index=False)
+    synthetic_costs(seed).to_csv(paths['costs_us'], index=False)
+    return paths
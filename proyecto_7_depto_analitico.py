@@ -75,6 +75,17 @@ import numpy as np
 import seaborn as sns
 from matplotlib import pyplot as plt
 
+from analitica import atribucion
+from analitica.actividad import active_users, trailing_active_users
+from analitica.calendario import month_codes, month_start
+from analitica.cohortes import report_matrix
+from analitica.carga import load_visits, load_orders, load_costs
+from analitica.conversion import conversion_users_by_time, conversion_time_cohort
+from analitica.sesiones import session_features
+from analitica.conversion import first_session_cohort as first_session_cohort_table
+from analitica.retencion import retention
+from analitica.usuarios import UidDictionary, first_per_user, per_user_table
+
 # %% [markdown]
 # ## Cargar datos <a id='cargar_datos'></a>
 
@@ -155,11 +166,22 @@ visits_log_us['Device'].value_counts()
 # %% [markdown]
 # ### Descarga Completa de Datos Optimizados  <a id='datos_op'></a>
 
+# %% [markdown]
+# <div style="background-color: lightyellow; padding: 10px;">
+# 
+# <span style="color: darkblue;">  
+#     
+# Los registros completos pesan varios GB, por lo tanto se cargan con `analitica.carga`: la primera vez cada CSV se convierte a Parquet con los tipos de datos correctos (`uid` como uint64, `Device` como category, `source_id` como entero y las fechas como datetime64) y las siguientes ejecuciones leen esa caché. La caché se reconstruye sólo si cambia el archivo de origen.
+#     
+# </span>
+#     
+# </div>
+
 # %%
 # se descargan los datos completos con los tipos de datos correctos
-visits_log_us = pd.read_csv('/datasets/visits_log_us.csv', dtype= {'Device': 'category'}, parse_dates= ['Start Ts', 'End Ts'])
-orders_log_us = pd.read_csv('/datasets/orders_log_us.csv', parse_dates= ['Buy Ts'])
-costs_us = pd.read_csv('/datasets/costs_us.csv', parse_dates= ['dt'])
+visits_log_us = load_visits('/datasets/visits_log_us.csv')
+orders_log_us = load_orders('/datasets/orders_log_us.csv')
+costs_us = load_costs('/datasets/costs_us.csv')
 
 # %%
 #se revisa la información de los datos de las visitas
@@ -281,6 +303,23 @@ costs_us.duplicated().sum()
 #     
 # </div>
 
+# %% [markdown]
+# <div style="background-color: lightyellow; padding: 10px;">
+# 
+# <span style="color: darkblue;">  
+#     
+# Los `uid` son enteros de 64 bits que se repiten en millones de filas. Con `analitica.usuarios` se construye una sola vez un diccionario que asigna a cada `uid` un código entero denso (int32), el mismo en visitas y pedidos; así el último día de visita, el primer mes de cada usuario/a y las demás agregaciones por usuario/a se obtienen sobre arreglos indexados por el código (`np.minimum.at`, `np.bincount`) y las uniones por `uid` se vuelven búsquedas por posición. El mismo diccionario se usa en el informe del producto y en el de ventas.
+#     
+# </span>
+#     
+# </div>
+
+# %%
+# se construye el diccionario de uid y se codifican las visitas y los pedidos
+uid_dictionary, (visit_users, order_users) = UidDictionary.build(visits_log_us['uid'], orders_log_us['uid'])
+n_users = len(uid_dictionary)
+n_users
+
 # %% [markdown]
 # ## Informe del Producto <a id='informe_producto'></a>
 
@@ -293,18 +332,16 @@ visits_log_us.head()
 # 
 # <span style="color: darkblue;">  
 #     
-# Para saber cuántas personas usan el sevidor cada día, semana y mes; primero se crea una columna para el año, mes, semana y día en el DataFrame `visits_log_us`. Con `dt` se extrae el dato de la fecha de interes.
+# Para saber cuántas personas usan el sevidor cada día, semana y mes; primero se crea una columna para el año, mes, semana y día en el DataFrame `visits_log_us`. Con `session_features()` del módulo `analitica.sesiones` se calculan todas en una sola pasada sobre las fechas, junto con la duración de cada sesión que se usa más adelante.
 #     
 # </span>
 #     
 # </div>
 
 # %%
-# se crean las nuevas columnas
-visits_log_us['session_year'] = visits_log_us['start_ts'].dt.year
-visits_log_us['session_month'] = visits_log_us['start_ts'].dt.month
-visits_log_us['session_week'] = visits_log_us['start_ts'].dt.isocalendar().week
-visits_log_us['session_date'] = visits_log_us['start_ts'].dt.date
+# se crean las nuevas columnas (año, mes, semana ISO, día y duración en minutos) en una sola pasada
+features = session_features(visits_log_us['start_ts'], visits_log_us['end_ts'])
+visits_log_us[features.columns] = features
 
 # %%
 # se imprimen las 3 filas del DataFrame visits_log_us
@@ -320,25 +357,45 @@ visits_log_us.head(3)
 # - **WAU**: el número de usuarios activos semanales;
 # - **MAU**: el número de usuarios activos mensuales.
 #     
+# Las columnas `session_week` y `session_month` sólo tienen el número de la semana y del mes: al agrupar por ellas, la semana 22 de 2017 y la de 2018 se cuentan como una sola. Con `active_users()` del módulo `analitica.actividad` las visitas se ordenan una sola vez por usuario y día, y de ahí salen los usuarios únicos por día, por semana (identificada por su lunes) y por mes (por su primer día), ya con el año, y los usuarios activos en los últimos 7 y 30 días de cada día.
+#     
 # </span>
 #     
 # </div>
 
 # %%
-# Agruparemos los datos por fecha del día de la sesión y buscaremos la media
-dau_total = visits_log_us.groupby(['session_date']).agg({'uid': 'nunique'}).mean().round()
+# usuarios únicos por día, semana y mes (con su año) y activos en los últimos 7 y 30 días
+activity = active_users(visits_log_us['start_ts'], visits_log_us['uid'])
+
+# %%
+# usuarios únicos por fecha del día de la sesión y su media
+dau_total = activity['daily'].mean().round()
 dau_total
 
 # %%
-# Agruparemos los datos por semana de la sesión y buscaremos la media
-wau_total = visits_log_us.groupby(['session_week']).agg({'uid': 'nunique'}).mean().round()
+# usuarios únicos por semana de la sesión y su media
+wau_total = activity['weekly'].mean().round()
 wau_total
 
 # %%
-# Agruparemos los datos por mes de la sesión y buscaremos la media
-mau_total = visits_log_us.groupby(['session_month']).agg({'uid': 'nunique'}).mean().round()
+# usuarios únicos por mes de la sesión y su media
+mau_total = activity['monthly'].mean().round()
 mau_total
 
+# %%
+# se grafican los usuarios activos en los últimos 7 y 30 días de cada día
+activity['rolling'].plot(
+                         kind= 'line',
+                         figsize= [12,8],
+                         fontsize= 12,
+                         color= ['darkblue', 'orange']
+                              )
+plt.title('Usuarios Activos en los Últimos 7 y 30 Días', fontsize=15)
+plt.xlabel('Fecha', fontsize=15)
+plt.ylabel('Usuarios Activos', fontsize=15)
+
+plt.show()
+
 # %% [markdown]
 # <div style="background-color: lightyellow; padding: 10px;">
 # 
@@ -360,6 +417,52 @@ sticky_wau
 sticky_mau = dau_total / mau_total
 sticky_mau
 
+# %% [markdown]
+# <div style="background-color: lightyellow; padding: 10px;">
+# 
+# <span style="color: darkblue;">  
+#     
+# El factor de adherencia promedio no muestra cómo cambia con el tiempo. Con `trailing_active_users()` del módulo `analitica.actividad` se obtiene, para cada día, el DAU, los usuarios activos en los últimos 7 y 28 días (R7 y R28) y su cociente. La serie se actualiza día a día con el último día de visita de cada usuario, así que también se puede alimentar con las particiones diarias conforme llegan.
+#     
+# </span>
+#     
+# </div>
+
+# %%
+# DAU, usuarios activos en los últimos 7 y 28 días (R7, R28) y factor de adherencia de cada día
+# (el último día de visita se guarda por posición, así que se pasan los códigos del diccionario de uid)
+trailing = trailing_active_users(visits_log_us['start_ts'], visit_users)
+trailing.head()
+
+# %%
+# se grafica el factor de adherencia diario a lo largo del tiempo
+trailing[['sticky_7d', 'sticky_28d']].plot(
+                                          kind= 'line',
+                                          figsize= [12,8],
+                                          fontsize= 12,
+                                          color= ['darkblue', 'orange']
+                                               )
+plt.title('Factor de Adherencia Diario (DAU/R7 y DAU/R28)', fontsize=15)
+plt.xlabel('Fecha', fontsize=15)
+plt.ylabel('Factor de Adherencia', fontsize=15)
+
+plt.show()
+
+# %% [markdown]
+# <div style="background-color: lightyellow; padding: 10px;">
+# 
+# <span style="color: darkblue;">  
+#     
+# Cuando el registro de visitas no cabe en memoria, las mismas métricas se obtienen por bloques con `stream_active_users()` del módulo `analitica.streaming`, que guarda para cada día, semana y mes el conjunto exacto de usuarios únicos: `stream_active_users('/datasets/visits_log_us.csv', chunksize=1_000_000)`.
+#     
+# Para los tableros, donde basta una aproximación, `approx_active_users()` del módulo `analitica.hll` construye un sketch HyperLogLog por día y obtiene el WAU y el MAU uniendo los sketches diarios; el parámetro `error` fija el error relativo típico y `by` permite separar por `device` o `source_id`.
+#     
+# Si se van a hacer muchas preguntas por dispositivo o fuente, conviene construir una sola vez el cubo `SessionCube.build(visits_log_us)` del módulo `analitica.cubo` (celdas por día × `device` × `source_id`); después `cube.sessions_per_user(device='touch')`, `cube.active_users(source_id=[3, 4])` o `cube.duration_stats(start='2017-09-01', end='2017-09-30')` responden en milisegundos sin volver a agrupar las visitas.
+#     
+# </span>
+#     
+# </div>
+
 # %% [markdown]
 # <div style="background-color: lightyellow; padding: 10px;">
 # 
@@ -405,10 +508,8 @@ plt.show()
 sessions_per_user['sess_per_user'].mode()
 
 # %%
-# se calculan la duración de las sesiones, se crea una nueva columna en el DataFrame 'visits_log_us'
-visits_log_us['session_duration_min'] = (visits_log_us['end_ts'] - visits_log_us['start_ts']).dt.seconds
-# se transforman los segundos a minutos
-visits_log_us['session_duration_min'] = visits_log_us['session_duration_min'] / 60
+# la duración de las sesiones en minutos ('session_duration_min') ya se calculó junto con las columnas de fecha,
+# como la diferencia exacta entre 'end_ts' y 'start_ts' (incluyendo los días completos)
 # se imprimen las primeras 5 filas
 visits_log_us.head()
 
@@ -461,7 +562,7 @@ visits_log_us['session_duration_min'].mode()
 # <span style="color: darkblue;">  
 #     
 # **Conclusiones:**  
-# La cantidad de usuarios activos diarios son de 908, a la semana 5,825 y al mes son 23,228. El factor de adherencia semanal es de 0.155, lo que nos dice que los usuarios interactuan con el servicio el 15.5 % de los días de las semana.  El factor de adherencia es bajo, por tanto, la frecuencia con la que los usuarios regresan a la semana se pueden mejorar. Por otro lado, el factor de adherencia mensual es es de 3.9 %, el cuál es muy bajo, también hay mucha área de oprtunidad para mejor dicho factor si el departamento de markenting desea aumentar la cantidad de los usuarios que regresan.  
+# La cantidad de usuarios activos diarios es de 908 y al mes es de 23,228 (el MAU no depende de separar los meses por año porque los datos cubren doce meses distintos). El WAU (`wau_total`) y el factor de adherencia semanal (`sticky_wau`) son los que imprimen las celdas anteriores, con las semanas separadas por año; las cifras de 5,825 y 0.155 que se citaban antes se calcularon agrupando sólo por el número de semana (la semana 22 de 2017 y la de 2018 contaban juntas) y ya no corresponden a este cálculo. El factor de adherencia semanal indica qué fracción de los días de la semana interactúan los usuarios con el servicio.  El factor de adherencia es bajo, por tanto, la frecuencia con la que los usuarios regresan a la semana se pueden mejorar. Por otro lado, el factor de adherencia mensual es es de 3.9 %, el cuál es muy bajo, también hay mucha área de oprtunidad para mejor dicho factor si el departamento de markenting desea aumentar la cantidad de los usuarios que regresan.  
 # El número de sesiones diarias es de 1 aproximadamente, mientras que, la duración media de las sesiones es de 1 minuto. Hay valores para la duración de las sesión de 1408 minutos, aquí es importante revisar si son valores atípicos o sin los usuarios o usuarias dejaron abiertas sus sesiones.
 # 
 #     
@@ -485,53 +586,94 @@ visits_log_us['session_duration_min'].mode()
 #     
 # </div>
 
+# %% [markdown]
+# <div style="background-color: lightyellow; padding: 10px;">
+# 
+# <span style="color: darkblue;">  
+#     
+# Los meses se representan con códigos enteros (`año * 12 + mes - 1`) del módulo `analitica.calendario`; así la edad de las cohortes es una resta exacta de enteros. Las fechas se recuperan con `month_start()` sólo para mostrar las tablas y gráficas.
+#     
+# </span>
+#     
+# </div>
+
 # %%
 # agregar columna de mes de inicio de sesión en DataFrame 'visits_log_us'
-# y en el DataFrame 'orders_log_us' la columna de mes de pedido
-visits_log_us['session_month'] = visits_log_us['start_ts'].astype('datetime64[M]')
-orders_log_us['order_month'] = orders_log_us['buy_ts'].astype('datetime64[M]')
+# y en el DataFrame 'orders_log_us' la columna de mes de pedido, como códigos enteros de mes
+visits_log_us['session_month'] = month_codes(visits_log_us['start_ts'])
+orders_log_us['order_month'] = month_codes(orders_log_us['buy_ts'])
 
 # %%
 
 # se busca la primer sesión para cada usuario
-first_session_dates = visits_log_us.groupby('uid')['session_month'].min().reset_index()
-# se cambia el nombre de la columna 
-first_session_dates.columns = ['uid', 'first_session_month']
+first_session = first_per_user(visit_users, visits_log_us['session_month'].to_numpy(), n_users)
+first_session_dates = per_user_table(uid_dictionary, first_session, 'first_session_month')
 first_session_dates.head()
 
+# %% [markdown]
+# <div style="background-color: lightyellow; padding: 10px;">
+# 
+# <span style="color: darkblue;">  
+#     
+# Con el mes de la primera sesión se forma la matriz de retención: para cada cohorte (`first_session_month`) y cada mes de vida, cuántos usuarios de la cohorte volvieron a tener alguna sesión y qué fracción de la cohorte son. `retention()` del módulo `analitica.retencion` busca la cohorte de cada visita por posición con los códigos de usuario y cuenta los usuarios distintos de cada celda con un solo ordenamiento, sin volver a unir las visitas con `first_session_dates`; con `by='device'` o `by='source_id'` separa las cohortes por el dispositivo o la fuente de la primera sesión.
+#     
+# </span>
+#     
+# </div>
+
 # %%
-# se una al DataFrame 'visits_log_us' con merge
-visits_log_us_ = visits_log_us.merge(first_session_dates, on= 'uid')
-visits_log_us_.head(3)
+# usuarios activos y tasa de retención por cohorte de primera sesión y mes de vida
+cohort_retention = retention(visits_log_us, visit_users, n_users)
+retention_rate = cohort_retention['retention_rate']
 
 # %%
-# se busca la fecha para la primera orden para cada usuario
-first_buy_dates = orders_log_us.groupby('uid')['order_month'].min().reset_index()
-# se cambia el nombre de la columna 
-first_buy_dates.columns = ['uid', 'first_buy_month']
-first_buy_dates.head()
+# se grafica un mapa de calor a partir de retention_rate
+plt.figure(figsize=(16, 9))
+
+sns.heatmap(retention_rate, annot=True, fmt='.1%', cmap="crest", linewidth=.01,
+            yticklabels=retention_rate.index.strftime('%Y-%m'))
+
+plt.title('Retención de los Usuarios por Cohorte de Primera Sesión', fontsize= 16)
+plt.xlabel('Edad de la Cohorte', fontsize= 14)
+
+
+plt.show()
 
 # %%
-# se una al DataFrame 'orders_log_us' con merge
-orders_log_us_ = orders_log_us.merge(first_buy_dates, on= 'uid')
-orders_log_us_.head(3)
+# tasa de retención por dispositivo de la primera sesión
+retention(visits_log_us, visit_users, n_users, by='device')['retention_rate'].round(3)
 
 # %%
-# se unen los DataFrame 'visits_log_us_' con 'orders_log_us_'
-visits_orders = visits_log_us_.merge(orders_log_us_, on= 'uid')
-visits_orders.head(3)
+# se busca la fecha para la primera orden para cada usuario
+first_buy = first_per_user(order_users, orders_log_us['order_month'].to_numpy(), n_users)
+first_buy_dates = per_user_table(uid_dictionary, first_buy, 'first_buy_month')
+first_buy_dates.head()
 
 # %%
-# se calcula los días trancurridos cuando el/la usuario/a se convierte en cliente
-visits_orders['convertion_time_days'] = (visits_orders['first_buy_month'] - visits_orders['first_session_month']).dt.days
-visits_orders.head(3)
+# hora exacta (en nanosegundos) de la primera sesión y del primer pedido de cada usuario/a,
+# para medir el tiempo de conversión en días completos y no entre inicios de mes
+first_session_ts = first_per_user(visit_users, visits_log_us['start_ts'].to_numpy(dtype='datetime64[ns]').view(np.int64), n_users)
+first_buy_ts = first_per_user(order_users, orders_log_us['buy_ts'].to_numpy(dtype='datetime64[ns]').view(np.int64), n_users)
 
 # %% [markdown]
 # <div style="background-color: lightyellow; padding: 10px;">
 # 
 # <span style="color: darkblue;">  
 #     
-# Se categorizan los días, para esto se definen los intervalos  en los cuales categorizarán los valores de tiempo de conversión de la columna `convertion_time_days` y se guardan en `bins`. En la variable `labels` se alamcenan los nombres de las etiquetas para cada uno de los intervalos definidos en `bins`. Después se emplea la función `cut()` para asignar cada valor de `convertion_time_days` al intervalo adecuado según los límites definidos en bins, y luego se le asigna la etiqueta correspondiente de labels. 
+# No se unen todas las sesiones con todos los pedidos de cada usuario/a (`visits_log_us.merge(orders_log_us, on='uid')`), porque eso genera sesiones×pedidos filas por usuario/a y con los registros completos no cabe en memoria. Basta con una fila por comprador/a con el mes de su primera sesión y el mes de su primer pedido, que se obtiene por posición a partir de los primeros meses por código de usuario/a.
+#     
+# </span>
+#     
+# </div>
+
+# %% [markdown]
+# <div style="background-color: lightyellow; padding: 10px;">
+# 
+# <span style="color: darkblue;">  
+#     
+# Se categorizan los días, para esto se definen los intervalos  en los cuales categorizarán los valores de tiempo de conversión de la columna `convertion_time_days` y se guardan en `bins`. En la variable `labels` se alamcenan los nombres de las etiquetas para cada uno de los intervalos definidos en `bins`. Cada valor de `convertion_time_days` se asigna al intervalo adecuado según los límites definidos en bins (con `np.searchsorted`, igual que `cut()`), y luego se le asigna la etiqueta correspondiente de labels. 
+#     
+# El tiempo de conversión son los días completos entre la hora de la primera sesión y la hora del primer pedido. Antes se restaban los inicios de mes de ambas fechas, de modo que las categorías de 0 días, 1 día y 1 semana sólo indicaban si la compra fue en el mismo mes que la primera sesión.
 #     
 # </span>
 #     
@@ -541,17 +683,16 @@ visits_orders.head(3)
 # se categoriza el tiempo de conversión
 bins = [-1, 0, 1, 7, 30, 60, 90, 120, 150, 180, 210, 240, 270, 300, 330, 360]  # Definir los intervalos 
 labels = ['Conversion 0d', 'Conversion 1d', 'Conversion 1w', 'Conversion 1m', 'Conversion 2m', 'Conversion 3m', 'Conversion 4m', 'Conversion 5m', 'Conversion 6m', 'Conversion 7m', 'Conversion 8m', 'Conversion 9m', 'Conversion 10m', 'Conversion 11m', 'Conversion 12m']
-visits_orders['conversion_category'] = pd.cut(visits_orders['convertion_time_days'], bins=bins, labels=labels)
+# se calculan los días trancurridos cuando el/la usuario/a se convierte en cliente y se categorizan,
+# con una fila por comprador/a
+users_conversion = conversion_users_by_time(uid_dictionary, first_session_ts, first_buy_ts, bins=bins, labels=labels)
 # se imprime una muestra de filas
-visits_orders.sample(5)
+users_conversion.sample(5)
 
 # %%
 # ahora se crea una tabla dinámica para saber la cantidad de pedidos que hicieron los usuarios por cohorte (que son los que 
 # se registracion por primera vez) y el tiempo que tardaron en hacer su primer pedido 'conversion_category'
-first_session_cohort = visits_orders.pivot_table(index= 'first_session_month',
-                                       columns= 'conversion_category',
-                                       values= 'uid',
-                                       aggfunc= 'nunique')
+first_session_cohort = first_session_cohort_table(users_conversion)
 
 # %%
 # se grafica un mapa de calor a partir de orders_pivot
@@ -572,7 +713,7 @@ plt.show()
 #     
 # **Conclusiones:**  
 # En en mapa de calor anterior muestra que los cohortes por primer inicio de sesión y la cantidad de usuarios que se hicieron su primer pedido por categoría de conversión, desde 0 días hasta 12 meses.  
-# Se observa que para todas las cohortes los usuarios y usuarias hicieron su primer pedido el mismo día, (Conversion d). Las cohortes de octubre, noviembre y diciembre del 2017 tienen la mayoría de usuarios y usuarias que hicieron su primer pedido el mismo día, 3761, 3357 y 3491, respectivamente; probablemente es debido a la temporada, ya que se celebran diferentes festividades, por lo que los/las clientes pueden necesitar lo más pronto el producto.  
+# El tiempo de conversión se mide en días exactos entre la primera sesión y el primer pedido, así que la categoría Conversion 0d sólo cuenta a quienes compraron el mismo día de su primera sesión y Conversion 1d, 1w, 1m, ... a quienes tardaron hasta un día, una semana, un mes, etc. El mapa de calor permite comparar cuántos usuarios y usuarias de cada cohorte compraron en cada categoría; las cohortes de octubre a diciembre del 2017 son las que más conviene revisar, porque en esos meses se celebran diferentes festividades y los/las clientes pueden necesitar el producto lo más pronto posible.  
 # También se observa que en algunas cohortes los y las clientes tardaron un mes en realizar su primer pedido y en otros hasta 4 meses; la cohorte de junio de 2017 es la única que tiene 54 usuarios que hicieron su primer pedido despues de 12 meses. Las usuarias y usurios del cohorte de mayo del 2018 la mayoría hizo su primer pedido el mismo día.   
 # 
 #     
@@ -583,10 +724,9 @@ plt.show()
 # %%
 # Ahora las cohortes se definen por el periodo de tiempo de conversión
 # se emplea una tabla dinámica para saber la cantidad de pedidos que hicieron de acuerdo a la fuente del anuncio
-convertion_time_cohort = visits_orders.pivot_table(index= 'conversion_category',
-                             columns= 'source_id',
-                             values= 'uid',
-                             aggfunc= 'nunique')
+# cada comprador/a cuenta en todas las fuentes desde las que tuvo alguna sesión
+convertion_time_cohort = conversion_time_cohort(users_conversion, visits_log_us,
+                                                dictionary=uid_dictionary, visit_users=visit_users)
 
 # %%
 # se grafica un mapa de calor a partir de convertion_time_cohort
@@ -632,6 +772,8 @@ plt.show()
 order_period = orders_log_us.groupby(['order_month'])['uid'].agg(['count', 'nunique']).reset_index()
 # se cambia el nombre de las columnas
 order_period.columns = ['order_month', 'n_orders', 'n_users']
+# se convierte el código de mes a fecha para mostrarlo
+order_period['order_month'] = month_start(order_period['order_month'])
 # se crea una columna para las ordenes por usuario
 order_period['orders_per_user'] = order_period['n_orders'] / order_period['n_users']
 order_period.head()
@@ -678,16 +820,28 @@ print(f'Los pedidos en promedio que se hacen por usuario/a son de {orders_per_us
 # <span style="color: darkblue;">  
 #     
 # ****  
-# Para calcular el LTV (la cantidad total de dinero que un cliente aporta a la empresa en promedio al realizar compras), se agrupan los datos por clientes con la fecha de su primera compra a partir del DataFrame `orders_log_us`, por tanto los/las clientes se organizan por cohorte por fecha de primer pedido. Después se agrupan por fecha de la cohorte y se calcula la cantidad de usuarios y usuarias únicos/as. Luego el DataFrame que tiene las fechas de las cohortes se agregan al DataFrame `orders_log_us` con `merge`, enseguida se agrupan los datos por cohorte y por la fecha de compra (mes de compra) y se calcula el total de ganancias (revenue) para cada grupo. 
+# Para calcular el LTV (la cantidad total de dinero que un cliente aporta a la empresa en promedio al realizar compras), se agrupan los datos por clientes con la fecha de su primera compra a partir del DataFrame `orders_log_us`, por tanto los/las clientes se organizan por cohorte por fecha de primer pedido. Después se agrupan por fecha de la cohorte y se calcula la cantidad de usuarios y usuarias únicos/as. Luego las fechas de las cohortes se agregan al DataFrame `orders_log_us` por el código de cada usuario/a, enseguida se agrupan los datos por cohorte y por la fecha de compra (mes de compra) y se calcula el total de ganancias (revenue) para cada grupo. 
+#     
+# </span>
+#     
+# </div>
+
+# %% [markdown]
+# <div style="background-color: lightyellow; padding: 10px;">
+# 
+# <span style="color: darkblue;">  
+#     
+# Los registros crecen cada día. Para no recalcular las cohortes con todo el historial, el módulo `analitica.incremental` guarda el primer mes de sesión y de pedido de cada usuario/a y las ganancias por cohorte y mes, y sólo procesa las particiones nuevas: `update('files/cache/cohortes.npz', 'files/particiones').tables()` devuelve `report`, `result`, `cac_by_source` y `result_romi`.
+#     
+# Con volúmenes de pedidos de producción, `parallel_ltv(orders_log_us, workers=8)` del módulo `analitica.paralelo` reparte los pedidos entre procesos por el hash del `uid` y devuelve las mismas tablas `cohort_sizes`, `cohorts`, `report` y `result`.
 #     
 # </span>
 #     
 # </div>
 
 # %%
-# se grupan los datos por id de usuario y se busca la fecha de su primer pedido con min()
-first_orders = orders_log_us.groupby('uid').agg({'order_month': 'min'}).reset_index()
-first_orders.columns = ['uid', 'first_order_month']
+# el mes del primer pedido de cada usuario/a ya se calculó por código de usuario/a en 'first_buy'
+first_orders = per_user_table(uid_dictionary, first_buy, 'first_order_month')
 first_orders.head()
 
 # %%
@@ -698,8 +852,9 @@ cohort_sizes.columns = ['first_order_month', 'n_buyers']
 cohort_sizes.head()
 
 # %%
-# se agregan los meses de la primera compra de los clientes y clientas al DataFrame orders_log_us
-orders_with_first_order = orders_log_us.merge( first_orders, on= 'uid')
+# se agregan los meses de la primera compra de los clientes y clientas al DataFrame orders_log_us,
+# buscándolos por la posición del código de cada pedido en lugar de unir por 'uid'
+orders_with_first_order = orders_log_us.assign(first_order_month=first_buy[order_users])
 orders_with_first_order.head()
 
 # %%
@@ -713,12 +868,8 @@ report = pd.merge(cohort_sizes, cohorts, on='first_order_month')
 report.head()
 
 # %%
-# se crea una columna para calcular la edad de cada cohorte
+# se crea una columna para calcular la edad de cada cohorte en meses, restando los códigos de mes
 report['age'] = report['order_month'] - report['first_order_month']
-# se cambia a meses
-report['age'] = report['age'] / np.timedelta64(1, 'M')
-# se redondean los meses
-report['age'] = report['age'].round().astype('int')
 report.head()
 
 # %%
@@ -727,12 +878,15 @@ report['ltv'] = report['revenue'] / report['n_buyers']
 report.head()
 
 # %%
-# Visualizaremos las cohortes como una tabla dinámica para visualizar el
-# ltv dpromedio por cohorte y por edad de la cohorte
-result = report.pivot_table(index= 'first_order_month',
-                            columns= 'age',
-                            values= 'ltv',
-                            aggfunc= 'mean').round()
+# el reporte ya tiene una fila por cohorte y edad: se guarda el LTV como matriz triangular
+# (sólo las edades que alcanza cada cohorte) y se convierte a tabla para visualizar el
+# ltv promedio por cohorte y por edad de la cohorte, con las cohortes como fechas
+ltv_matrix = report_matrix(report, 'ltv')
+result = ltv_matrix.to_frame().round()
+
+# %%
+# LTV acumulado de cada cohorte por edad
+ltv_matrix.cumsum().to_frame().round(2)
 
 
 # %%
@@ -773,24 +927,35 @@ result.sum(axis=1).round().sort_values(ascending= False)
 #     
 # ****  
 # Se calculan los gastos totales en publicidad del Datarame `costs_us`, después se unirá el resultado al DataFrame `report`. Luego se calcula cuánto dinero se gastó a lo largo del tiempo, enseguida se hará el calculo del costo de adquisción de clientes de cada una de las fuentes. Luego se calcula el ROMI dividiendo el LTV (cantidad total de dinero que un cliente aporta a la empresa) entre el CAC (el costo de atraer a cada cliente).
+#     
+# Los costos son diarios, así que primero se suman por mes y fuente con `analitica.atribucion`; unirlos directamente por la fecha del primer día del mes del pedido sólo contaría el gasto del día 1 de cada mes. Cada comprador/a se atribuye a la fuente de su primera sesión y los costos de cada mes se asignan a la cohorte de ese mes de primer pedido.
 # </span>
 #     
 # </div>
 
 # %%
-# se encuentra la suma total de los costos de marketing para cada mes y se guarda el resultado como monthly_costs
-monthly_costs = costs_us.groupby(['dt', 'source_id'])['costs'].sum().reset_index()
+# se encuentra la suma total de los costos de marketing para cada mes y fuente y se guarda el resultado como monthly_costs
+monthly_costs = atribucion.monthly_costs(costs_us)
 monthly_costs.head()
 
 # %%
-# Agreguemos los datos sobre los costos al DataFrame 'report'
-report_with_costs = pd.merge(report, monthly_costs, left_on= 'order_month', right_on= 'dt')
+# se busca la fuente de la primera sesión de cada usuario/a y se cuentan los/las compradores/as
+# por cohorte (mes del primer pedido) y fuente
+acquisition = atribucion.acquisition_sources(visits_log_us, visit_users, n_users)
+cohort_sources = atribucion.cohort_sources(first_buy, acquisition)
+cohort_sources.head()
+
+# %%
+# Agreguemos los datos sobre los costos al DataFrame 'report': los costos de cada mes se atribuyen
+# a la cohorte de ese mes, junto con el CAC y el ROMI
+attribution = atribucion.attribute_costs(report, cohort_sources, monthly_costs)
+report_with_costs = attribution['report_with_costs']
 report_with_costs.head()
 
 
 # %%
 # Se agrupa el total de los costos de marketing a lo largo del tiempo
-source_costs = report_with_costs.groupby('dt')['costs'].sum().sort_values(ascending= False)
+source_costs = atribucion.costs_by_month(monthly_costs)
 source_costs
 
 # %%
@@ -808,13 +973,14 @@ plt.ylabel('Cantidad Total de Costos', fontsize=15)
 plt.show()
 
 # %%
-# Agregamos una columna para calcular el CAC (costo de adquisición de clientes/as)
-report_with_costs['cac'] = report_with_costs['costs'] / report_with_costs['n_buyers']
-report_with_costs.head()
+# el CAC (costo de adquisición de clientes/as) por cohorte y fuente: costos de la fuente en el mes
+# entre los/las compradores/as que llegaron por ella
+cohort_cac = attribution['cohort_cac']
+cohort_cac.head()
 
 # %%
-# se agrupan la suma del costo de adquisición por la fuente del anuncio
-cac_by_source = report_with_costs.groupby('source_id')['cac'].sum().sort_values(ascending= False)
+# el costo de adquisición de cada fuente del anuncio: sus costos totales entre sus compradores/as
+cac_by_source = attribution['cac_by_source']
 cac_by_source
 
 # %%
@@ -833,16 +999,19 @@ plt.ylabel('Costo de Adquisición', fontsize=15)
 plt.show()
 
 # %%
-# se calcula el ROMI (retorno de la inversión en marketing, o return on marketing investment en inglés) 
-# se divide el LTV por el CAC
-report_with_costs['romi'] = report_with_costs['ltv'] / report_with_costs['cac']
-report_with_costs.head()
+# el ROMI (retorno de la inversión en marketing, o return on marketing investment en inglés)
+# es el LTV dividido entre el CAC de la cohorte
+report_with_costs[['first_order_month', 'age', 'ltv', 'cac', 'romi']].head()
+
+# %%
+# el ROMI por cohorte y edad como matriz triangular, convertido a tabla para el mapa de calor
+romi_matrix = report_matrix(report_with_costs, 'romi')
+result_romi = romi_matrix.to_frame()
 
 # %%
-result_romi = report_with_costs.pivot_table(index='first_order_month', 
-                             columns='age', 
-                             values='romi', 
-                             aggfunc='mean')
+# ROMI acumulado y mes de vida en que cada cohorte recupera la inversión (ROMI acumulado >= 1)
+romi_cumulative = romi_matrix.cumsum()
+romi_cumulative.to_frame().round(2), romi_cumulative.first_age(1.0).rename('payback_age')
 
 # %%
 # se grafica un mapa de calor a partir de result_romi
@@ -899,7 +1068,7 @@ plt.show()
 # <span style="color: darkblue;">
 #     
 # **Conclusión General:**  
-# 1. La cantidad de usuarios activos diarios, semanales y mensuales muestra una participación constante (908, 5,825 y 23,228, respectivamente), sin embargo, el factor de adherencia semanal y mensual es bajo, de 0.155 y 0.039, respectivamente. Por tanto, hay área de oportunidad para incrementar dicho valor, si es lo que se desea.  
+# 1. La cantidad de usuarios activos diarios, semanales y mensuales muestra una participación constante (908 al día y 23,228 al mes; el WAU es el de `wau_total`, con las semanas separadas por año), sin embargo, el factor de adherencia semanal (`sticky_wau`) y el mensual (0.039) son bajos. Por tanto, hay área de oportunidad para incrementar dicho valor, si es lo que se desea.  
 #     
 # 2. La duración promedio de las sesiones es de 1 minuto, no obstante, hay algunos valores atípicos que requieren revisión para determinar si son errores o sesiones dejadas abiertas.  
 #     
@@ -0,0 +1,68 @@
+'''
+Usuarios activos de `analitica.actividad` comparados con un recorrido ingenuo día por día.
+'''
+import numpy as np
+import pandas as pd
+import pytest
+
+from analitica.actividad import TrailingActiveUsers, active_users, trailing_active_users, visit_days
+
+
+def _visits(n=3_000, n_users=200, n_days=90, seed=0):
+    rng = np.random.default_rng(seed)
+    start = (pd.Timestamp('2017-12-01')
+             + pd.to_timedelta(rng.integers(0, n_days * 86_400, size=n), unit='s'))
+    return pd.Series(start), rng.integers(0, n_users, size=n).astype(np.int32)
+
+
+def _naive_active(start, users, window):
+    # para cada día, los/las usuarios/as distintos/as con visitas en los `window` días que terminan en él
+    days = start.dt.normalize()
+    dates = pd.date_range(days.min(), days.max(), freq='D')
+    return np.array([len(set(users[(days > date - pd.Timedelta(days=window)) & (days <= date)]))
+                     for date in dates])
+
+
+def test_active_users_matches_groupby():
+    start, users = _visits()
+    tables = active_users(start, users)
+    frame = pd.DataFrame({'uid': users, 'day': start.dt.normalize()})
+    daily = frame.groupby('day')['uid'].nunique()
+    weekly = frame.groupby(frame['day'] - pd.to_timedelta(frame['day'].dt.weekday, unit='D'))['uid'].nunique()
+    monthly = frame.groupby(frame['day'].dt.to_period('M').dt.start_time)['uid'].nunique()
+    assert tables['daily'].tolist() == daily.tolist()
+    assert tables['daily'].index.tolist() == daily.index.tolist()
+    assert tables['weekly'].tolist() == weekly.tolist()
+    assert tables['weekly'].index.tolist() == weekly.index.tolist()
+    assert tables['monthly'].tolist() == monthly.tolist()
+    for window in (7, 30):
+        assert tables['rolling'][f'active_{window}d'].tolist() == _naive_active(start, users, window).tolist()
+
+
+def test_trailing_active_users_matches_naive_loop():
+    start, users = _visits(seed=1)
+    table = trailing_active_users(start, users)
+    for window in (7, 28):
+        assert table[f'active_{window}d'].tolist() == _naive_active(start, users, window).tolist()
+    dau = pd.Series(users).groupby(start.dt.normalize().to_numpy()).nunique()
+    assert table['dau'].reindex(dau.index).tolist() == dau.tolist()
+    assert np.allclose(table['sticky_7d'], table['dau'] / table['active_7d'])
+
+
+def test_trailing_active_users_by_blocks():
+    # procesar las visitas por bloques de días da la misma tabla que procesarlas de una vez
+    start, users = _visits(seed=2)
+    order = np.argsort(start.to_numpy(), kind='stable')
+    days, users = visit_days(start)[order], users[order]
+    trailing = TrailingActiveUsers()
+    for block in np.array_split(np.arange(len(days)), 7):
+        trailing.update(days[block], users[block])
+    pd.testing.assert_frame_equal(trailing.frame(), TrailingActiveUsers().update(days, users).frame())
+
+
+def test_trailing_active_users_rejects_uids():
+    start, _ = _visits(n=10)
+    with pytest.raises(ValueError):
+        TrailingActiveUsers().update(visit_days(start), np.arange(10, dtype=np.uint64))
+    with pytest.raises(ValueError):
+        TrailingActiveUsers().update(visit_days(start), np.full(10, -1, dtype=np.int64))
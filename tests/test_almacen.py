@@ -0,0 +1,57 @@
+'''
+Almacén binario de `analitica.almacen` comparado con la carga del CSV.
+'''
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analitica import almacen
+from analitica.carga import read_csv_typed
+from benchmarks.sinteticos import synthetic_visits
+
+
+def _write(tmp_path, visits):
+    path = str(tmp_path / 'visits_log_us.csv')
+    visits.to_csv(path, index=False)
+    return path
+
+
+def test_store_matches_csv_with_many_sources(tmp_path):
+    # más fuentes de las que caben en int8: los códigos no pueden dar la vuelta
+    visits = synthetic_visits(5_000, seed=1)
+    visits['Source Id'] = np.random.default_rng(1).integers(1, 400, size=len(visits))
+    path = _write(tmp_path, visits)
+    store = almacen.load_store(path, str(tmp_path / 'almacen'))
+    expected = read_csv_typed(path, table='visits_log_us')
+    expected = expected.iloc[np.argsort(expected['Start Ts'].to_numpy(), kind='stable')]
+    frame = store.frame()
+    assert frame['source_id'].tolist() == expected['Source Id'].tolist()
+    assert frame['device'].astype(str).tolist() == expected['Device'].astype(str).tolist()
+    assert frame['uid'].tolist() == expected['Uid'].tolist()
+
+
+def test_too_many_categories(tmp_path):
+    visits = synthetic_visits(40_000, seed=2)
+    visits['Device'] = [f'd{i}' for i in range(len(visits))]
+    with pytest.raises(ValueError, match='int16'):
+        almacen.build_store(_write(tmp_path, visits), str(tmp_path / 'almacen'))
+
+
+def test_old_format_is_rebuilt(tmp_path):
+    path = _write(tmp_path, synthetic_visits(1_000, seed=3))
+    store_dir = str(tmp_path / 'almacen')
+    almacen.build_store(path, store_dir)
+    meta_path = os.path.join(store_dir, 'meta.json')
+    with open(meta_path) as f:
+        meta = json.load(f)
+    del meta['format']
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    store = almacen.load_store(path, store_dir)
+    with open(meta_path) as f:
+        assert json.load(f)['format'] == almacen.STORE_FORMAT
+    assert store.source_id.dtype == np.int16
+    assert isinstance(store.frame()['device'].dtype, pd.CategoricalDtype)
@@ -0,0 +1,94 @@
+'''
+`analitica.cohortes.CohortMatrix` comparada con las mismas operaciones sobre la tabla densa.
+'''
+import numpy as np
+import pandas as pd
+
+from analitica.cohortes import CohortMatrix
+
+
+def _cells(first_month=2017 * 12 + 5, n_months=12, seed=0, missing=0.2, empty_row=True):
+    # celdas (cohorte, edad, valor) de una tabla triangular, con algunas celdas sin dato
+    rng = np.random.default_rng(seed)
+    cohorts, ages = [], []
+    for row in range(n_months):
+        for age in range(n_months - row):
+            if rng.random() >= missing and not (empty_row and row == 3):
+                cohorts.append(first_month + row)
+                ages.append(age)
+    values = rng.gamma(1.0, 0.3, size=len(cohorts))
+    return np.array(cohorts), np.array(ages), values
+
+
+def _dense(cohorts, ages, values, first_month, n_months):
+    # tabla cohortes × edades; NaN en las celdas sin dato y fuera del triángulo
+    grid = np.full((n_months, n_months), np.nan)
+    grid[cohorts - first_month, ages] = values
+    return grid
+
+
+def _triangle(n_months):
+    return np.arange(n_months)[:, None] + np.arange(n_months) < n_months
+
+
+def test_dense_and_frame():
+    cohorts, ages, values = _cells()
+    matrix = CohortMatrix.from_cells(cohorts, ages, values)
+    np.testing.assert_array_equal(matrix.dense(), _dense(cohorts, ages, values, cohorts.min(), 12))
+    report = pd.DataFrame({'first_order_month': cohorts, 'age': ages, 'value': values})
+    pivot = report.pivot_table(index='first_order_month', columns='age', values='value')
+    np.testing.assert_array_equal(matrix.to_frame().to_numpy(), pivot.to_numpy())
+
+
+def test_cumsum_and_payback():
+    cohorts, ages, values = _cells(seed=1)
+    matrix = CohortMatrix.from_cells(cohorts, ages, values)
+    grid = _dense(cohorts, ages, values, cohorts.min(), 12)
+    expected = np.where(_triangle(12), np.nancumsum(grid, axis=1), np.nan)
+    expected[np.isnan(grid).all(axis=1)] = np.nan
+    np.testing.assert_allclose(matrix.cumsum().dense(), expected)
+
+    payback = []
+    for row in expected:
+        reached = np.flatnonzero(row >= 1.0)
+        payback.append(reached[0] if len(reached) else np.nan)
+    np.testing.assert_array_equal(matrix.payback_age(1.0).to_numpy(), payback)
+    assert matrix.payback_age(1.0).index.name == 'first_order_month'
+
+
+def test_slice():
+    cohorts, ages, values = _cells(seed=2)
+    first_month = int(cohorts.min())
+    matrix = CohortMatrix.from_cells(cohorts, ages, values)
+    grid = matrix.dense()
+    for first, last, max_age in [(2, 7, None), (0, 11, 4), (5, 5, 1), (9, 20, None), (-3, 2, 0), (8, 4, None)]:
+        part = matrix.slice(first_month + first, first_month + last, max_age)
+        start, stop = max(first, 0), max(min(last + 1, 12), max(first, 0))
+        expected = grid[start:stop, :max_age]
+        assert len(part) == len(expected)
+        assert part.first_month == first_month + start
+        np.testing.assert_array_equal(part.dense(), expected[:, :part.n_ages])
+        # las edades que la matriz recortada no guarda no las alcanza ninguna de sus cohortes
+        assert np.isnan(expected[:, part.n_ages:]).all()
+    # también con fechas
+    dated = matrix.slice(pd.Timestamp('2017-08-01'), '2017-10-01')
+    np.testing.assert_array_equal(dated.dense(), grid[2:5, :dated.n_ages])
+
+
+def test_merge():
+    left = CohortMatrix.from_cells(*_cells(seed=3, n_months=8))
+    right = CohortMatrix.from_cells(*_cells(first_month=2017 * 12 + 8, seed=4, n_months=10, empty_row=False))
+    merged = left.merge(right)
+    first_month = min(left.first_month, right.first_month)
+    n_rows = max(left.first_month + len(left), right.first_month + len(right)) - first_month
+    grids = []
+    for matrix in (left, right):
+        grid = np.full((n_rows, merged.n_ages), np.nan)
+        offset = matrix.first_month - first_month
+        grid[offset:offset + len(matrix), :matrix.n_ages] = matrix.dense()
+        grids.append(grid)
+    expected = np.where(np.isnan(grids[0]) & np.isnan(grids[1]), np.nan,
+                        np.nan_to_num(grids[0]) + np.nan_to_num(grids[1]))
+    assert merged.first_month == first_month
+    np.testing.assert_allclose(merged.dense(), expected)
+    np.testing.assert_allclose(merged.dense(), right.merge(left).dense())
@@ -0,0 +1,34 @@
+'''
+Intervalos del tiempo de conversión de `analitica.conversion` comparados con `pd.cut`.
+'''
+import numpy as np
+import pandas as pd
+
+from analitica.conversion import CONVERSION_BINS, CONVERSION_LABELS, latency_bins
+
+
+def _cut_codes(days):
+    # el cálculo del cuaderno original: intervalos cerrados por la derecha
+    return pd.cut(days, bins=CONVERSION_BINS, labels=CONVERSION_LABELS).codes
+
+
+def test_latency_bins_on_edges():
+    # cada límite, sus vecinos enteros y valores fuera de los intervalos
+    edges = np.asarray(CONVERSION_BINS, dtype=np.int64)
+    days = np.unique(np.concatenate([edges - 1, edges, edges + 1, [-1000, 0, 361, 10_000]]))
+    codes = latency_bins(days)
+    np.testing.assert_array_equal(codes, _cut_codes(days))
+    # 0 días es 'Conversion 0d', el intervalo (-1, 0]; -1 queda fuera
+    assert CONVERSION_LABELS[codes[days == 0][0]] == 'Conversion 0d'
+    assert codes[days == -1][0] == -1
+    assert CONVERSION_LABELS[codes[days == 360][0]] == 'Conversion 12m'
+
+
+def test_latency_bins_on_fractions_and_missing():
+    days = np.array([-1.5, -0.5, 0.0, 0.5, 1.0, 6.5, 7.0, 359.5, 360.0, 360.5, np.nan])
+    np.testing.assert_array_equal(latency_bins(days), _cut_codes(days))
+
+
+def test_latency_bins_random():
+    days = np.random.default_rng(0).integers(-5, 400, size=10_000)
+    np.testing.assert_array_equal(latency_bins(days), _cut_codes(days))
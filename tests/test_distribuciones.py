@@ -0,0 +1,61 @@
+'''
+Sketch de cuantiles KLL de `analitica.distribuciones` comparado con los cuantiles exactos.
+'''
+import numpy as np
+import pytest
+
+from analitica.distribuciones import KLLSketch
+
+QUANTILES = np.linspace(0, 1, 101)
+
+
+def _rank_error(sketch, values):
+    # diferencia máxima entre el rango pedido y el rango real del valor devuelto
+    ordered = np.sort(values)
+    ranks = np.searchsorted(ordered, sketch.quantile(QUANTILES), side='right') / len(values)
+    return np.abs(ranks - QUANTILES).max()
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_quantiles_within_error(seed):
+    rng = np.random.default_rng(seed)
+    values = rng.lognormal(2.0, 1.0, size=200_000)
+    sketch = KLLSketch(k=200, seed=seed)
+    for block in np.array_split(values, 40):
+        sketch.update(block)
+    assert sketch.n == len(values)
+    assert _rank_error(sketch, values) < 3 / sketch.k
+    # el sketch guarda O(k log(n / k)) elementos, no los n valores
+    assert sum(len(items) for items in sketch.levels) < 10 * sketch.k
+
+
+def test_merge_within_error():
+    rng = np.random.default_rng(7)
+    parts = [rng.exponential(600, size=50_000) for _ in range(4)]
+    sketches = []
+    for seed, part in enumerate(parts):
+        sketch = KLLSketch(k=200, seed=seed)
+        sketch.update(part)
+        sketches.append(sketch)
+    merged = sketches[0]
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+    values = np.concatenate(parts)
+    assert merged.n == len(values)
+    assert _rank_error(merged, values) < 3 / merged.k
+
+
+def test_small_input_is_exact():
+    values = np.arange(100, dtype=np.float64)
+    sketch = KLLSketch(k=200)
+    sketch.update(values[::-1])
+    assert sketch.quantile(0.0) == 0.0
+    assert sketch.quantile(1.0) == 99.0
+    assert sketch.quantile(0.5) == 49.0
+
+
+def test_empty_sketch_returns_nan():
+    sketch = KLLSketch()
+    assert np.isnan(sketch.quantile(0.5))
+    assert np.isnan(sketch.quantile([0.25, 0.75])).all()
+    assert sketch.quantile([0.25, 0.75]).shape == (2,)
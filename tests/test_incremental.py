@@ -0,0 +1,71 @@
+'''
+Modo incremental de `analitica.incremental` sobre particiones de datos sintéticos,
+comparado con el análisis completo de `analitica.pipeline`.
+'''
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from analitica import incremental, particiones, pipeline
+from benchmarks.sinteticos import write_dataset
+
+OUTPUTS = ['report', 'result', 'report_with_costs', 'cac_by_source', 'result_romi']
+
+
+@pytest.fixture(scope='module')
+def paths(tmp_path_factory):
+    return write_dataset(str(tmp_path_factory.mktemp('datos')), 20_000, seed=5)
+
+
+@pytest.fixture(scope='module')
+def expected(paths):
+    return pipeline.run(paths['visits_log_us'], paths['orders_log_us'], paths['costs_us'],
+                        cache_dir=None, outputs=OUTPUTS)
+
+
+def _check(tables, expected):
+    for name in OUTPUTS:
+        if isinstance(expected[name], pd.DataFrame):
+            pd.testing.assert_frame_equal(tables[name], expected[name], check_dtype=False)
+        else:
+            pd.testing.assert_series_equal(tables[name], expected[name], check_dtype=False)
+
+
+@pytest.mark.parametrize('fmt', [None, 'csv'])
+def test_update_reads_write_partitions_output(paths, expected, tmp_path, fmt):
+    # con fmt=None, el formato por omisión de write_partitions() (Parquet si hay pyarrow)
+    root = str(tmp_path / 'particiones')
+    names = set()
+    for table, path in paths.items():
+        names.update(particiones.write_partitions(path, root, table, fmt=fmt))
+    state = incremental.update(str(tmp_path / 'estado.npz'), root)
+    assert state.partitions == names
+    _check(state.tables(), expected)
+
+
+def test_update_in_two_steps(paths, expected, tmp_path):
+    # particiones CSV sin manifiesto, la segunda mitad copiada después de la primera actualización
+    written = str(tmp_path / 'escritas')
+    root = str(tmp_path / 'particiones')
+    state_path = str(tmp_path / 'estado.npz')
+    names = set()
+    for table, path in paths.items():
+        names.update(particiones.write_partitions(path, written, table, fmt='csv'))
+        os.makedirs(os.path.join(root, table))
+    for step in ('2017-12', '2099-12'):
+        for table in paths:
+            for filename in os.listdir(os.path.join(written, table)):
+                if filename.endswith('.csv') and filename[:7] <= step:
+                    shutil.copy(os.path.join(written, table, filename), os.path.join(root, table, filename))
+        state = incremental.update(state_path, root)
+    assert state.partitions == names
+    _check(state.tables(), expected)
+
+
+def test_tables_without_orders(tmp_path):
+    state = incremental.update(str(tmp_path / 'estado.npz'), str(tmp_path / 'vacío'))
+    assert not state.partitions
+    with pytest.raises(ValueError, match='no tiene pedidos'):
+        state.tables()
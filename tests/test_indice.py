@@ -0,0 +1,93 @@
+'''
+Índice de primeros contactos de `analitica.indice` comparado con el mínimo por `uid` de
+todas las filas.
+'''
+import numpy as np
+import pandas as pd
+
+from analitica.indice import FIELDS, FirstTouchIndex
+
+
+def _visit_blocks(n_blocks=12, seed=0):
+    # bloques con uid que se repiten entre bloques y horas en cualquier orden
+    rng = np.random.default_rng(seed)
+    blocks = []
+    for block in range(n_blocks):
+        size = int(rng.integers(50, 400))
+        # cada bloque mezcla uid ya vistos con uid nuevos, de tamaños distintos para formar varios tramos
+        uids = rng.integers(0, 100 * (block + 1), size=size).astype(np.uint64) * np.uint64(7919)
+        start = pd.Timestamp('2017-06-01') + pd.to_timedelta(rng.integers(0, 365 * 86_400, size=size), unit='s')
+        blocks.append(pd.DataFrame({'uid': uids, 'start_ts': start,
+                                    'source_id': rng.integers(1, 11, size=size),
+                                    'device': rng.choice(['desktop', 'touch'], size=size)}))
+    return blocks
+
+
+def _expected(visits):
+    # primera fila de cada uid (entre filas a la misma hora, la primera)
+    first = visits.sort_values(['uid', 'start_ts'], kind='stable').groupby('uid').head(1)
+    return first.set_index('uid').sort_index()
+
+
+def test_overlapping_blocks_keep_earliest_touch():
+    blocks = _visit_blocks()
+    index = FirstTouchIndex()
+    n_runs = []
+    for block in blocks:
+        index.add_visits(block['uid'], block['start_ts'], block['source_id'], block['device'])
+        n_runs.append(len(index._runs))
+        # los tramos tienen uid distintos y cada tramo es al menos el doble del siguiente
+        sizes = [len(run['uids']) for run in index._runs]
+        assert all(previous >= 2 * last for previous, last in zip(sizes, sizes[1:]))
+    assert max(n_runs) > 1
+    expected = _expected(pd.concat(blocks, ignore_index=True))
+    uids = expected.index.to_numpy(dtype=np.uint64)
+    # antes de compactar (búsqueda por tramos) y después (un solo tramo)
+    for _ in range(2):
+        assert len(index) == len(expected)
+        np.testing.assert_array_equal(index.lookup(uids, 'first_session_ts'),
+                                      expected['start_ts'].to_numpy(dtype='datetime64[ns]').view(np.int64))
+        np.testing.assert_array_equal(index.lookup(uids, 'first_source_id'), expected['source_id'])
+        devices = np.asarray(index.devices)[index.lookup(uids, 'first_device')]
+        np.testing.assert_array_equal(devices, expected['device'])
+        np.testing.assert_array_equal(index.uids, uids)
+    assert len(index._runs) == 1
+
+
+def test_blocks_in_any_order_and_orders():
+    blocks = _visit_blocks(seed=1)
+    forward, backward = FirstTouchIndex(), FirstTouchIndex()
+    for block in blocks:
+        forward.add_visits(block['uid'], block['start_ts'], block['source_id'], block['device'])
+    for block in blocks[::-1]:
+        backward.add_visits(block['uid'], block['start_ts'], block['source_id'], block['device'])
+    for name in ('first_session_ts', 'first_source_id'):
+        np.testing.assert_array_equal(forward.columns[name], backward.columns[name])
+
+    # pedidos de una parte de los/las usuarios/as, en dos bloques que se cruzan
+    rng = np.random.default_rng(2)
+    uids = rng.choice(forward.uids, size=600)
+    buy = pd.Timestamp('2017-07-01') + pd.to_timedelta(rng.integers(0, 300 * 86_400, size=600), unit='s')
+    revenue = rng.random(600)
+    for part in (slice(0, 350), slice(250, 600)):
+        new = forward.add_orders(uids[part], buy[part], revenue[part])
+        assert len(new) == 0
+    orders = pd.DataFrame({'uid': uids, 'start_ts': buy, 'revenue': revenue})
+    # las filas 250-349 se procesan dos veces; no cambian el primer pedido
+    expected = _expected(orders)
+    found = expected.index.to_numpy(dtype=np.uint64)
+    np.testing.assert_array_equal(forward.lookup(found, 'first_order_ts'),
+                                  expected['start_ts'].to_numpy(dtype='datetime64[ns]').view(np.int64))
+    np.testing.assert_array_equal(forward.lookup(found, 'first_order_revenue'), expected['revenue'])
+    missing = np.setdiff1d(forward.uids, found)
+    assert (forward.lookup(missing, 'first_order_ts') == FIELDS['first_order_ts'][1]).all()
+
+
+def test_save_and_load(tmp_path):
+    index = FirstTouchIndex()
+    for block in _visit_blocks(n_blocks=5, seed=3):
+        index.add_visits(block['uid'], block['start_ts'], block['source_id'], block['device'])
+    path = str(tmp_path / 'primeros.npz')
+    index.save(path)
+    loaded = FirstTouchIndex.load(path)
+    pd.testing.assert_frame_equal(loaded.frame(), index.frame())
@@ -0,0 +1,66 @@
+'''
+Retención de `analitica.retencion` comparada con un `groupby` sobre las visitas.
+'''
+import numpy as np
+import pandas as pd
+
+from analitica.retencion import retention
+
+
+def _visits(n=5_000, n_users=400, seed=0):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2017-06-01') + pd.to_timedelta(rng.integers(0, 365 * 86_400, size=n), unit='s')
+    return pd.DataFrame({'start_ts': start,
+                         'device': rng.choice(['desktop', 'touch'], size=n),
+                         'uid': rng.integers(0, n_users, size=n)})
+
+
+def _naive(visits, by=None):
+    # cohorte (mes de la primera sesión) y edad de cada visita; usuarios/as distintos/as por celda
+    visits = visits.assign(month=visits['start_ts'].dt.to_period('M'))
+    first = visits.sort_values('start_ts', kind='stable').groupby('uid').head(1).set_index('uid')
+    visits['first_session_month'] = visits['uid'].map(first['month'])
+    visits['age'] = (visits['month'] - visits['first_session_month']).apply(lambda offset: offset.n)
+    keys = ['first_session_month', 'age']
+    if by is not None:
+        visits[by] = visits['uid'].map(first[by])
+        keys = [by] + keys
+    table = visits.groupby(keys)['uid'].nunique().unstack('age', fill_value=0).astype(np.float64)
+    last = visits['month'].max()
+    for cohort in table.index.get_level_values('first_session_month').unique():
+        # las edades que la cohorte todavía no alcanza quedan en NaN
+        table.loc[table.index.get_level_values('first_session_month') == cohort,
+                  table.columns > (last - cohort).n] = np.nan
+    return table
+
+
+def _check(result, expected):
+    actual = result['retention']
+    assert actual.shape == expected.shape
+    np.testing.assert_array_equal(actual.to_numpy(), expected.to_numpy())
+    np.testing.assert_allclose(result['retention_rate'].to_numpy(),
+                               expected.div(expected[0], axis=0).to_numpy())
+
+
+def test_retention_matches_groupby():
+    visits = _visits()
+    codes = visits['uid'].to_numpy()
+    result = retention(visits, codes, codes.max() + 1)
+    expected = _naive(visits)
+    _check(result, expected)
+    assert result['retention'].index.tolist() == [month.start_time for month in expected.index]
+
+
+def test_retention_by_device_matches_groupby():
+    visits = _visits(seed=1)
+    codes = visits['uid'].to_numpy()
+    result = retention(visits, codes, codes.max() + 1, by='device')
+    _check(result, _naive(visits, by='device'))
+
+
+def test_retention_without_visits():
+    visits = _visits().iloc[:0]
+    for by in (None, 'device'):
+        result = retention(visits, visits['uid'].to_numpy(), 0, by=by)
+        assert result['retention'].empty and result['retention_rate'].empty
+        assert result['retention'].index.names[-1] == 'first_session_month'